@@ -10,15 +10,24 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Algotrader.settings')
+# Set up Django before the consumers are imported
+django_asgi_application = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from algotraderapp import routing  # Replace 'your_app' with the actual app name where routing.py is located
+from algotraderapp import log_channels, views
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Algotrader.settings')
+# Queued channel logging of the server process
+log_channels.setup()
+# Unique trade configuration indexes, duplicate tokens stop the server here instead of on a later write
+views.trade_configurations.ensure_indexes()
 
 # Define the ASGI application
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),  # Handle HTTP requests
+    "http": django_asgi_application,  # Handle HTTP requests
     "websocket":URLRouter(
             routing.websocket_urlpatterns  # Add your WebSocket URL patterns
         )
@@ -73,7 +73,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Algotrader.wsgi.application'
-#ASGI_APPLICATION = 'Algotrader.asgi.application'
+ASGI_APPLICATION = 'Algotrader.asgi.application'
 
 CORS_ALLOW_ALL_ORIGINS = True
 
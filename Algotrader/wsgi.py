@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Algotrader.settings')
 
 application = get_wsgi_application()
+
+from algotraderapp import log_channels, views
+
+# Queued channel logging of the server process
+log_channels.setup()
+# Unique trade configuration indexes, duplicate tokens stop the server here instead of on a later write
+views.trade_configurations.ensure_indexes()
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import logging
+import datetime
+import itertools
+import tempfile
+import contextlib
+from . import candle_time
+from . import log_channels
+from . import tick_recorder
+from .run_script import WebSocketHandler
+from .product_setting import CANDLE_CLOCK, TICK_CONFLATION, CANDLE_CLOSE_TIMER
+
+# Tick fields KiteTicker delivers as datetimes, recorded as strings
+TICK_DATETIME_FIELDS = ('exchange_timestamp', 'last_trade_time', 'timestamp')
+
+
+class SimulatedClock:
+    """ Stand-in for datetime.now, set to the recorded arrival time of every batch. """
+
+    def __init__(self, start=None):
+        self.current = start
+
+    def set(self, value):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=candle_time.IST)
+        self.current = value
+
+    def __call__(self):
+        return self.current
+
+
+class SimulatedBroker:
+    """
+    KiteConnect stand-in for backtests.
+
+    Market orders fill completely at the latest recorded price of the
+    symbol, moved against the order by slippage points. Orders for a
+    symbol that has not traded yet are rejected. orders(), order_history()
+    and positions() answer in the KiteConnect format, so the order book and
+    P&L code run unchanged.
+    """
+
+    VARIETY_REGULAR = 'regular'
+    TRANSACTION_TYPE_BUY = 'BUY'
+    TRANSACTION_TYPE_SELL = 'SELL'
+    ORDER_TYPE_MARKET = 'MARKET'
+    PRODUCT_MIS = 'MIS'
+
+    def __init__(self, clock, slippage=0.0):
+        self.api_key = 'backtest'
+        self.access_token = None
+        self.clock = clock
+        self.slippage = slippage
+        self.prices = {}  # tradingsymbol -> last recorded price
+        self._orders = []
+        self._order_ids = itertools.count(1)
+
+    def set_price(self, tradingsymbol, price):
+        self.prices[tradingsymbol] = price
+
+    def set_access_token(self, access_token):
+        self.access_token = access_token
+
+    def place_order(self, variety, exchange, tradingsymbol, transaction_type, quantity, order_type, product, **kwargs):
+        order_id = f"BT{next(self._order_ids):08d}"
+        price = self.prices.get(tradingsymbol)
+        order = {
+            'order_id': order_id,
+            'exchange': exchange,
+            'tradingsymbol': tradingsymbol,
+            'transaction_type': transaction_type,
+            'quantity': quantity,
+            'order_type': order_type,
+            'product': product,
+            'variety': variety,
+            # Kite reports naive IST timestamps
+            'order_timestamp': self.clock().replace(tzinfo=None, microsecond=0),
+        }
+        if price is None:
+            order.update(status='REJECTED', status_message='No price for the symbol yet', filled_quantity=0, average_price=0)
+        else:
+            slippage = self.slippage if transaction_type == self.TRANSACTION_TYPE_BUY else -self.slippage
+            order.update(status='COMPLETE', filled_quantity=quantity, average_price=price + slippage)
+        self._orders.append(order)
+        return order_id
+
+    def orders(self):
+        return [dict(order) for order in self._orders]
+
+    def order_history(self, order_id):
+        return [dict(order) for order in self._orders if order['order_id'] == order_id]
+
+    def positions(self):
+        net = {}
+        for order in self._orders:
+            if order['status'] != 'COMPLETE':
+                continue
+            signed_quantity = order['filled_quantity'] if order['transaction_type'] == self.TRANSACTION_TYPE_BUY else -order['filled_quantity']
+            net[order['tradingsymbol']] = net.get(order['tradingsymbol'], 0) + signed_quantity
+        positions = [{'tradingsymbol': tradingsymbol, 'quantity': quantity} for tradingsymbol, quantity in net.items()]
+        return {'net': positions, 'day': positions}
+
+
+class BacktestResult:
+    """ Trades and P&L of a backtest run. """
+
+    def __init__(self, trades, group_pnl, symbol_pnl, batches, ticks, elapsed, simulated_seconds):
+        self.trades = trades
+        self.group_pnl = group_pnl  # exit_trades_threshold_points -> P/L per share of the group
+        self.symbol_pnl = symbol_pnl  # tradingsymbol -> P/L per share
+        self.batches = batches
+        self.ticks = ticks
+        self.elapsed = elapsed
+        self.simulated_seconds = simulated_seconds
+
+    def to_dict(self):
+        return {
+            'trades': self.trades,
+            'group_pnl': self.group_pnl,
+            'symbol_pnl': self.symbol_pnl,
+            'batches': self.batches,
+            'ticks': self.ticks,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'simulated_seconds': self.simulated_seconds,
+            'speedup': round(self.simulated_seconds / self.elapsed, 1) if self.elapsed else None,
+        }
+
+
+def _parse_datetime(value):
+    return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def read_tick_batches(path):
+    """
+    Read recorded tick batches from a JSON lines file.
+
+    Every line is {"received_at": "...", "ticks": [...]}, one KiteTicker
+    on_ticks call. A line holding a single tick is read as a batch of one.
+    Datetimes are ISO strings; without received_at the latest
+    exchange_timestamp of the batch is used as the arrival time. Binary
+    segments of the tick recorder, or its directory, are read as well.
+
+    The path is resolved right away, run_backtest changes the working
+    directory before the batches are read.
+
+    Returns:
+    - iterator: (received_at datetime, list of tick dicts) pairs
+    """
+    path = os.path.abspath(path)
+    if os.path.isdir(path) or tick_recorder.is_segment(path):
+        return tick_recorder.read_tick_batches(path)
+    return _read_json_batches(path)
+
+
+def _read_json_batches(path):
+    with open(path, 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            ticks = record['ticks'] if 'ticks' in record else [record]
+            for tick in ticks:
+                for field in TICK_DATETIME_FIELDS:
+                    if tick.get(field):
+                        tick[field] = _parse_datetime(tick[field])
+            received_at = _parse_datetime(record.get('received_at'))
+            if received_at is None:
+                exchange_timestamps = [tick['exchange_timestamp'] for tick in ticks if tick.get('exchange_timestamp')]
+                if not exchange_timestamps:
+                    logging.warning(f"Skipping tick batch without a time in {path}")
+                    continue
+                received_at = max(exchange_timestamps)
+            yield received_at, ticks
+
+
+@contextlib.contextmanager
+def sandbox(workdir=None, quiet=True):
+    """
+    Run engine code in workdir (a new temporary directory by default) so the
+    candle journals and P&L files it writes never touch the live session's,
+    with the tick, strategy, order and P&L channels at WARNING when quiet.
+    The working directory and the channel levels are process wide.
+
+    Yields:
+    - str: The working directory.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='algotrader-backtest-')
+    previous_cwd = os.getcwd()
+    previous_levels = {channel: log_channels.get_logger(channel).level for channel in log_channels.CHANNELS}
+    if quiet:
+        for channel in log_channels.CHANNELS:
+            log_channels.set_level(channel, logging.WARNING)
+    try:
+        os.makedirs(workdir, exist_ok=True)
+        os.chdir(workdir)
+        yield workdir
+    finally:
+        os.chdir(previous_cwd)
+        for channel, level in previous_levels.items():
+            log_channels.set_level(channel, level)
+
+
+def close_journals(handler):
+    """ Release the candle journal files of a handler's aggregators. """
+    for candle_aggregator in handler.candle_aggregators.values():
+        candle_aggregator.candle_journal.close()
+
+
+def run_backtest(instruments, tick_batches, candle_clock=CANDLE_CLOCK, tick_conflation=TICK_CONFLATION,
+                 candle_close_timer=CANDLE_CLOSE_TIMER, slippage=0.0, workdir=None, quiet=True, order_executor=True):
+    """
+    Replay recorded ticks through WebSocketHandler.on_ticks against a simulated broker and clock.
+
+    Ticks are processed inline, so a run is deterministic. With
+    order_executor, orders go through a synchronous OrderExecutor: the live
+    path's submit and apply_order_events flow, placed on the tick thread
+    without the broker round trip overlapping later ticks. Without it they
+    are placed inline as with ORDER_EXECUTOR_WORKERS = 0. Candle journals are written to workdir (a new temporary
+    directory by default) so live session files are never touched. With
+    quiet the tick, strategy, order and P&L channels only log warnings;
+    run backtests in their own process, the channels are process wide.
+
+    Parameters:
+    - instruments (list): tradeconfiguration documents, as stored in MongoDB.
+    - tick_batches (iterable): (received_at, ticks) pairs, see read_tick_batches.
+
+    Returns:
+    - BacktestResult
+    """
+    clock = SimulatedClock()
+    broker = SimulatedBroker(clock, slippage=slippage)
+    symbols_by_token = {int(x['instrument_token']): x['instrument_details']['tradingsymbol'] for x in instruments}
+    handler = None
+    batches = 0
+    tick_count = 0
+    first_time = None
+    started = time.perf_counter()
+    with sandbox(workdir, quiet):
+        try:
+            handler = WebSocketHandler(broker, instruments, candle_clock=candle_clock, tick_queue_shards=0,
+                                       tick_conflation=tick_conflation, order_executor_workers=0,
+                                       candle_close_timer=candle_close_timer, clock=clock, tick_recorder=False,
+                                       live_broadcast=False, synchronous_orders=order_executor)
+            handler.order_book.seed()
+
+            for received_at, ticks in tick_batches:
+                clock.set(received_at)
+                if first_time is None:
+                    first_time = clock.current
+                # Market orders of this batch fill at the latest price the batch brought
+                for tick in ticks:
+                    tradingsymbol = symbols_by_token.get(tick.get('instrument_token'))
+                    if tradingsymbol is not None and 'last_price' in tick:
+                        broker.set_price(tradingsymbol, tick['last_price'])
+                handler.on_ticks(None, ticks)
+                batches += 1
+                tick_count += len(ticks)
+        finally:
+            if handler is not None:
+                close_journals(handler)
+    elapsed = time.perf_counter() - started
+
+    trades = [{
+        'order_id': order['order_id'],
+        'time': str(order['order_timestamp']),
+        'tradingsymbol': order['tradingsymbol'],
+        'transaction_type': order['transaction_type'],
+        'quantity': order['quantity'],
+        'price': order['average_price'],
+        'status': order['status'],
+    } for order in broker.orders()]
+    group_pnl = {}
+    for runtime in handler.instrument_table.values():
+        if runtime.group_key is not None and str(runtime.group_key) not in group_pnl:
+            group_pnl[str(runtime.group_key)] = handler.group_pnl.group_total(runtime.group_key)
+    simulated_seconds = (clock.current - first_time).total_seconds() if first_time is not None else 0
+    return BacktestResult(trades, group_pnl, handler.group_pnl.snapshot(), batches, tick_count, elapsed, simulated_seconds)
@@ -0,0 +1,319 @@
+import sys
+import time
+import random
+import logging
+import datetime
+import platform
+from . import candle_time, log_channels
+from .backtest import SimulatedClock, SimulatedBroker, sandbox, close_journals
+from .candle_buffer import Candle
+from .candle_store import CandleJournal
+from .run_script import CandleAggregator, WebSocketHandler
+
+BENCHMARKS = ('process_tick', 'check_strategy', 'pnl', 'on_ticks')
+# Session start of the synthetic feed
+FEED_START = datetime.datetime(2024, 1, 1, 9, 15, tzinfo=candle_time.IST)
+# Thresholds far out of reach keep the P&L path from closing the day during a run
+UNREACHABLE_THRESHOLD = 10 ** 9
+
+
+def make_instruments(count, timeframe=1, trade_side='BOTH', percentage=0.1, exit_trades_threshold_points=UNREACHABLE_THRESHOLD):
+    """ tradeconfiguration documents for count synthetic instruments. """
+    return [{
+        'instrument_token': str(100000 + index),
+        'lot_size': '1',
+        'exit_trades_threshold_points': str(exit_trades_threshold_points),
+        'trade_calculation_percentage': str(percentage),
+        'timeframe': str(timeframe),
+        'trade_side': trade_side,
+        'instrument_details': {'tradingsymbol': f'BENCH{index}', 'exchange': 'NFO'},
+    } for index in range(count)]
+
+
+def synthetic_batches(instruments, rate=5, seconds=60, seed=1, start=FEED_START):
+    """
+    Generate KiteTicker style batches, one per second, in the backtest format.
+
+    Every instrument gets rate ticks per second on a random walk around
+    1000 + 10 * its index, so prices break out of the previous candles now
+    and then.
+
+    Returns:
+    - list: (received_at, ticks) pairs
+    """
+    generator = random.Random(seed)
+    prices = {int(x['instrument_token']): 1000.0 + 10 * index for index, x in enumerate(instruments)}
+    batches = []
+    for second in range(seconds):
+        received_at = start + datetime.timedelta(seconds=second, microseconds=generator.randint(0, 999999))
+        exchange_timestamp = received_at.replace(tzinfo=None, microsecond=0)
+        ticks = []
+        for _ in range(rate):
+            for instrument_token in prices:
+                price = round(prices[instrument_token] * (1 + generator.gauss(0, 0.0005)), 2)
+                prices[instrument_token] = price
+                ticks.append({
+                    'tradable': True,
+                    'mode': 'full',
+                    'instrument_token': instrument_token,
+                    'last_price': price,
+                    'last_traded_quantity': generator.randint(1, 100),
+                    'volume_traded': 0,
+                    'ohlc': {'open': 1000.0, 'high': 2000.0, 'low': 500.0, 'close': 1000.0},
+                    'exchange_timestamp': exchange_timestamp,
+                })
+        batches.append((received_at, ticks))
+    return batches
+
+
+def seed_history(instruments, history, start=FEED_START):
+    """ Write history closed candles before the feed start to every instrument's candle journal. """
+    for x in instruments:
+        interval = int(x['timeframe']) * 60
+        journal = CandleJournal(f"{int(x['instrument_token'])}_{int(x['timeframe'])}_minute_candles.json")
+        first_start = candle_time.to_epoch(start) - history * interval
+        for index in range(history):
+            price = 1000.0 + (index % 7)
+            journal.save(Candle(first_start + index * interval, price, price + 2, price - 2, price + 1, 100,
+                                2000.0, 500.0, True))
+        journal.close()
+
+
+class LatencySamples:
+    """ Per call latencies of one benchmark, in nanoseconds. """
+
+    def __init__(self):
+        self.samples = []
+        self.operations = 0
+        self.elapsed = 0
+
+    def add(self, nanoseconds, operations=1):
+        self.samples.append(nanoseconds)
+        self.operations += operations
+        self.elapsed += nanoseconds
+
+    def percentile(self, fraction):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0
+
+    def summary(self):
+        """ Percentiles in microseconds per call and operations per second. """
+        return {
+            'calls': len(self.samples),
+            'operations': self.operations,
+            'p50_us': round(self.percentile(0.50) / 1000, 3),
+            'p99_us': round(self.percentile(0.99) / 1000, 3),
+            'mean_us': round(self.elapsed / len(self.samples) / 1000, 3) if self.samples else 0,
+            'max_us': round(max(self.samples) / 1000, 3) if self.samples else 0,
+            'throughput_per_sec': round(self.operations / (self.elapsed / 1e9), 1) if self.elapsed else 0,
+        }
+
+
+def _stamp(batches):
+    """ Add the arrival fields on_ticks sets, for benchmarks that call the aggregator directly. """
+    for received_at, ticks in batches:
+        epoch = candle_time.to_epoch(received_at)
+        for tick in ticks:
+            tick['current_datetime'] = received_at
+            tick['epoch'] = epoch
+    return batches
+
+
+def _aggregators(instruments):
+    aggregators = {}
+    for x in instruments:
+        aggregators[int(x['instrument_token'])] = CandleAggregator(
+            int(x['instrument_token']), x['instrument_details']['tradingsymbol'], interval_minutes=int(x['timeframe']),
+            trade_side=x['trade_side'])
+    return aggregators
+
+
+def _handler(broker, clock_value, instruments, tick_conflation=False):
+    """ A WebSocketHandler running inline, its reload_config registers the threshold groups as live. """
+    handler = WebSocketHandler(broker, instruments, tick_queue_shards=0, tick_conflation=tick_conflation,
+                               order_executor_workers=0, candle_close_timer=False, clock=clock_value,
+                               tick_recorder=False, live_broadcast=False)
+    handler.order_book.seed()
+    return handler
+
+
+class ErrorRecords(logging.Handler):
+    """ Keeps the errors a channel logs, the engine logs and swallows failures on the tick path. """
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def bench_process_tick(instruments, batches):
+    """ Candle aggregation of every tick. """
+    aggregators = _aggregators(instruments)
+    samples = LatencySamples()
+    clock = time.perf_counter_ns
+    try:
+        for _, ticks in _stamp(batches):
+            for tick in ticks:
+                aggregator = aggregators[tick['instrument_token']]
+                started = clock()
+                aggregator.process_tick(tick)
+                samples.add(clock() - started)
+    finally:
+        for aggregator in aggregators.values():
+            aggregator.candle_journal.close()
+    return samples
+
+
+def bench_check_strategy(instruments, batches):
+    """ Breakout check on the latest candle after every tick. """
+    aggregators = _aggregators(instruments)
+    percentages = {int(x['instrument_token']): float(x['trade_calculation_percentage']) for x in instruments}
+    samples = LatencySamples()
+    clock = time.perf_counter_ns
+    try:
+        for _, ticks in _stamp(batches):
+            for tick in ticks:
+                instrument_token = tick['instrument_token']
+                aggregator = aggregators[instrument_token]
+                aggregator.process_tick(tick)
+                if aggregator.current_candle is None:
+                    continue
+                started = clock()
+                aggregator.check_strategy(instrument_token, percentages[instrument_token])
+                samples.add(clock() - started)
+    finally:
+        for aggregator in aggregators.values():
+            aggregator.candle_journal.close()
+    return samples
+
+
+def bench_pnl(instruments, batches, fills=20):
+    """ Daily P&L of every tick with fills booked in the order book, as process_ticks runs it. """
+    clock_value = SimulatedClock(FEED_START)
+    broker = SimulatedBroker(clock_value)
+    for x in instruments:
+        tradingsymbol = x['instrument_details']['tradingsymbol']
+        broker.set_price(tradingsymbol, 1000.0)
+        for index in range(fills):
+            transaction_type = broker.TRANSACTION_TYPE_BUY if index % 2 == 0 else broker.TRANSACTION_TYPE_SELL
+            broker.place_order(broker.VARIETY_REGULAR, 'NFO', tradingsymbol, transaction_type, 1,
+                               broker.ORDER_TYPE_MARKET, broker.PRODUCT_MIS)
+    handler = _handler(broker, clock_value, instruments)
+    # Raises KeyError here rather than on every timed call when a group is not registered
+    for runtime in handler.instrument_table.values():
+        handler.group_pnl.group_total(runtime.group_key)
+    errors = ErrorRecords()
+    pnl_logger = log_channels.get_logger('pnl')
+    pnl_logger.addHandler(errors)
+    samples = LatencySamples()
+    clock = time.perf_counter_ns
+    try:
+        for _, ticks in batches:
+            for tick in ticks:
+                runtime = handler.instrument_table[tick['instrument_token']]
+                started = clock()
+                runtime.aggregator.fetch_and_calculate_daily_profit_loss(
+                    broker, tick['last_price'], runtime.instrument_token, runtime.tradingsymbol, runtime.exchange,
+                    runtime.exit_trades_threshold_points, {}, runtime.lot_size, runtime.percentage)
+                samples.add(clock() - started)
+    finally:
+        pnl_logger.removeHandler(errors)
+        close_journals(handler)
+    # fetch_and_calculate_daily_profit_loss logs and returns 0 on errors, the timings of failed calls mean nothing
+    if errors.records:
+        raise RuntimeError(f"{len(errors.records)} timed P&L calls failed, first: {errors.records[0].getMessage()}")
+    return samples
+
+
+def bench_on_ticks(instruments, batches, tick_conflation=False):
+    """ The whole handler, per batch: candles, stop loss, P&L, strategy and inline simulated orders. """
+    clock_value = SimulatedClock()
+    broker = SimulatedBroker(clock_value)
+    handler = _handler(broker, clock_value, instruments, tick_conflation)
+    symbols_by_token = {int(x['instrument_token']): x['instrument_details']['tradingsymbol'] for x in instruments}
+    samples = LatencySamples()
+    clock = time.perf_counter_ns
+    try:
+        for received_at, ticks in batches:
+            clock_value.set(received_at)
+            # Market orders of this batch fill at the latest price the batch brought, as in run_backtest
+            for tick in ticks:
+                broker.set_price(symbols_by_token[tick['instrument_token']], tick['last_price'])
+            started = clock()
+            handler.on_ticks(None, ticks)
+            samples.add(clock() - started, operations=len(ticks))
+    finally:
+        close_journals(handler)
+    return samples
+
+
+def run_benchmarks(instrument_count=10, rate=5, seconds=60, history=100, timeframe=1, seed=1,
+                   benchmarks=BENCHMARKS, tick_conflation=False, workdir=None):
+    """
+    Run the hot path benchmarks on a synthetic feed in a scratch directory.
+
+    Each benchmark gets fresh aggregators over the same feed; candle
+    journals are seeded with history closed candles first, so load and
+    history size effects show up. The log channels are held at WARNING.
+
+    Returns:
+    - dict: 'environment', 'parameters' and per benchmark latency summaries
+      (see LatencySamples.summary), JSON serializable.
+    """
+    instruments = make_instruments(instrument_count, timeframe=timeframe)
+    parameters = {
+        'instruments': instrument_count,
+        'rate_per_instrument': rate,
+        'seconds': seconds,
+        'history': history,
+        'timeframe': timeframe,
+        'seed': seed,
+        'tick_conflation': tick_conflation,
+    }
+    runners = {
+        'process_tick': bench_process_tick,
+        'check_strategy': bench_check_strategy,
+        'pnl': bench_pnl,
+        'on_ticks': lambda instruments, batches: bench_on_ticks(instruments, batches, tick_conflation),
+    }
+    results = {}
+    for name in benchmarks:
+        if name not in runners:
+            raise ValueError(f"Unknown benchmark: {name}")
+        with sandbox(workdir, quiet=True):
+            seed_history(instruments, history)
+            # Ticks are mutated by the handler, every benchmark gets its own feed
+            batches = synthetic_batches(instruments, rate=rate, seconds=seconds, seed=seed)
+            results[name] = runners[name](instruments, batches).summary()
+    return {
+        'created_at': datetime.datetime.now(candle_time.IST).isoformat(timespec='seconds'),
+        'environment': {
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+        },
+        'parameters': parameters,
+        'results': results,
+    }
+
+
+def compare(baseline, current, tolerance=0.2, metrics=('p50_us', 'p99_us')):
+    """
+    Latency regressions of current against a baseline run.
+
+    Returns:
+    - list: (benchmark, metric, baseline value, current value) for every
+      metric more than tolerance (a fraction) slower than the baseline.
+    """
+    regressions = []
+    for name, summary in current['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        for metric in metrics:
+            if previous.get(metric) and summary[metric] > previous[metric] * (1 + tolerance):
+                regressions.append((name, metric, previous[metric], summary[metric]))
+    return regressions
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import threading
+from . import candle_time
+
+# Streams viewers can subscribe to; ticks and candles have one channel layer group per instrument token
+TICKS = 'ticks'
+CANDLES = 'candles'
+SIGNALS = 'signals'
+PNL = 'pnl'
+STREAMS = (TICKS, CANDLES, SIGNALS, PNL)
+INSTRUMENT_STREAMS = (TICKS, CANDLES)
+# Channel layer message type, handled by ZerodhaWebSocketConsumer.broadcast_update
+MESSAGE_TYPE = 'broadcast.update'
+# Tick fields forwarded to viewers
+TICK_FIELDS = ('last_price', 'last_traded_quantity', 'volume_traded', 'change', 'ohlc')
+
+
+def group_name(stream, instrument_token=None):
+    """ Channel layer group of a stream, per instrument for INSTRUMENT_STREAMS. """
+    if stream in INSTRUMENT_STREAMS:
+        return f"{stream}.{int(instrument_token)}"
+    return stream
+
+
+def tick_payload(tick):
+    payload = {field: tick[field] for field in TICK_FIELDS if field in tick}
+    payload['instrument_token'] = tick['instrument_token']
+    if tick.get('exchange_timestamp'):
+        payload['exchange_timestamp'] = str(tick['exchange_timestamp'])
+    return payload
+
+
+def candle_payload(instrument_token, candle):
+    payload = candle.to_dict()
+    payload['instrument_token'] = instrument_token
+    return payload
+
+
+def update(stream, key, data, base=None, conflate=True):
+    """
+    A channel layer message for viewers.
+
+    Viewers keep only the latest data per (stream, key) until they send
+    (conflate), and encode deltas against the last data sent for
+    (stream, base). Signals are not conflated and not delta encoded.
+    """
+    return {'type': MESSAGE_TYPE, 'stream': stream, 'key': key, 'base': base if base is not None else key,
+            'data': data, 'conflate': conflate}
+
+
+class LiveBroadcaster:
+    """
+    Publishes the engine's ticks, candles, signals and threshold group P&L
+    to channel layer groups for the live viewers.
+
+    The tick thread only keeps the latest tick per instrument and queues
+    signals. A background thread with its own event loop sends what changed
+    every interval seconds, so the channel layer gets at most one tick and
+    one candle update per instrument per interval however fast the feed is,
+    and viewers never open a broker connection of their own.
+
+    Parameters:
+    - candle_history: instrument_token -> CandleHistory, None for unknown tokens.
+    - group_totals: () -> {group key: total}.
+    """
+
+    def __init__(self, candle_history, group_totals, interval=0.25, channel_layer=None):
+        self.candle_history = candle_history
+        self.group_totals = group_totals
+        self.interval = interval
+        self.channel_layer = channel_layer
+        self._lock = threading.Lock()
+        self._ticks = {}  # instrument_token -> latest tick since the last flush
+        self._signals = []
+        self._candle_starts = {}  # instrument_token -> start of the candle last sent
+        self._last_totals = {}  # group key -> total last sent
+        self._signal_sequence = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_error = None
+        self.flushes = 0
+        self.messages_sent = 0
+        self.failed_messages = 0
+
+    def publish_ticks(self, ticks):
+        """ Keep the latest tick of every instrument in the batch, called on the tick path. """
+        with self._lock:
+            latest = self._ticks
+            for tick in ticks:
+                if 'last_price' in tick:
+                    latest[tick['instrument_token']] = tick
+
+    def publish_signal(self, aggregator, signal):
+        """ Queue an order signal, registered as a CandleAggregator signal listener. """
+        signal = dict(signal, time=candle_time.ist_now().isoformat(timespec='milliseconds'))
+        with self._lock:
+            self._signal_sequence += 1
+            self._signals.append((self._signal_sequence, signal))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="live-broadcast", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the sender after a last flush. """
+        self._stop_event.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def collect(self):
+        """ Channel layer (group, message) pairs of everything that changed since the last call. """
+        with self._lock:
+            ticks, self._ticks = self._ticks, {}
+            signals, self._signals = self._signals, []
+        messages = []
+        for instrument_token, tick in ticks.items():
+            messages.append((group_name(TICKS, instrument_token),
+                             update(TICKS, str(instrument_token), tick_payload(tick))))
+            messages.extend(self._candle_messages(instrument_token))
+        for sequence, signal in signals:
+            messages.append((group_name(SIGNALS), update(SIGNALS, str(sequence), signal, conflate=False)))
+        # One update per group: shards publish only the groups of their instruments, so
+        # a shared key would let one shard's totals replace another's
+        for group_key, total in self.group_totals().items():
+            if self._last_totals.get(group_key) != total:
+                self._last_totals[group_key] = total
+                messages.append((group_name(PNL), update(PNL, str(group_key), {'group': str(group_key), 'total': total})))
+        return messages
+
+    def _candle_messages(self, instrument_token):
+        history = self.candle_history(instrument_token)
+        if history is None or not len(history):
+            return []
+        group = group_name(CANDLES, instrument_token)
+        base = str(instrument_token)
+        latest = history[-1]
+        messages = []
+        previous_start = self._candle_starts.get(instrument_token)
+        if previous_start is not None and previous_start != latest.start:
+            # The candle sent last time closed since, send its final state before the new one
+            for back in range(2, history.retained() + 1):
+                try:
+                    candle = history[-back]
+                except IndexError:
+                    # The ring moved on while reading
+                    break
+                if candle.start <= previous_start:
+                    if candle.start == previous_start:
+                        messages.append((group, update(CANDLES, f"{base}:{candle.start}",
+                                                       candle_payload(instrument_token, candle), base=base)))
+                    break
+        self._candle_starts[instrument_token] = latest.start
+        messages.append((group, update(CANDLES, f"{base}:{latest.start}", candle_payload(instrument_token, latest), base=base)))
+        return messages
+
+    async def _send(self, messages):
+        for group, message in messages:
+            await self.channel_layer.group_send(group, message)
+
+    def _run(self):
+        if self.channel_layer is None:
+            from channels.layers import get_channel_layer
+            self.channel_layer = get_channel_layer()
+            if self.channel_layer is None:
+                logging.warning("No channel layer configured, live broadcast is off")
+                return
+        # One loop for the life of the thread, the channel layer keeps its connections per loop
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                stopping = self._stop_event.wait(self.interval)
+                self.flush(loop)
+                if stopping:
+                    break
+        finally:
+            loop.close()
+
+    def flush(self, loop):
+        self.flushes += 1
+        messages = []
+        try:
+            messages = self.collect()
+            if messages:
+                loop.run_until_complete(self._send(messages))
+                self.messages_sent += len(messages)
+            self._last_error = None
+        except Exception as error:
+            self.failed_messages += len(messages)
+            # Log once per distinct failure, a down channel layer fails every flush
+            if str(error) != self._last_error:
+                logging.error(f"Live broadcast failed: {error}")
+            self._last_error = str(error)
+
+    def metrics(self):
+        return {
+            'running': self._thread is not None,
+            'interval': self.interval,
+            'flushes': self.flushes,
+            'messages_sent': self.messages_sent,
+            'failed_messages': self.failed_messages,
+            'last_error': self._last_error,
+        }
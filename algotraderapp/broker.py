@@ -0,0 +1,227 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+import contextlib
+import functools
+from concurrent.futures import Future
+from kiteconnect import KiteConnect
+
+# Request priorities, lower runs first when a rate limit is saturated
+EXIT = 0  # Square off and stop-loss orders
+ENTRY = 1  # New positions
+POLL = 2  # Order book and position polling
+BULK = 3  # Instrument downloads and other bulk reads
+
+# Token buckets per endpoint class: (requests per second, burst). Kite allows
+# 10 order requests/s, 1 quote request/s, 3 historical requests/s and 10/s for the rest.
+RATE_LIMITS = {
+    'order': (10, 10),
+    'quote': (1, 1),
+    'historical': (3, 3),
+    'default': (10, 10),
+}
+ENDPOINT_CLASSES = {
+    'place_order': 'order',
+    'modify_order': 'order',
+    'cancel_order': 'order',
+    'exit_order': 'order',
+    'quote': 'quote',
+    'ohlc': 'quote',
+    'ltp': 'quote',
+    'historical_data': 'historical',
+}
+DEFAULT_PRIORITIES = {
+    'place_order': ENTRY,
+    'modify_order': ENTRY,
+    'cancel_order': EXIT,
+    'exit_order': EXIT,
+    'instruments': BULK,
+    'mf_instruments': BULK,
+}
+# Read-only calls where concurrent identical requests share one round trip
+COALESCED = ('orders', 'positions', 'holdings', 'trades', 'order_history')
+# KiteConnect methods that do not hit the API
+LOCAL_METHODS = ('set_access_token', 'set_session_expiry_hook', 'login_url')
+# Order modes that close or flip a position after a stop-loss or threshold hit
+EXIT_ORDER_MODES = ("Square OFF", "Reverse Mode", "Final Square Off")
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def request_priority(priority):
+    """ Run the broker calls made by this thread inside the block at the given priority. """
+    previous_priority = getattr(_local, 'priority', None)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous_priority
+
+
+def order_priority(order_mode):
+    return EXIT if order_mode in EXIT_ORDER_MODES else ENTRY
+
+
+def split_rate_limits(shares, rate_limits=None):
+    """
+    Split the rate limits between clients sharing one API key.
+
+    Every client gets its share of the rate, and of the burst with at least
+    one request, so together they stay under the key's limits.
+    """
+    return {endpoint_class: (rate / shares, max(1, burst / shares))
+            for endpoint_class, (rate, burst) in (rate_limits or RATE_LIMITS).items()}
+
+
+class TokenBucket:
+    """
+    Token bucket whose waiters are served by priority, then arrival order.
+
+    The caller's own thread waits for a token, so there is no dispatcher
+    thread; a waiter only takes a token when it is at the head of the queue.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._waiters = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority):
+        """ Block until a token is available for this caller, return the seconds waited. """
+        started = time.monotonic()
+        with self._condition:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] == entry and self.tokens >= 1:
+                        self.tokens -= 1
+                        heapq.heappop(self._waiters)
+                        self._condition.notify_all()
+                        return time.monotonic() - started
+                    # Sleep until the next token, or until the head of the queue changes
+                    self._condition.wait((1 - self.tokens) / self.rate if self.tokens < 1 else None)
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._condition.notify_all()
+                raise
+
+    def penalize(self, seconds):
+        """ Back off after the broker rejected a request for exceeding its limit. """
+        with self._condition:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def waiting(self):
+        return len(self._waiters)
+
+
+class BrokerClient:
+    """
+    Thread-safe KiteConnect wrapper shared by the views, the order book and the executor.
+
+    - Keep-alive connections from a pooled requests session.
+    - Per endpoint class token buckets so bursts stay under Kite's limits.
+    - Priority: when a bucket is empty, exits are served before entries,
+      polling and downloads. Set with `with request_priority(EXIT):`.
+    - Identical concurrent orders()/positions() style reads share one
+      request; callers get the same result object and must not mutate it.
+
+    Everything else (constants, api_key, login_url, ...) is delegated to
+    the wrapped KiteConnect, so it can be used wherever a KiteConnect is.
+    """
+
+    def __init__(self, api_key, access_token=None, pool_size=10, timeout=None, rate_limits=None, max_retries=2):
+        self.kite = KiteConnect(api_key=api_key, access_token=access_token, timeout=timeout,
+                                pool={'pool_connections': pool_size, 'pool_maxsize': pool_size, 'max_retries': 0})
+        self.max_retries = max_retries
+        self._buckets = {endpoint_class: TokenBucket(rate, burst)
+                         for endpoint_class, (rate, burst) in (rate_limits or RATE_LIMITS).items()}
+        self._inflight = {}  # (method, args) -> Future of the leading request
+        self._inflight_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.coalesced = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.kite, name)
+        if name.startswith('_') or name in LOCAL_METHODS or not callable(attribute):
+            return attribute
+        return functools.partial(self._call, name, attribute)
+
+    def _call(self, name, method, *args, **kwargs):
+        priority = getattr(_local, 'priority', None)
+        if priority is None:
+            priority = DEFAULT_PRIORITIES.get(name, POLL)
+        if name in COALESCED and not kwargs:
+            return self._coalesce((name,) + args, lambda: self._send(name, method, priority, args, kwargs))
+        return self._send(name, method, priority, args, kwargs)
+
+    def _send(self, name, method, priority, args, kwargs):
+        bucket = self._buckets.get(ENDPOINT_CLASSES.get(name, 'default'), self._buckets['default'])
+        attempt = 0
+        while True:
+            waited = bucket.acquire(priority)
+            with self._stats_lock:
+                self.requests += 1
+                self.wait_seconds += waited
+            try:
+                return method(*args, **kwargs)
+            except Exception as error:
+                # A 429 is rejected before the broker acts on it, so retrying is safe even for orders
+                if getattr(error, 'code', None) != 429 or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                with self._stats_lock:
+                    self.throttled += 1
+                logging.warning(f"Broker rate limit hit on {name}, retrying ({attempt}/{self.max_retries})")
+                bucket.penalize(1.0)
+
+    def _coalesce(self, key, request):
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            with self._stats_lock:
+                self.coalesced += 1
+            return future.result()
+
+        try:
+            result = request()
+            future.set_result(result)
+            return result
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def metrics(self):
+        with self._stats_lock:
+            return {
+                'requests': self.requests,
+                'coalesced': self.coalesced,
+                'throttled': self.throttled,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'waiting': {endpoint_class: bucket.waiting() for endpoint_class, bucket in self._buckets.items()},
+            }
@@ -0,0 +1,175 @@
+import os
+from array import array
+from . import candle_time
+
+
+class Candle:
+    """ A candle with fixed fields, used for the forming bar and as a view on the history. """
+
+    __slots__ = ('start', 'open', 'high', 'low', 'close', 'volume', 'ohlc_high', 'ohlc_low', 'final_save')
+
+    def __init__(self, start, open, high, low, close, volume, ohlc_high, ohlc_low, final_save=False):
+        self.start = start  # IST epoch of the start_time
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.ohlc_high = ohlc_high  # Day high of the last tick, see CandleAggregator.process_tick
+        self.ohlc_low = ohlc_low
+        self.final_save = final_save
+
+    @classmethod
+    def from_dict(cls, candle):
+        """ Build a candle from a journal record. """
+        return cls(candle_time.parse_start_time(candle['start_time']), candle['open'], candle['high'], candle['low'],
+                   candle['close'], candle['volume'], candle.get('ohlc_high'), candle.get('ohlc_low'),
+                   candle.get('final_save', True))
+
+    @property
+    def start_time(self):
+        return candle_time.format_epoch(self.start)
+
+    def to_dict(self):
+        """ The candle in the journal and API format. """
+        return {
+            'start_time': self.start_time,
+            'open': self.open,
+            'high': self.high,
+            'low': self.low,
+            'close': self.close,
+            'volume': self.volume,
+            'ohlc_high': self.ohlc_high,
+            'ohlc_low': self.ohlc_low,
+            'final_save': self.final_save,
+        }
+
+    def to_json(self):
+        """ The journal record, formatted without building a dict (floats and ints repr as valid JSON). """
+        return '{"start_time":"%s","open":%r,"high":%r,"low":%r,"close":%r,"volume":%r,"ohlc_high":%s,"ohlc_low":%s,"final_save":%s}' % (
+            self.start_time, self.open, self.high, self.low, self.close, self.volume,
+            'null' if self.ohlc_high is None else repr(self.ohlc_high),
+            'null' if self.ohlc_low is None else repr(self.ohlc_low),
+            'true' if self.final_save else 'false')
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class CandleHistory:
+    """
+    Fixed depth ring of the latest candles, stored column wise in arrays.
+
+    Mirrors the candle list the aggregator used to keep: saving a candle with
+    the start of the last one overwrites it, a newer one is appended and the
+    oldest falls off once depth is reached. len() counts every candle saved,
+    so it keeps growing like the list did while memory stays flat.
+
+    version changes whenever any candle but the last one changes, so values
+    derived from the closed candles can be cached against it.
+
+    revision counts every write and each slot keeps the revision it was
+    last written at, so readers can ask for the candles changed since a
+    revision (see changed_since). dropped is the newest revision of a candle
+    that fell off the ring. generation tells histories apart across
+    restarts, revisions of different generations are not comparable.
+    """
+
+    def __init__(self, depth=100):
+        self.depth = max(3, depth)
+        self.start = array('q', [0]) * self.depth
+        self.open = array('d', [0.0]) * self.depth
+        self.high = array('d', [0.0]) * self.depth
+        self.low = array('d', [0.0]) * self.depth
+        self.close = array('d', [0.0]) * self.depth
+        self.volume = array('q', [0]) * self.depth
+        self.ohlc_high = array('d', [0.0]) * self.depth
+        self.ohlc_low = array('d', [0.0]) * self.depth
+        self.final_save = bytearray(self.depth)
+        self.revisions = array('q', [0]) * self.depth
+        self.count = 0
+        self.version = 0
+        self.revision = 0
+        self.dropped = 0
+        self.generation = os.urandom(4).hex()
+
+    def __len__(self):
+        return self.count
+
+    def retained(self):
+        return min(self.count, self.depth)
+
+    def slot(self, back):
+        """ Array index of the candle back positions from the end, 1 is the last candle. """
+        return (self.count - back) % self.depth
+
+    def save(self, candle):
+        """ Add or update a candle, returns the history. """
+        if self.count:
+            last_start = self.start[self.slot(1)]
+            if candle.start == last_start:
+                self._write(self.slot(1), candle)
+                return self
+            if candle.start < last_start:
+                # Rewrite of an older candle still in the ring, anything older is dropped
+                for back in range(2, self.retained() + 1):
+                    if self.start[self.slot(back)] == candle.start:
+                        self._write(self.slot(back), candle)
+                        self.version += 1
+                        break
+                return self
+        self.count += 1
+        self.version += 1
+        if self.count > self.depth:
+            self.dropped = self.revisions[self.slot(1)]
+        self._write(self.slot(1), candle)
+        return self
+
+    def _write(self, index, candle):
+        self.start[index] = candle.start
+        self.open[index] = candle.open
+        self.high[index] = candle.high
+        self.low[index] = candle.low
+        self.close[index] = candle.close
+        self.volume[index] = candle.volume
+        self.ohlc_high[index] = candle.ohlc_high if candle.ohlc_high is not None else 0.0
+        self.ohlc_low[index] = candle.ohlc_low if candle.ohlc_low is not None else 0.0
+        self.final_save[index] = candle.final_save
+        self.revision += 1
+        self.revisions[index] = self.revision
+
+    def __getitem__(self, position):
+        """ A Candle copy of a retained candle, positions count like the list indexes did. """
+        retained = self.retained()
+        back = -position if position < 0 else self.count - position
+        if not 1 <= back <= retained:
+            raise IndexError("candle is not retained in the history")
+        index = self.slot(back)
+        return Candle(self.start[index], self.open[index], self.high[index], self.low[index], self.close[index],
+                      self.volume[index], self.ohlc_high[index], self.ohlc_low[index], bool(self.final_save[index]))
+
+    def __iter__(self):
+        for back in range(self.retained(), 0, -1):
+            yield self[-back]
+
+    def changed_since(self, since=0):
+        """
+        Retained candles written after revision since, oldest first.
+
+        Not locked against the writer: the revision is read before the
+        candles are copied, so a candle written during the copy is newer
+        than the returned revision and comes again on the next call.
+
+        Returns:
+        - tuple: (revision, [Candle])
+        """
+        revision = self.revision
+        candles = []
+        for back in range(self.retained(), 0, -1):
+            if self.revisions[self.slot(back)] > since:
+                try:
+                    candles.append(self[-back])
+                except IndexError:
+                    # The ring moved on while copying
+                    continue
+        return revision, candles
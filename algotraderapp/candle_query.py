@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+from . import candle_time
+from .candle_store import load_candles
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value):
+    """ Compact JSON text, encoded by orjson when it is installed. """
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, separators=(',', ':'))
+
+
+def journal_path(instrument_token, timeframe):
+    """ Candle journal an aggregator writes, relative to the working directory like the aggregator's. """
+    return f"{instrument_token}_{timeframe}_minute_candles.json"
+
+
+def parse_time(value):
+    """ IST epoch of a start_time string ('YYYY-MM-DD HH:MM:SS') or of an epoch number, None when empty. """
+    if value is None or str(value).strip() == '':
+        return None
+    value = str(value).strip()
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return candle_time.parse_start_time(value)
+
+
+def format_revision(history, revision):
+    return f"{history.generation}-{revision}"
+
+
+def parse_revision(value):
+    """ (generation, revision) of a revision token from an earlier response, None when empty. """
+    if value is None or str(value).strip() == '':
+        return None
+    generation, _, revision = str(value).strip().rpartition('-')
+    if not generation or not revision.isdigit():
+        raise ValueError(f"Invalid since revision: {value}")
+    return generation, int(revision)
+
+
+class CandleQuery:
+    """
+    Filters of a candle request.
+
+    start and end bound the candle start times (IST epochs, inclusive), since
+    is the revision of an earlier response and limit keeps the last candles
+    of the selection.
+    """
+
+    def __init__(self, start=None, end=None, since=None, limit=None):
+        self.start = start
+        self.end = end
+        self.since = since
+        self.limit = limit
+
+    @classmethod
+    def from_params(cls, params):
+        """ Build a query from request parameters (from, to, since, limit), raises ValueError on bad values. """
+        limit = params.get('limit')
+        if limit not in (None, ''):
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError("limit must be positive")
+        else:
+            limit = None
+        return cls(parse_time(params.get('from')), parse_time(params.get('to')), parse_revision(params.get('since')), limit)
+
+    def key(self):
+        return (self.start, self.end, self.since, self.limit)
+
+    def includes(self, epoch):
+        return (self.start is None or epoch >= self.start) and (self.end is None or epoch <= self.end)
+
+    def clip(self, candles):
+        return candles[-self.limit:] if self.limit is not None else candles
+
+
+def source_state(history, file_path):
+    """ What a response of one instrument depends on, the ETag is built from it. """
+    if history is not None:
+        return ('memory', history.generation, history.revision, history.dropped)
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return ('missing',)
+    return ('journal', stat.st_mtime_ns, stat.st_size)
+
+
+def etag(timeframe, query, states):
+    """ Weak ETag of a response, states are (instrument_token, source_state) pairs. """
+    digest = hashlib.sha1(repr((timeframe, query.key(), states)).encode()).hexdigest()[:20]
+    return f'W/"candles-{digest}"'
+
+
+def from_history(history, query):
+    """
+    Answer a query from an in-memory CandleHistory.
+
+    Returns:
+    - tuple: (incremental, revision token, [candle JSON]), None when candles
+      the query asks for have fallen off the ring and only the journal has them.
+    """
+    since = query.since
+    incremental = since is not None and since[0] == history.generation and since[1] >= history.dropped
+    revision, candles = history.changed_since(since[1] if incremental else 0)
+    selected = [candle for candle in candles if query.includes(candle.start)]
+    if not incremental and len(history) > history.retained():
+        if query.start is None:
+            if query.limit is None or len(selected) < query.limit:
+                return None
+        elif not candles or query.start < candles[0].start:
+            return None
+    return incremental, format_revision(history, revision), [candle.to_json() for candle in query.clip(selected)]
+
+
+def from_journal(file_path, query):
+    """ Answer a query from a candle journal file, returns [candle JSON]. """
+    candles = load_candles(file_path)
+    if query.start is not None or query.end is not None:
+        candles = [candle for candle in candles if query.includes(candle_time.parse_start_time(candle['start_time']))]
+    return [dumps(candle) for candle in query.clip(candles)]
+
+
+def render_instrument(history, file_path, query):
+    """ JSON of one instrument's response, candle records are joined as text instead of encoding a list of dicts. """
+    answer = from_history(history, query) if history is not None else None
+    if answer is not None:
+        incremental, revision, candles = answer
+        source = 'memory'
+    elif os.path.exists(file_path):
+        # Candles reach the journal before the history, so it holds at least this revision
+        revision = format_revision(history, history.revision) if history is not None else None
+        incremental, candles = False, from_journal(file_path, query)
+        source = 'journal'
+    else:
+        return '{"file_exists":false}'
+    header = dumps({'file_exists': True, 'source': source, 'incremental': incremental, 'revision': revision})
+    return header[:-1] + ',"candle_data":[' + ','.join(candles) + ']}'
+
+
+def render(instrument_tokens, timeframe, histories, query):
+    """
+    JSON body of a candle request. One instrument is answered with its
+    response at the top level, several with {"instruments": {token: response}}.
+    """
+    parts = [(instrument_token, render_instrument(histories.get(instrument_token), journal_path(instrument_token, timeframe), query))
+             for instrument_token in instrument_tokens]
+    if len(parts) == 1:
+        return parts[0][1]
+    return '{"instruments":{' + ','.join(f'{dumps(instrument_token)}:{body}' for instrument_token, body in parts) + '}}'
@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+from . import candle_time
+
+# Seconds between wall clock advances of the scheduler thread
+TIMER_RESOLUTION = 0.25
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel with one slot per epoch second.
+
+    Deadlines further out than one rotation stay in their slot and are
+    skipped until the wheel reaches them. Scheduling and advancing are
+    O(1) per timer, independent of the number of instruments.
+    """
+
+    def __init__(self, slots=3600):
+        self.slots = [[] for _ in range(slots)]
+        self.current = None  # Epoch second the wheel has advanced to
+        self._overdue = []  # Scheduled at or before current, returned by the next advance
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def schedule(self, deadline, item):
+        with self._lock:
+            self.pending += 1
+            if self.current is not None and deadline <= self.current:
+                self._overdue.append((deadline, item))
+            else:
+                self.slots[deadline % len(self.slots)].append((deadline, item))
+
+    def advance(self, now):
+        """
+        Move the wheel to epoch second now.
+
+        Returns:
+        - list: (deadline, item) of every timer that expired, oldest deadline first.
+        """
+        with self._lock:
+            expired = self._overdue
+            self._overdue = []
+            if self.current is None:
+                self.current = now - 1
+            if now > self.current:
+                if now - self.current >= len(self.slots):
+                    # Clock jumped by more than a rotation, every slot is due
+                    slot_indexes = range(len(self.slots))
+                else:
+                    slot_indexes = [second % len(self.slots) for second in range(self.current + 1, now + 1)]
+                for slot_index in slot_indexes:
+                    slot = self.slots[slot_index]
+                    if not slot:
+                        continue
+                    remaining = [timer for timer in slot if timer[0] > now]
+                    if len(remaining) != len(slot):
+                        expired.extend(timer for timer in slot if timer[0] <= now)
+                        self.slots[slot_index] = remaining
+                self.current = now
+            self.pending -= len(expired)
+        expired.sort(key=lambda timer: timer[0])
+        return expired
+
+
+class CandleCloseScheduler:
+    """
+    Fires a candle close event when an instrument's candle interval ends.
+
+    Aggregators schedule the end of their current candle; when the clock
+    reaches it, on_close(instrument_token, boundary_epoch) is called. With
+    the local clock a thread advances the wheel from the wall clock, so
+    candles close on time even when no tick arrives. Tick batches also
+    advance it (see WebSocketHandler.handle_ticks), which is the only
+    driver with the exchange clock, keeping replays deterministic.
+    """
+
+    def __init__(self, on_close, clock=candle_time.LOCAL_CLOCK, slots=3600):
+        self.on_close = on_close
+        self.clock = clock
+        self.wheel = TimingWheel(slots)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._advance_lock = threading.Lock()  # Keeps the events of one boundary in order
+        self.fired = 0
+        self.last_boundary = None
+        self.last_delay = 0.0
+        self.max_delay = 0.0
+
+    def schedule(self, instrument_token, boundary):
+        self.wheel.schedule(boundary, instrument_token)
+
+    def advance(self, epoch):
+        """
+        Fire the close events of every boundary up to epoch (IST epoch seconds).
+
+        on_close runs under the advance lock and must not block; the tick
+        queue accepts close events even when a shard is full.
+        """
+        with self._advance_lock:
+            for boundary, instrument_token in self.wheel.advance(int(epoch)):
+                self.fired += 1
+                self.last_boundary = boundary
+                try:
+                    self.on_close(instrument_token, boundary)
+                except Exception as error:
+                    logging.error(f"Error closing candle of {instrument_token} at {candle_time.format_epoch(boundary)}: {error}")
+
+    def _now(self):
+        return candle_time.to_epoch(candle_time.ist_now())
+
+    def _timer_loop(self):
+        while not self._stop_event.wait(TIMER_RESOLUTION):
+            now = self._now()
+            fired = self.fired
+            self.advance(now)
+            if self.fired != fired:
+                # How late the last boundary of this pass was closed
+                self.last_delay = time.time() + candle_time.IST_OFFSET_SECONDS - self.last_boundary
+                self.max_delay = max(self.max_delay, self.last_delay)
+
+    def start(self):
+        """ Start the wall clock driver, only used with the local clock. """
+        if self.clock != candle_time.LOCAL_CLOCK or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._timer_loop, name="candle-close-timer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def metrics(self):
+        return {
+            'clock': self.clock,
+            'pending': self.wheel.pending,
+            'fired': self.fired,
+            'last_delay_ms': round(self.last_delay * 1000, 3),
+            'max_delay_ms': round(self.max_delay * 1000, 3),
+        }
@@ -0,0 +1,148 @@
+import os
+import json
+import logging
+import threading
+from . import candle_time
+
+
+def _encode_candle(candle):
+    """ Serialize a candle as a single journal line. """
+    return (json.dumps(candle, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def load_candles(file_path):
+    """
+    Load candles from a candle file written by CandleJournal.
+
+    The journal stores one JSON object per line and the last record for a
+    given start_time wins. Files written by the older implementation (a single
+    JSON list) are still accepted so existing session files keep loading.
+
+    Returns:
+    - list: Candles in the order their start_time was first seen.
+    """
+    with open(file_path, 'r') as file:
+        content = file.read()
+
+    if content.lstrip().startswith('['):
+        # Legacy format: the whole file is one JSON list
+        records = json.loads(content)
+    else:
+        records = []
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A reader can race with a tail rewrite, skip the torn record
+                logging.warning(f"Skipping malformed candle record in {file_path}")
+
+    candle_dict = {}
+    for candle in records:
+        candle_dict[candle['start_time']] = candle
+    return list(candle_dict.values())
+
+
+class CandleJournal:
+    """
+    Append-only journal file of an instrument's candles.
+
+    Closed candles are appended once, while updates to the in-progress candle
+    overwrite only the tail record of the file instead of rewriting the whole
+    history. Records for older candles that get rewritten are appended and
+    counted as stale; once enough of them pile up the file is compacted.
+
+    Candles are not kept in memory, the aggregator holds the recent ones in
+    a CandleHistory. Compaction reads the file back.
+    """
+
+    def __init__(self, file_path, compact_every=500):
+        self.file_path = file_path
+        self.compact_every = compact_every
+        self._file = None
+        self._tail_key = None  # start epoch of the last record on disk
+        self._tail_offset = 0  # byte offset where the last record starts
+        self._stale_records = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Read the candles saved by earlier runs and compact the file.
+
+        Returns:
+        - list: Candle dicts in start_time order.
+        """
+        with self._lock:
+            candles = []
+            if os.path.exists(self.file_path):
+                try:
+                    candles = load_candles(self.file_path)
+                except (json.JSONDecodeError, KeyError, TypeError) as error:
+                    logging.error(f"Could not load candles from {self.file_path}: {error}")
+                    candles = []
+                # Rewrite whatever was loaded as a clean journal so the tail offset is known
+                self._rewrite(candles)
+            return candles
+
+    def save(self, candle):
+        """ Add or update a candle.Candle in the journal. """
+        key = candle.start
+        record = (candle.to_json() + '\n').encode('utf-8')
+
+        with self._lock:
+            if self._file is None:
+                self._rewrite()
+
+            if key == self._tail_key:
+                # In-progress candle: overwrite only the tail record
+                self._file.seek(self._tail_offset)
+                self._file.write(record)
+                self._file.truncate()
+            else:
+                if self._tail_key is not None and key < self._tail_key:
+                    # An older candle was rewritten, its previous record is now stale
+                    self._stale_records += 1
+                self._file.seek(0, os.SEEK_END)
+                self._tail_offset = self._file.tell()
+                self._tail_key = key
+                self._file.write(record)
+            self._file.flush()
+
+            if self._stale_records >= self.compact_every:
+                self._rewrite()
+
+    def compact(self):
+        """ Rewrite the journal so it holds exactly one record per candle. """
+        with self._lock:
+            self._rewrite()
+
+    def close(self):
+        """ Compact the journal and release the file handle. """
+        with self._lock:
+            if self._file is None:
+                return
+            self._rewrite()
+            self._file.close()
+            self._file = None
+
+    def _rewrite(self, candles=None):
+        if self._file is not None:
+            self._file.flush()
+        if candles is None:
+            candles = load_candles(self.file_path) if os.path.exists(self.file_path) else []
+        temp_path = self.file_path + '.tmp'
+        tail_offset = 0
+        with open(temp_path, 'wb') as file:
+            for candle in candles:
+                tail_offset = file.tell()
+                file.write(_encode_candle(candle))
+        # Atomic swap so concurrent readers never see a half written file
+        os.replace(temp_path, self.file_path)
+
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.file_path, 'r+b')
+        self._tail_offset = tail_offset
+        self._tail_key = candle_time.parse_start_time(candles[-1]['start_time']) if candles else None
+        self._stale_records = 0
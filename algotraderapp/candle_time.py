@@ -0,0 +1,57 @@
+import time
+import datetime
+from zoneinfo import ZoneInfo
+
+# Candle times are IST wall clock; they are kept as integer seconds since
+# 1970-01-01 00:00 IST so bucketing is plain integer arithmetic.
+IST_OFFSET_SECONDS = 5 * 60 * 60 + 30 * 60
+START_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Clock sources for bucketing ticks into candles
+LOCAL_CLOCK = 'local'  # Arrival time of the tick batch
+EXCHANGE_CLOCK = 'exchange'  # exchange_timestamp of each tick, deterministic under replay
+
+IST = ZoneInfo("Asia/Kolkata")
+
+
+def ist_now():
+    """ Current IST time, the default clock of the tick handlers. """
+    return datetime.datetime.now(IST)
+
+
+def to_epoch(value):
+    """
+    Convert a tick time to integer IST epoch seconds.
+
+    Naive datetimes (as sent by KiteTicker) are taken as IST wall clock,
+    aware datetimes are converted. Sub-second precision is dropped, candle
+    boundaries are whole minutes so comparisons are unaffected.
+    """
+    if value.tzinfo is None:
+        return int((value - _EPOCH).total_seconds())
+    return int(value.timestamp()) + IST_OFFSET_SECONDS
+
+
+def from_epoch(epoch):
+    """ Naive IST datetime of an epoch, the form KiteTicker sends tick times in. """
+    return _EPOCH + datetime.timedelta(seconds=epoch)
+
+
+def bucket_start(epoch, interval_seconds=60):
+    """ Start of the bucket an epoch second falls into. """
+    return epoch - epoch % interval_seconds
+
+
+def minute_of_day(epoch):
+    return (epoch // 60) % (24 * 60)
+
+
+def format_epoch(epoch):
+    """ Render an epoch as a candle start_time string. """
+    return time.strftime(START_TIME_FORMAT, time.gmtime(epoch))
+
+
+def parse_start_time(start_time):
+    """ Parse a candle start_time string back into an epoch. """
+    return int((datetime.datetime.strptime(start_time, START_TIME_FORMAT) - _EPOCH).total_seconds())
@@ -1,62 +1,213 @@
 import json
-import os
-from channels.generic.websocket import WebsocketConsumer
-from kiteconnect import KiteTicker
+import math
 import asyncio
+import logging
+from urllib.parse import parse_qs
+from channels.generic.websocket import AsyncWebsocketConsumer
+from . import broadcast
+from .product_setting import BROADCAST_CLIENT_RATE, BROADCAST_CLIENT_MAX_RATE, BROADCAST_CLIENT_MAX_INSTRUMENTS
 
-class ZerodhaWebSocketConsumer(WebsocketConsumer):
-    async def connect(self):
-        # Accept WebSocket connection
-        self.accept()
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
-        # Initialize Zerodha KiteTicker
-        self.api_key = os.getenv("api_key")
-        self.access_token = os.getenv('access_token')
 
-        # Set up KiteTicker instance
-        self.ticker = KiteTicker(self.api_key, self.access_token)
+class ZerodhaWebSocketConsumer(AsyncWebsocketConsumer):
+    """
+    Live ticks, candles, order signals and group P&L for one viewer.
 
-        # Assign the callbacks
-        self.ticker.on_ticks = self.on_ticks  # Callback to receive live market data
-        self.ticker.on_connect = self.on_connect  # Callback when connection is established
-        self.ticker.on_close = self.on_close  # Callback when connection is closed
+    The consumer joins the channel layer groups the trading engine's
+    broadcaster publishes into, so viewers share the engine's single broker
+    feed. Updates are conflated per stream and key while the viewer waits
+    for its next send, sent at most max_rate times per second, and by default
+    delta encoded against what the viewer already has.
 
-        # Subscribe to instruments (replace with actual instrument tokens)
-        instrument_tokens = [1292]  # Replace with actual instrument tokens
-        self.ticker.subscribe(instrument_tokens)
+    Query string (all optional): tokens=256265,260105 streams=ticks,candles,signals,pnl
+    max_rate=4 delta=1 encoding=json|msgpack. The same settings can be changed
+    later with {"action": "subscribe" | "unsubscribe", "tokens": [...], "streams": [...]}
+    and {"action": "configure", "max_rate": ..., "delta": ..., "encoding": ...} messages.
+    Invalid values are answered with {"error": ...} and change nothing.
 
-        # Connect to Zerodha WebSocket
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self.ticker.connect)
+    Frames are {"updates": [{"stream", "key", "data"} or {"stream", "key", "delta"}]},
+    key is the instrument token (a sequence number for signals, the threshold
+    group for pnl) and a delta holds only the fields that changed since the last update
+    of the same stream and key.
+    """
 
-    def on_ticks(self, ws, ticks):
-        """
-        Called when Zerodha sends tick data.
-        """
-        # Log ticks to console for debugging
-        print("Received ticks:", ticks)
+    async def connect(self):
+        self.groups_joined = set()
+        self.tokens = set()
+        self.streams = set()
+        self.pending = {}  # (stream, key) -> channel layer message, the latest one wins
+        self.last_sent = {}  # (stream, base) -> data last sent, the base of the deltas
+        self.max_rate = BROADCAST_CLIENT_RATE
+        self.delta = True
+        self.encoding = 'json'
+        self.wakeup = asyncio.Event()
+        self.sender = None
+        await self.accept()
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            self.configure({name: values[-1] for name, values in params.items()})
+            await self.subscribe(_split(params.get('tokens')), _split(params.get('streams')) or list(broadcast.STREAMS))
+        except ValueError as error:
+            # The connection stays open on the defaults, the viewer can fix it with configure and subscribe messages
+            await self.send(text_data=json.dumps({'error': str(error)}))
+        self.sender = asyncio.create_task(self.send_loop())
 
-        # Use asyncio to send data back to WebSocket client
-        asyncio.run(self.send(text_data=json.dumps({
-            "ticks": ticks  # Forward the tick data
-        })))
+    async def disconnect(self, close_code):
+        if self.sender is not None:
+            self.sender.cancel()
+        for group in self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.groups_joined = set()
 
-    def on_connect(self, ws, response):
-        """
-        Called when Zerodha WebSocket connection is established.
-        """
-        print("WebSocket connection established:", response)
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data if text_data is not None else bytes_data)
+            if not isinstance(message, dict):
+                raise ValueError("Messages must be JSON objects")
+            action = message.get('action')
+            if action == 'subscribe':
+                await self.subscribe(message.get('tokens', []), message.get('streams') or list(broadcast.STREAMS))
+            elif action == 'unsubscribe':
+                await self.unsubscribe(message.get('tokens', []), message.get('streams') or list(broadcast.STREAMS))
+            elif action == 'configure':
+                self.configure(message)
+            else:
+                raise ValueError(f"Unknown action: {action}")
+            await self.send(text_data=json.dumps({'subscribed': {'tokens': sorted(self.tokens), 'streams': sorted(self.streams)},
+                                                  'max_rate': self.max_rate, 'delta': self.delta,
+                                                  'encoding': self.encoding}))
+        except Exception as error:
+            await self.send(text_data=json.dumps({'error': str(error)}))
 
-    def on_close(self, ws, code, reason):
+    def configure(self, options):
         """
-        Called when Zerodha WebSocket connection is closed.
+        Apply max_rate, delta and encoding options, missing ones keep their value.
+        Raises ValueError on an invalid value, the settings are then left as they were.
         """
-        print("WebSocket closed:", code, reason)
+        max_rate = options.get('max_rate', self.max_rate)
+        try:
+            max_rate = float(max_rate)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid max_rate: {max_rate}")
+        if not math.isfinite(max_rate) or max_rate <= 0:
+            raise ValueError(f"max_rate must be a positive number, got {max_rate}")
+        delta = options.get('delta', self.delta)
+        if delta in (True, '1', 'true', 'True'):
+            delta = True
+        elif delta in (False, '0', 'false', 'False'):
+            delta = False
+        else:
+            raise ValueError(f"Invalid delta: {delta}")
+        encoding = options.get('encoding', self.encoding)
+        if encoding not in ('json', 'msgpack'):
+            raise ValueError(f"Unknown encoding: {encoding}")
+
+        self.max_rate = min(max(max_rate, 0.1), BROADCAST_CLIENT_MAX_RATE)
+        self.delta = delta
+        # msgpack is only offered when it is installed, json is the fallback
+        self.encoding = 'msgpack' if encoding == 'msgpack' and msgpack is not None else 'json'
+        # Deltas restart from full data after a change of settings
+        self.last_sent = {}
+
+    def _groups(self, tokens, streams):
+        groups = set()
+        for stream in streams:
+            if stream not in broadcast.STREAMS:
+                raise ValueError(f"Unknown stream: {stream}")
+            if stream in broadcast.INSTRUMENT_STREAMS:
+                groups.update(broadcast.group_name(stream, token) for token in tokens)
+            else:
+                groups.add(broadcast.group_name(stream))
+        return groups
+
+    async def subscribe(self, tokens, streams):
+        tokens = self.tokens | _tokens(tokens)
+        if len(tokens) > BROADCAST_CLIENT_MAX_INSTRUMENTS:
+            raise ValueError(f"At most {BROADCAST_CLIENT_MAX_INSTRUMENTS} instruments per connection")
+        streams = self.streams | set(streams)
+        # Instrument streams apply to every subscribed token, unknown streams raise before anything changes
+        groups = self._groups(tokens, streams)
+        self.tokens = tokens
+        self.streams = streams
+        for group in groups - self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.groups_joined.add(group)
+
+    async def unsubscribe(self, tokens, streams):
+        tokens = _tokens(tokens)
+        if tokens:
+            groups = self._groups(tokens, [stream for stream in streams if stream in broadcast.INSTRUMENT_STREAMS])
+            self.tokens -= tokens
+        else:
+            # Without tokens whole streams are dropped
+            groups = self._groups(self.tokens, streams)
+            self.streams -= set(streams)
+        for group in groups & self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+            self.groups_joined.discard(group)
+
+    async def broadcast_update(self, event):
+        """ Channel layer handler of broadcast.MESSAGE_TYPE, keeps the update for the next frame. """
+        key = (event['stream'], event['key'])
+        if event.get('conflate', True):
+            self.pending.pop(key, None)
+        self.pending[key] = event
+        self.wakeup.set()
+
+    def encode_update(self, event):
+        stream, data = event['stream'], event['data']
+        if not event.get('conflate', True):
+            return {'stream': stream, 'key': event['key'], 'data': data}
+        # Viewers key updates by base, a candle's is its instrument and start_time tells the candles apart
+        key = event.get('base', event['key'])
+        previous = self.last_sent.get((stream, key)) if self.delta else None
+        self.last_sent[(stream, key)] = data
+        if previous is None:
+            return {'stream': stream, 'key': key, 'data': data}
+        changed = {field: value for field, value in data.items() if previous.get(field) != value}
+        if not changed:
+            return None
+        return {'stream': stream, 'key': key, 'delta': changed}
+
+    async def send_loop(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                events, self.pending = self.pending, {}
+                updates = [update for update in map(self.encode_update, events.values()) if update is not None]
+                if updates:
+                    frame = {'updates': updates}
+                    if self.encoding == 'msgpack':
+                        await self.send(bytes_data=msgpack.packb(frame))
+                    else:
+                        await self.send(text_data=json.dumps(frame, separators=(',', ':')))
+                # Updates arriving in the meantime are conflated into the next frame
+                await asyncio.sleep(1 / self.max_rate)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logging.error(f"Live feed sender stopped: {error}")
+            await self.close()
+
+
+def _split(values):
+    """ Comma separated query string values as a flat list. """
+    return [item for value in values or () for item in value.split(',') if item.strip()]
 
-    async def disconnect(self, close_code):
-        # Close the WebSocket connection
-        await self.close()
 
-        # Close Zerodha WebSocket connection
-        if self.ticker:
-            self.ticker.close()
+def _tokens(values):
+    """ Instrument tokens as a set of ints, raises ValueError on anything else. """
+    if isinstance(values, (str, int)):
+        values = [values]
+    tokens = set()
+    for value in values or ():
+        try:
+            tokens.add(int(value))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid instrument token: {value}")
+    return tokens
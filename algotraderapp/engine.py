@@ -0,0 +1,387 @@
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from kiteconnect import KiteTicker
+from .product_setting import CANDLE_CLOCK, TICK_CONFLATION, ENGINE_QUEUE_MAXSIZE, ENGINE_PNL_CAPACITY
+from .product_setting import BROKER_POOL_SIZE, BROKER_MAX_RETRIES
+from .product_setting import TICK_RECORDER, TICK_RECORDER_DIR, TICK_RECORDER_DEPTH, LATENCY_METRICS
+from .broker import BrokerClient, split_rate_limits
+from .order_book import OrderBook
+from .pnl import SharedGroupPnL
+from .tick_recorder import TickRecorder
+from .latency import LatencyMetrics
+from .run_script import WebSocketHandler
+from . import candle_time, log_channels
+
+# Seconds between shard status reports
+STATUS_INTERVAL = 1.0
+
+
+def build_layout(instruments, symbols=None):
+    """
+    Build the shared P&L table layout for all shards.
+
+    Symbols keep the slot they were given in a previous layout, new symbols
+    are appended, so values survive a configuration reload.
+
+    Returns:
+    - dict: {'symbols': [tradingsymbol], 'groups': {exit_trades_threshold_points: [tradingsymbol]}}
+    """
+    symbols = list(symbols or [])
+    known_symbols = set(symbols)
+    groups = {}
+    for instrument in instruments:
+        tradingsymbol = instrument['instrument_details']['tradingsymbol']
+        if tradingsymbol not in known_symbols:
+            symbols.append(tradingsymbol)
+            known_symbols.add(tradingsymbol)
+        # Same grouping as WebSocketHandler.restructure_for_combined_threshold
+        if instrument.get('exit_trades_threshold_points') is not None:
+            groups.setdefault(instrument['exit_trades_threshold_points'], []).append(tradingsymbol)
+    return {'symbols': symbols, 'groups': groups}
+
+
+def shard_for(instrument_token, shards):
+    return int(instrument_token) % shards
+
+
+class ShardedEngine:
+    """
+    Trading engine spread over several worker processes.
+
+    The feed (KiteTicker, in the Django process) stamps the arrival time on
+    every tick and routes it by instrument token to one of N worker
+    processes. Each worker runs a WebSocketHandler without a socket for its
+    subset of instruments, with its own BrokerClient holding its share of the
+    API key's rate limits and its own copy of the order book. The parent
+    seeds and reconciles the order book once and broadcasts the order lists
+    and the order updates to all workers. Threshold group P&L is
+    shared across shards through a SharedGroupPnL table. Workers report
+    their status periodically, see shard_status(). Each worker writes its
+    own channel log files (ticks.shard<n>.txt and so on).
+
+    Exposes the same lifecycle methods as WebSocketHandler so the views can
+    use either one.
+    """
+
+    def __init__(self, kite, instruments=[], processes=2, candle_clock=CANDLE_CLOCK, tick_conflation=TICK_CONFLATION,
+                 instrument_master=None):
+        self.websocket_running = True
+        self.kite = kite
+        self.processes = processes
+        self.candle_clock = candle_clock
+        self.tick_conflation = tick_conflation
+        self.kite_ticker = KiteTicker(kite.api_key, kite.access_token)
+        # The parent records the feed once, before it is split across the shards
+        self.tick_recorder = TickRecorder(TICK_RECORDER_DIR, depth=TICK_RECORDER_DEPTH) if TICK_RECORDER else None
+        # Feed lag is measured here, the other stages in the shards
+        self.latency = LatencyMetrics(enabled=LATENCY_METRICS)
+
+        # Spawn instead of fork, the Django process runs threads that must not be copied
+        self._context = multiprocessing.get_context('spawn')
+        self._inboxes = [self._context.Queue(maxsize=ENGINE_QUEUE_MAXSIZE) for _ in range(processes)]
+        self._status_queue = self._context.Queue()
+        self._workers = []
+        self._status_thread = None
+        self._stop_event = threading.Event()
+        self._status_lock = threading.Lock()
+        self._shard_status = {}
+
+        # The shards get instrument_details resolved here from the day's instrument dump
+        self.instrument_master = instrument_master
+        if instrument_master is not None:
+            instruments = instrument_master.resolve(instruments)
+        self.instruments = instruments
+        self.instrument_tokens = [int(x['instrument_token']) for x in instruments]
+        self.symbols_by_token = {int(x['instrument_token']): x['instrument_details']['tradingsymbol'] for x in instruments}
+        self.layout = build_layout(instruments)
+        self.group_pnl = SharedGroupPnL.create(self.layout, capacity=ENGINE_PNL_CAPACITY)
+        # The only order book that polls the REST API, the shards merge what it fetched
+        self.order_book = OrderBook(kite)
+        self.order_book.reconcile_listeners.append(self.on_reconciled_orders)
+
+        self.kite_ticker.on_ticks = self.on_ticks
+        self.kite_ticker.on_connect = self.on_connect
+        self.kite_ticker.on_close = self.on_close
+        self.kite_ticker.on_error = self.on_error
+        self.kite_ticker.on_noreconnect = self.on_noreconnect
+        self.kite_ticker.on_reconnect = self.on_reconnect
+        self.kite_ticker.on_order_update = self.on_order_update
+
+    def shard_instruments(self, instruments, shard):
+        return [x for x in instruments if shard_for(x['instrument_token'], self.processes) == shard]
+
+    def reload_config(self, instruments):
+        """ Send the new configuration to every shard and update the subscription. """
+        if self.instrument_master is not None:
+            instruments = self.instrument_master.resolve(instruments)
+        self.layout = build_layout(instruments, self.layout['symbols'])
+        self.group_pnl.set_layout(self.layout)
+        for shard, inbox in enumerate(self._inboxes):
+            inbox.put(('config', self.shard_instruments(instruments, shard), self.layout))
+
+        previous_tokens = set(self.instrument_tokens)
+        self.instruments = instruments
+        self.instrument_tokens = [int(x['instrument_token']) for x in instruments]
+        self.symbols_by_token = {int(x['instrument_token']): x['instrument_details']['tradingsymbol'] for x in instruments}
+        if self.kite_ticker.is_connected():
+            removed_tokens = list(previous_tokens - set(self.instrument_tokens))
+            added_tokens = list(set(self.instrument_tokens) - previous_tokens)
+            if removed_tokens:
+                self.kite_ticker.unsubscribe(removed_tokens)
+            if added_tokens:
+                self.kite_ticker.subscribe(added_tokens)
+
+    def on_connect(self, ws, response):
+        logging.info("WebSocket connected. Subscribing to instruments.")
+        self.kite_ticker.subscribe(self.instrument_tokens)
+
+    def on_close(self, ws, code, reason):
+        logging.info(f"WebSocket closed. {code} with reason {reason}")
+
+    def on_error(self, ws, code, reason):
+        logging.error(f"WebSocket encountered an error: Code {code}, Reason: {reason}.")
+
+    def on_noreconnect(self, ws):
+        logging.error("WebSocket reconnection failed permanently.")
+
+    def on_reconnect(self, ws, attempt_count):
+        logging.info(f"WebSocket is attempting to reconnect. Attempt {attempt_count}.")
+
+    def on_ticks(self, ws, ticks):
+        """ Stamp the arrival time and route the ticks to their shards. """
+        try:
+            current_datetime = candle_time.ist_now()
+            if self.candle_clock == candle_time.LOCAL_CLOCK and current_datetime.hour < 9:
+                return None
+            current_epoch = candle_time.to_epoch(current_datetime)
+            if self.tick_recorder is not None:
+                self.tick_recorder.record(ticks, current_datetime)
+            if self.latency.enabled:
+                self.latency.observe_arrival(ticks, current_datetime, self.symbols_by_token)
+
+            batches = {}
+            for tick in ticks:
+                tick['current_datetime'] = current_datetime
+                tick['epoch'] = current_epoch
+                batches.setdefault(shard_for(tick['instrument_token'], self.processes), []).append(tick)
+            for shard, batch in batches.items():
+                self._inboxes[shard].put(('ticks', batch))
+        except Exception as error:
+            logging.error(f"Error routing ticks: {error}")
+
+    def on_order_update(self, ws, data):
+        """ Every shard keeps its own order book, broadcast the update. """
+        self.order_book.on_order_update(ws, data)
+        for inbox in self._inboxes:
+            inbox.put(('order', data))
+
+    def on_reconciled_orders(self, orders):
+        """ Broadcast the order list of the seed and every reconciliation poll. """
+        for inbox in self._inboxes:
+            inbox.put(('orders', orders))
+
+    def run_websocket(self):
+        """ Start the shard processes, then connect the feed. """
+        self.group_pnl.load_snapshot()
+        self.group_pnl.start()
+        for shard in range(self.processes):
+            process = self._context.Process(
+                target=run_shard,
+                args=(shard, self.processes, self.kite.api_key, self.kite.access_token, self.shard_instruments(self.instruments, shard),
+                      self.layout, self.group_pnl.name, self._inboxes[shard], self._status_queue,
+                      self.candle_clock, self.tick_conflation, self.latency.enabled, log_channels.LOG_DIR),
+                name=f"algotrader-shard-{shard}",
+                daemon=True,
+            )
+            process.start()
+            self._workers.append(process)
+        # Queued ahead of the first ticks of every shard
+        self.order_book.seed()
+        self.order_book.start_reconciliation()
+        self._stop_event.clear()
+        self._status_thread = threading.Thread(target=self._collect_status, name="shard-status", daemon=True)
+        self._status_thread.start()
+
+        self.kite_ticker.connect(threaded=True)
+
+    def stop_websocket(self):
+        """ Close the feed, stop the shards and release the shared table. """
+        try:
+            if not self.websocket_running:
+                logging.warning("Engine stop called, but it was not running.")
+                return
+            self.kite_ticker.unsubscribe(self.instrument_tokens)
+            self.kite_ticker.close(1000, "No More Trade Required")
+
+            for inbox in self._inboxes:
+                inbox.put(('stop',))
+            for process in self._workers:
+                process.join(timeout=10)
+                if process.is_alive():
+                    logging.error(f"Shard process {process.name} did not stop, terminating it")
+                    process.terminate()
+            self._workers = []
+            self._stop_event.set()
+            self.order_book.stop()
+
+            self.group_pnl.stop()
+            self.group_pnl.close()
+            if self.tick_recorder is not None:
+                self.tick_recorder.close()
+            self.websocket_running = False
+        except Exception as error:
+            logging.error(f"Failed to stop the sharded engine: {error}")
+
+    def is_running(self):
+        return self.websocket_running
+
+    def _collect_status(self):
+        while not self._stop_event.is_set():
+            try:
+                status = self._status_queue.get(timeout=STATUS_INTERVAL)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError, ValueError):
+                # Queue closed during shutdown
+                return
+            with self._status_lock:
+                self._shard_status[status['shard']] = status
+
+    def shard_status(self):
+        """ Latest status reported by every shard. """
+        now = time.time()
+        statuses = []
+        for shard, process in enumerate(self._workers or [None] * self.processes):
+            with self._status_lock:
+                status = dict(self._shard_status.get(shard, {'shard': shard}))
+            status['alive'] = bool(process and process.is_alive())
+            if 'reported_at' in status:
+                status['report_age'] = round(now - status['reported_at'], 3)
+            try:
+                status['queue_depth'] = self._inboxes[shard].qsize()
+            except NotImplementedError:
+                # qsize is not available on macOS
+                status['queue_depth'] = None
+            statuses.append(status)
+        return statuses
+
+    def queue_metrics(self):
+        return [{'shard': status['shard'], 'depth': status.get('queue_depth')} for status in self.shard_status()]
+
+    def scheduler_metrics(self):
+        return {status['shard']: status.get('candle_scheduler', {}) for status in self.shard_status()}
+
+    def latency_snapshots(self):
+        """ Stage latency histograms of the feed process and of every shard. """
+        return [self.latency.snapshot()] + [status['latency'] for status in self.shard_status() if 'latency' in status]
+
+    def set_latency_metrics(self, enabled):
+        """ Switch the stage latency histograms on or off here and in every shard. """
+        self.latency.set_enabled(enabled)
+        for inbox in self._inboxes:
+            inbox.put(('latency', bool(enabled)))
+
+    def recorder_metrics(self):
+        if self.tick_recorder is None:
+            return {}
+        return self.tick_recorder.metrics()
+
+    def broadcast_metrics(self):
+        return {status['shard']: status.get('broadcast', {}) for status in self.shard_status()}
+
+    def candle_history(self, instrument_token, timeframe):
+        """ Candles live in the worker processes, readers fall back to the candle journals. """
+        return None
+
+    def conflation_metrics(self):
+        metrics = {}
+        for status in self.shard_status():
+            metrics.update(status.get('conflation', {}))
+        return metrics
+
+
+def run_shard(shard, shards, api_key, access_token, instruments, layout, pnl_table_name, inbox, status_queue,
+              candle_clock, tick_conflation, latency_metrics=False, log_dir=None):
+    """ Entry point of a shard worker process. """
+    # The parent keeps the plain channel files in log_dir, each shard logs to ticks.shard<n>.txt and so on
+    log_channels.setup(log_dir)
+    log_channels.set_file_suffix(f".shard{shard}")
+    # The shards place orders on the same API key, each keeps to its share of the limits
+    kite = BrokerClient(api_key, access_token, pool_size=BROKER_POOL_SIZE, max_retries=BROKER_MAX_RETRIES,
+                        rate_limits=split_rate_limits(shards))
+    group_pnl = SharedGroupPnL.attach(pnl_table_name, layout)
+    handler = WebSocketHandler(kite, instruments, candle_clock=candle_clock, tick_queue_shards=0,
+                               tick_conflation=tick_conflation, group_pnl=group_pnl, tick_recorder=False,
+                               latency_metrics=latency_metrics)
+    if handler.candle_scheduler is not None:
+        handler.candle_scheduler.start()
+    # Every shard broadcasts the instruments it processes
+    if handler.broadcaster is not None:
+        handler.broadcaster.start()
+
+    ticks_processed = 0
+    batches_processed = 0
+    last_report = 0
+    while True:
+        try:
+            message = inbox.get(timeout=STATUS_INTERVAL)
+        except queue.Empty:
+            message = None
+
+        if message is not None:
+            kind = message[0]
+            if kind == 'ticks':
+                handler.handle_ticks(message[1])
+                ticks_processed += len(message[1])
+                batches_processed += 1
+            elif kind == 'order':
+                handler.order_book.on_order_update(None, message[1])
+            elif kind == 'orders':
+                handler.order_book.merge(message[1])
+            elif kind == 'latency':
+                handler.set_latency_metrics(message[1])
+            elif kind == 'config':
+                group_pnl.set_layout(message[2])
+                handler.reload_config(message[1])
+            elif kind == 'stop':
+                break
+
+        if time.time() - last_report >= STATUS_INTERVAL:
+            last_report = time.time()
+            status_queue.put({
+                'shard': shard,
+                'pid': os.getpid(),
+                'reported_at': last_report,
+                'ticks_processed': ticks_processed,
+                'batches_processed': batches_processed,
+                'instruments': {
+                    candle_aggregator.tradingsymbol: {
+                        'order_active': candle_aggregator.order_active,
+                        'close_trade_for_the_day': candle_aggregator.close_trade_for_the_day,
+                        'profit_threshold_points': candle_aggregator.profit_threshold_points,
+                        'candles': len(candle_aggregator.candles),
+                    }
+                    for candle_aggregator in handler.candle_aggregators.values()
+                },
+                'conflation': handler.conflation_metrics(),
+                'orders': handler.order_metrics(),
+                'candle_scheduler': handler.scheduler_metrics(),
+                'broker': kite.metrics(),
+                'latency': handler.latency.snapshot(),
+                'broadcast': handler.broadcast_metrics(),
+            })
+
+    if handler.candle_scheduler is not None:
+        handler.candle_scheduler.stop()
+    if handler.broadcaster is not None:
+        handler.broadcaster.stop()
+    handler.order_book.stop()
+    if handler.order_executor is not None:
+        handler.order_executor.shutdown()
+    for candle_aggregator in handler.candle_aggregators.values():
+        candle_aggregator.candle_journal.close()
+    group_pnl.close()
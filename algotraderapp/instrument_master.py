@@ -0,0 +1,372 @@
+import io
+import os
+import csv
+import gzip
+import time
+import hashlib
+import logging
+import datetime
+import threading
+import numpy as np
+from . import candle_time
+
+# Columns of the Kite instrument dump, in its CSV order
+FIELDS = ('instrument_token', 'exchange_token', 'tradingsymbol', 'name', 'last_price', 'expiry', 'strike',
+          'tick_size', 'lot_size', 'instrument_type', 'segment', 'exchange')
+_TEXT_FIELDS = ('exchange_token', 'tradingsymbol', 'name', 'instrument_type', 'segment', 'exchange')
+_NUMERIC_TYPES = {
+    'instrument_token': '<u4',
+    'last_price': '<f8',
+    'expiry': '<i4',  # date.toordinal(), 0 when the instrument does not expire
+    'strike': '<f8',
+    'tick_size': '<f8',
+    'lot_size': '<i4',
+}
+FILE_PREFIX = 'instruments-'
+FILE_SUFFIX = '.npy'
+# Seconds before a failed background refresh is tried again
+RETRY_SECONDS = 60
+EXPORT_SUFFIX = '.csv.gz'
+# Rows decoded from the mapped dump and written to CSV at a time
+EXPORT_CHUNK_ROWS = 5000
+
+
+def snapshot_dtype(instruments):
+    """ Structured dtype of a dump, text columns are as wide as their longest value. """
+    fields = []
+    for name in FIELDS:
+        if name in _NUMERIC_TYPES:
+            fields.append((name, _NUMERIC_TYPES[name]))
+        else:
+            width = max((len(str(instrument.get(name) or '').encode()) for instrument in instruments), default=1)
+            fields.append((name, f'S{max(width, 1)}'))
+    return np.dtype(fields)
+
+
+def encode(instruments):
+    """ Pack kite.instruments() rows into a structured array. """
+    array = np.zeros(len(instruments), dtype=snapshot_dtype(instruments))
+    for name in FIELDS:
+        if name == 'expiry':
+            values = [value.toordinal() if isinstance(value, datetime.date) else 0
+                      for value in (instrument.get('expiry') for instrument in instruments)]
+        elif name in _TEXT_FIELDS:
+            values = [str(instrument.get(name) or '').encode() for instrument in instruments]
+        else:
+            values = [instrument.get(name) or 0 for instrument in instruments]
+        array[name] = values
+    return array
+
+
+def _decode_expiry(ordinal):
+    return datetime.date.fromordinal(ordinal) if ordinal else ''
+
+
+def decode(values):
+    """ A row tuple (record.tolist()) as the dict kite.instruments() returns. """
+    (instrument_token, exchange_token, tradingsymbol, name, last_price, expiry, strike, tick_size, lot_size,
+     instrument_type, segment, exchange) = values
+    return {
+        'instrument_token': instrument_token,
+        'exchange_token': exchange_token.decode(),
+        'tradingsymbol': tradingsymbol.decode(),
+        'name': name.decode(),
+        'last_price': last_price,
+        'expiry': _decode_expiry(expiry),
+        'strike': strike,
+        'tick_size': tick_size,
+        'lot_size': lot_size,
+        'instrument_type': instrument_type.decode(),
+        'segment': segment.decode(),
+        'exchange': exchange.decode(),
+    }
+
+
+def decode_columns(selection):
+    """ Rows of a dump as {field: list}, in FIELDS order. """
+    columns = {}
+    for name in FIELDS:
+        values = selection[name].tolist()
+        if name == 'expiry':
+            values = [_decode_expiry(value) for value in values]
+        elif name in _TEXT_FIELDS:
+            values = [value.decode() for value in values]
+        columns[name] = values
+    return columns
+
+
+def iter_rows(selection, chunk_size=EXPORT_CHUNK_ROWS):
+    """ Row tuples in FIELDS order, decoded chunk_size rows at a time. """
+    for start in range(0, len(selection), chunk_size):
+        columns = decode_columns(selection[start:start + chunk_size])
+        yield from zip(*(columns[name] for name in FIELDS))
+
+
+def csv_chunks(rows, chunk_size=EXPORT_CHUNK_ROWS):
+    """ The header and rows as CSV text, chunk_size rows per string. """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count == chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
+
+
+def export_key(exchange=None, segment=None):
+    """ File and ETag safe name of an export filter. """
+    return hashlib.sha1(f"{exchange or ''}|{segment or ''}".encode()).hexdigest()[:12]
+
+
+def snapshot_path(directory, day):
+    return os.path.join(directory, f"{FILE_PREFIX}{day.strftime('%Y%m%d')}{FILE_SUFFIX}")
+
+
+def snapshot_days(directory):
+    """ Days with a saved dump in directory, oldest first. """
+    if not os.path.isdir(directory):
+        return []
+    days = []
+    for filename in os.listdir(directory):
+        if filename.startswith(FILE_PREFIX) and filename.endswith(FILE_SUFFIX):
+            try:
+                days.append(datetime.datetime.strptime(filename[len(FILE_PREFIX):-len(FILE_SUFFIX)], '%Y%m%d').date())
+            except ValueError:
+                continue
+    return sorted(days)
+
+
+class InstrumentSnapshot:
+    """
+    One day's instrument dump, memory mapped, with in-memory indexes.
+
+    Rows stay in the mapped file and are decoded when looked up; only the
+    token, tradingsymbol and (exchange, tradingsymbol) indexes are built on
+    load. Snapshots are never changed after they are built, the master
+    swaps in a new one on refresh.
+    """
+
+    def __init__(self, array, day, expires_at):
+        self.array = array
+        self.day = day
+        self.expires_at = expires_at  # Unix time the next day's dump is due
+        tokens = array['instrument_token'].tolist()
+        symbols = [symbol.decode() for symbol in array['tradingsymbol'].tolist()]
+        exchanges = [exchange.decode() for exchange in array['exchange'].tolist()]
+        self.by_token = dict(zip(tokens, range(len(tokens))))
+        self.by_exchange_symbol = dict(zip(zip(exchanges, symbols), range(len(symbols))))
+        self.by_symbol = {}
+        for row, symbol in enumerate(symbols):
+            self.by_symbol.setdefault(symbol, []).append(row)
+
+    def __len__(self):
+        return len(self.array)
+
+    def row(self, index):
+        return decode(self.array[index].tolist())
+
+    def selection(self, exchange=None, segment=None):
+        """ Rows matching the filters, the whole array without filters. """
+        if exchange is None and segment is None:
+            return self.array
+        mask = np.ones(len(self.array), dtype=bool)
+        if exchange is not None:
+            mask &= self.array['exchange'] == exchange.encode()
+        if segment is not None:
+            mask &= self.array['segment'] == segment.encode()
+        return self.array[mask]
+
+
+class InstrumentMaster:
+    """
+    Token indexed cache of the Kite instrument dump.
+
+    The dump is downloaded at most once per trading day and saved as a
+    structured .npy file per day in directory, so a restart maps the saved
+    file instead of downloading ~100k rows again. Kite publishes the day's
+    dump in the morning; from refresh_time (IST) on a snapshot of an earlier
+    day is stale and the next lookup starts a refresh in a background thread
+    while it keeps answering from the old snapshot. Only a master with no
+    snapshot at all downloads inline.
+    """
+
+    def __init__(self, broker, directory='instrument_data', refresh_time=(8, 30), keep_days=2):
+        self.broker = broker
+        self.directory = directory
+        self.refresh_time = refresh_time
+        self.keep_days = keep_days
+        self._snapshot = None
+        self._lock = threading.Lock()  # Serializes loads and downloads
+        self._export_lock = threading.Lock()
+        self._refreshing = False
+        self._retry_at = 0
+        self.refreshes = 0
+        self.failed_refreshes = 0
+        self.last_error = None
+
+    def trading_day(self, now=None):
+        """ Day of the dump that is current at now (IST). """
+        now = now or candle_time.ist_now()
+        if (now.hour, now.minute) < self.refresh_time:
+            return now.date() - datetime.timedelta(days=1)
+        return now.date()
+
+    def _expires_at(self, day):
+        hour, minute = self.refresh_time
+        due = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(hour, minute), candle_time.IST)
+        return due.timestamp()
+
+    def _open(self, day):
+        array = np.load(snapshot_path(self.directory, day), mmap_mode='r', allow_pickle=False)
+        return InstrumentSnapshot(array, day, self._expires_at(day))
+
+    def load(self):
+        """ Map the newest saved dump, returns the snapshot or None when there is none. """
+        with self._lock:
+            if self._snapshot is None:
+                for day in reversed(snapshot_days(self.directory)):
+                    try:
+                        self._snapshot = self._open(day)
+                        break
+                    except (OSError, ValueError) as error:
+                        logging.error(f"Could not load the instrument dump of {day}: {error}")
+            return self._snapshot
+
+    def refresh(self, force=False):
+        """ Download the instrument dump, save it and swap it in, unless the current day's is loaded. """
+        with self._lock:
+            day = self.trading_day()
+            if not force and self._snapshot is not None and self._snapshot.day >= day:
+                return self._snapshot
+            try:
+                array = encode(self.broker.instruments())
+                os.makedirs(self.directory, exist_ok=True)
+                path = snapshot_path(self.directory, day)
+                temporary_path = path + '.tmp'
+                with open(temporary_path, 'wb') as file:
+                    np.save(file, array, allow_pickle=False)
+                os.replace(temporary_path, path)
+                self._snapshot = self._open(day)
+                self.refreshes += 1
+                self.last_error = None
+            except Exception as error:
+                self.failed_refreshes += 1
+                self.last_error = str(error)
+                self._retry_at = time.time() + RETRY_SECONDS
+                raise
+            self._remove_old_snapshots()
+            logging.info(f"Instrument dump of {day} saved with {len(array)} instruments")
+            return self._snapshot
+
+    def _remove_old_snapshots(self):
+        for day in snapshot_days(self.directory)[:-self.keep_days]:
+            try:
+                os.remove(snapshot_path(self.directory, day))
+            except OSError as error:
+                logging.warning(f"Could not remove the instrument dump of {day}: {error}")
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as error:
+            logging.error(f"Instrument dump refresh failed: {error}")
+        finally:
+            self._refreshing = False
+
+    def snapshot(self):
+        """ The current snapshot, loading or downloading it first when there is none. """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.load()
+            if snapshot is None:
+                return self.refresh()
+        now = time.time()
+        if now >= snapshot.expires_at and not self._refreshing and now >= self._retry_at:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, name="instrument-refresh", daemon=True).start()
+        return snapshot
+
+    def get(self, instrument_token):
+        """ Instrument of a token, None when the dump does not have it. """
+        snapshot = self.snapshot()
+        row = snapshot.by_token.get(int(instrument_token))
+        return snapshot.row(row) if row is not None else None
+
+    def find(self, exchange, tradingsymbol):
+        snapshot = self.snapshot()
+        row = snapshot.by_exchange_symbol.get((exchange, tradingsymbol))
+        return snapshot.row(row) if row is not None else None
+
+    def by_symbol(self, tradingsymbol):
+        """ Instruments of a tradingsymbol on every exchange listing it. """
+        snapshot = self.snapshot()
+        return [snapshot.row(row) for row in snapshot.by_symbol.get(tradingsymbol, ())]
+
+    def columns(self, exchange=None, segment=None):
+        """ The (filtered) dump as {field: list}, in FIELDS order. """
+        return decode_columns(self.snapshot().selection(exchange, segment))
+
+    def export_etag(self, snapshot, exchange=None, segment=None):
+        """ Weak ETag of a CSV export, it changes with the dump's day and the filters. """
+        return f'W/"instruments-{snapshot.day.strftime("%Y%m%d")}-{export_key(exchange, segment)}"'
+
+    def export(self, snapshot, exchange=None, segment=None):
+        """
+        Path of the gzip compressed CSV of a snapshot's (filtered) rows,
+        written on the first request of the day for the filters and reused
+        after. Filters matching no rows get no file, returns None.
+        """
+        selection = snapshot.selection(exchange, segment)
+        if not len(selection):
+            return None
+        prefix = f"{FILE_PREFIX}{snapshot.day.strftime('%Y%m%d')}-"
+        path = os.path.join(self.directory, prefix + export_key(exchange, segment) + EXPORT_SUFFIX)
+        with self._export_lock:
+            if not os.path.exists(path):
+                temporary_path = path + '.tmp'
+                with gzip.open(temporary_path, 'wt', newline='', compresslevel=6) as file:
+                    for chunk in csv_chunks(iter_rows(selection)):
+                        file.write(chunk)
+                os.replace(temporary_path, path)
+                # Exports of earlier days are not served again
+                for filename in os.listdir(self.directory):
+                    if filename.endswith(EXPORT_SUFFIX) and not filename.startswith(prefix):
+                        try:
+                            os.remove(os.path.join(self.directory, filename))
+                        except OSError as error:
+                            logging.warning(f"Could not remove the instrument export {filename}: {error}")
+        return path
+
+    def resolve(self, configurations):
+        """
+        Replace the instrument_details of tradeconfiguration documents with
+        the current dump's entry, keeping the stored details of tokens that
+        are no longer listed. Changes and returns the documents.
+        """
+        for configuration in configurations:
+            try:
+                instrument = self.get(configuration['instrument_token'])
+            except Exception as error:
+                logging.error(f"Could not resolve instrument {configuration.get('instrument_token')}: {error}")
+                return configurations
+            if instrument is not None:
+                instrument['expiry'] = str(instrument['expiry'])
+                configuration['instrument_details'] = instrument
+        return configurations
+
+    def metrics(self):
+        snapshot = self._snapshot
+        return {
+            'day': str(snapshot.day) if snapshot is not None else None,
+            'instruments': len(snapshot) if snapshot is not None else 0,
+            'refreshing': self._refreshing,
+            'refreshes': self.refreshes,
+            'failed_refreshes': self.failed_refreshes,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,76 @@
+import logging
+
+# Exchanges that follow the equity session, everything else trades 9 AM to 11 PM
+EQUITY_EXCHANGES = ('NFO', 'NSE', 'BSE')
+EQUITY_SESSION = (9 * 60 + 15, 15 * 60)
+DEFAULT_SESSION = (9 * 60, 23 * 60)
+
+
+class InstrumentRuntime:
+    """
+    Typed, pre-parsed trade configuration for one subscribed instrument.
+
+    Built once from the tradeconfiguration documents so the tick loop never
+    parses strings, scans the instrument list or rebuilds group membership.
+    Session bounds are minutes since midnight (IST), end exclusive.
+    """
+
+    __slots__ = (
+        'instrument_token', 'tradingsymbol', 'exchange', 'lot_size', 'percentage',
+        'exit_trades_threshold_points', 'timeframe', 'trade_side', 'group_key', 'group_symbols',
+        'session_start', 'session_end', 'aggregator', 'config',
+    )
+
+    def __init__(self, config, group_key, group_symbols, aggregator=None):
+        instrument_details = config['instrument_details']
+        self.instrument_token = int(config['instrument_token'])
+        self.tradingsymbol = instrument_details['tradingsymbol']
+        self.exchange = instrument_details['exchange']
+        self.lot_size = int(config['lot_size'])
+        self.percentage = float(config['trade_calculation_percentage'])
+        self.exit_trades_threshold_points = float(config['exit_trades_threshold_points'])
+        self.timeframe = int(config['timeframe'])
+        self.trade_side = config.get('trade_side', 'BOTH')
+        self.group_key = group_key
+        self.group_symbols = group_symbols
+        self.session_start, self.session_end = EQUITY_SESSION if self.exchange in EQUITY_EXCHANGES else DEFAULT_SESSION
+        self.aggregator = aggregator
+        self.config = config
+
+    def in_session(self, minute_of_day):
+        return self.session_start <= minute_of_day < self.session_end
+
+
+def compile_instrument_table(instruments, grouped_instruments, aggregators=None):
+    """
+    Compile the trade configuration into a table keyed by integer instrument token.
+
+    Parameters:
+    - instruments (list): tradeconfiguration documents.
+    - grouped_instruments (dict): Output of restructure_for_combined_threshold.
+    - aggregators (dict): CandleAggregator instances keyed by instrument_token as stored in the config.
+
+    Returns:
+    - dict: {instrument_token (int): InstrumentRuntime}
+    """
+    aggregators = aggregators or {}
+    group_symbols_by_key = {
+        group_key: frozenset(instrument['tradingsymbol'] for instrument in members)
+        for group_key, members in grouped_instruments.items()
+    }
+
+    table = {}
+    for config in instruments:
+        try:
+            group_key = config.get('exit_trades_threshold_points')
+            runtime = InstrumentRuntime(
+                config,
+                group_key=group_key,
+                group_symbols=group_symbols_by_key.get(group_key, frozenset()),
+                aggregator=aggregators.get(config['instrument_token']),
+            )
+        except (KeyError, TypeError, ValueError) as error:
+            logging.error(f"Skipping invalid trade configuration {config}: {error}")
+            continue
+        table[runtime.instrument_token] = runtime
+    return table
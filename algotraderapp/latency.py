@@ -0,0 +1,202 @@
+import time
+from bisect import bisect_left
+from . import candle_time
+
+# Tick path stages, in the order a tick passes them
+STAGES = (
+    'feed_lag',  # Batch arrival minus exchange_timestamp (second resolution)
+    'queue_wait',  # Arrival until processing of the tick starts
+    'candle_update',
+    'strategy_check',
+    'pnl_refresh',
+    'order_submit',  # Time the tick thread spends placing or submitting an order
+    'order_ack',  # Submit until the broker returned an order id
+)
+# Upper bounds of the histogram buckets in seconds, 1 microsecond to 10 seconds
+BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRIC_NAME = 'algotrader_stage_latency_seconds'
+INSTRUMENT_METRIC_NAME = 'algotrader_instrument_stage_latency_seconds'
+
+
+class Histogram:
+    """ Cumulative latency histogram on the fixed BUCKETS, the last count is the +Inf bucket. """
+
+    __slots__ = ('counts', 'total')
+
+    def __init__(self, counts=None, total=0.0):
+        self.counts = list(counts) if counts is not None else [0] * (len(BUCKETS) + 1)
+        self.total = total
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, fraction):
+        """ Upper bound of the bucket holding the fraction quantile, None when empty. """
+        count = self.count()
+        if not count:
+            return None
+        rank = fraction * count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank and bucket_count:
+                return BUCKETS[index] if index < len(BUCKETS) else float('inf')
+        return float('inf')
+
+
+class LatencyMetrics:
+    """
+    Per instrument latency histograms of the tick path stages.
+
+    Call sites check `enabled` before reading the clock, so switching the
+    metrics off leaves one attribute load per stage. An instrument's ticks
+    are processed by one thread at a time, so its histograms are updated
+    without a lock; aggregates are summed when they are read.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = {}  # (stage, instrument) -> Histogram
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+
+    def observe(self, stage, instrument, seconds):
+        histogram = self._histograms.get((stage, instrument))
+        if histogram is None:
+            histogram = self._histograms.setdefault((stage, instrument), Histogram())
+        histogram.observe(seconds)
+
+    def observe_arrival(self, ticks, received_at, symbols):
+        """
+        Record the feed lag of a batch and stamp its ticks with the arrival
+        time the queue_wait stage is measured from.
+
+        Parameters:
+        - received_at (datetime): Arrival time of the batch, IST.
+        - symbols (dict): instrument_token -> tradingsymbol, used as the instrument label.
+        """
+        received_perf = time.perf_counter()
+        received_epoch = candle_time.to_epoch(received_at) + received_at.microsecond / 1000000
+        for tick in ticks:
+            tick['received_perf'] = received_perf
+            exchange_timestamp = tick.get('exchange_timestamp')
+            if exchange_timestamp:
+                instrument_token = tick['instrument_token']
+                self.observe('feed_lag', symbols.get(instrument_token, instrument_token),
+                             max(0.0, received_epoch - candle_time.to_epoch(exchange_timestamp)))
+
+    def reset(self):
+        self._histograms = {}
+
+    def snapshot(self):
+        """ Histograms as plain data, picklable for the shard status reports. """
+        return {
+            'enabled': self.enabled,
+            'histograms': [
+                {'stage': stage, 'instrument': instrument, 'counts': list(histogram.counts), 'sum': histogram.total}
+                for (stage, instrument), histogram in list(self._histograms.items())
+            ],
+        }
+
+    def summary(self):
+        """ Count, mean and bucket p50/p99 in milliseconds per stage across all instruments. """
+        return summarize([self.snapshot()])
+
+
+def _merge(snapshots):
+    """ Merge snapshots into {(stage, instrument): Histogram}. """
+    merged = {}
+    for snapshot in snapshots:
+        for entry in snapshot.get('histograms', ()):
+            key = (entry['stage'], entry['instrument'])
+            histogram = Histogram(entry['counts'], entry['sum'])
+            if key in merged:
+                merged[key].merge(histogram)
+            else:
+                merged[key] = histogram
+    return merged
+
+
+def _aggregate(merged):
+    totals = {}
+    for (stage, _), histogram in merged.items():
+        totals.setdefault(stage, Histogram()).merge(histogram)
+    return totals
+
+
+def summarize(snapshots):
+    summary = {}
+    for stage, histogram in _aggregate(_merge(snapshots)).items():
+        count = histogram.count()
+        summary[stage] = {
+            'count': count,
+            'mean_ms': round(histogram.total / count * 1000, 4) if count else None,
+            'p50_ms': round(histogram.quantile(0.50) * 1000, 4) if count else None,
+            'p99_ms': round(histogram.quantile(0.99) * 1000, 4) if count else None,
+        }
+    return summary
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name, labels, histogram):
+    label_text = ','.join(f'{key}="{_label_value(value)}"' for key, value in labels)
+    prefix = label_text + ',' if label_text else ''
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound!r}"}} {cumulative}')
+    cumulative += histogram.counts[-1]
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+    lines.append(f'{name}_sum{{{label_text}}} {histogram.total!r}')
+    lines.append(f'{name}_count{{{label_text}}} {cumulative}')
+    return lines
+
+
+def _series_order(item):
+    (stage, instrument), _ = item
+    return (STAGES.index(stage) if stage in STAGES else len(STAGES), str(instrument))
+
+
+def render_prometheus(snapshots):
+    """
+    Render snapshots (one per process) in the Prometheus text exposition format.
+
+    Stages across all instruments are METRIC_NAME, per instrument series are
+    INSTRUMENT_METRIC_NAME, so summing the latter does not double count.
+    """
+    merged = _merge(snapshots)
+    enabled = any(snapshot.get('enabled') for snapshot in snapshots)
+    lines = [
+        '# HELP algotrader_latency_metrics_enabled Whether tick path latency metrics are being recorded.',
+        '# TYPE algotrader_latency_metrics_enabled gauge',
+        f'algotrader_latency_metrics_enabled {int(enabled)}',
+        f'# HELP {METRIC_NAME} Tick path stage latency across all instruments.',
+        f'# TYPE {METRIC_NAME} histogram',
+    ]
+    totals = _aggregate(merged)
+    for stage in STAGES:
+        if stage in totals:
+            lines.extend(_histogram_lines(METRIC_NAME, [('stage', stage)], totals[stage]))
+    lines.append(f'# HELP {INSTRUMENT_METRIC_NAME} Tick path stage latency per instrument.')
+    lines.append(f'# TYPE {INSTRUMENT_METRIC_NAME} histogram')
+    for (stage, instrument), histogram in sorted(merged.items(), key=_series_order):
+        lines.extend(_histogram_lines(INSTRUMENT_METRIC_NAME, [('stage', stage), ('instrument', instrument)], histogram))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,186 @@
+import os
+import sys
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Named channels for the tick and order paths: channel -> (file, default level, keep every n-th record)
+# Levels and sampling can be overridden per channel with LOG_<CHANNEL>_LEVEL and LOG_<CHANNEL>_SAMPLE.
+CHANNELS = {
+    'ticks': ('ticks.txt', 'INFO', 1),
+    'strategy': ('strategy_log.txt', 'INFO', 1),
+    'orders': ('order_placement.log', 'INFO', 1),
+    'pnl': ('profit_loss.log', 'INFO', 1),
+    'websocket': ('stop_websocket_run_script_.log', 'INFO', 1),
+}
+# Channel files go to LOG_DIR, the project directory by default, or the directory passed to setup().
+# The path is resolved once, so the files do not follow later working directory changes (backtests
+# and benchmarks run in a sandbox).
+LOG_DIR = os.path.abspath(os.getenv('LOG_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 50 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_log_queue = queue.SimpleQueue()
+_listener = None
+_handlers = []
+_file_handlers = []
+_setup_lock = threading.Lock()
+
+
+class _InProcessQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves message formatting to the listener thread.
+
+    The stock QueueHandler formats every record in the caller so it can be
+    pickled; our queue never leaves the process, so the tick thread only pays
+    for creating the record. Callers should pass values that are not mutated
+    afterwards (numbers, strings, snapshots) as logging arguments.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class _ChannelFilter(logging.Filter):
+    """ Route records of one channel logger to its file handler. """
+
+    def __init__(self, logger_name):
+        super().__init__()
+        self.logger_name = logger_name
+
+    def filter(self, record):
+        return record.name == self.logger_name
+
+
+class _RootFilter(logging.Filter):
+    """ Keep channel records out of the console handler. """
+
+    def filter(self, record):
+        return not record.name.startswith('algotrader.')
+
+
+class SamplingFilter(logging.Filter):
+    """ Keep one in every n records below WARNING, warnings and errors always pass. """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or next(self._counter) % self.every == 0
+
+
+def get_logger(channel):
+    """
+    Return the logger of a named channel.
+
+    Until setup() ran in the process the records go to the root logger,
+    importing the engine never creates log files.
+    """
+    return logging.getLogger(f'algotrader.{channel}')
+
+
+def setup(log_dir=None):
+    """
+    Route the root logger and every channel through one queue.
+
+    A single QueueListener thread formats records and writes them to
+    pre-opened, size rotated files, so the tick thread never blocks on disk.
+    Called by the process entry points: the WSGI and ASGI applications,
+    the shard processes and the backtest and benchmark commands. Safe to
+    call more than once, the first call decides the log directory.
+    """
+    global _listener, LOG_DIR
+    with _setup_lock:
+        if _listener is not None:
+            return
+        if _handlers:
+            # Already configured and shut down, only restart the listener
+            _listener = QueueListener(_log_queue, *_handlers, respect_handler_level=True)
+            _listener.start()
+            return
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = _handlers
+        if log_dir is not None:
+            LOG_DIR = os.path.abspath(log_dir)
+        os.makedirs(LOG_DIR, exist_ok=True)
+
+        console_handler = logging.StreamHandler(sys.stderr)
+        console_handler.setFormatter(formatter)
+        console_handler.addFilter(_RootFilter())
+        handlers.append(console_handler)
+
+        for channel, (file_name, level, sample_every) in CHANNELS.items():
+            logger_name = f'algotrader.{channel}'
+            file_handler = RotatingFileHandler(os.path.join(LOG_DIR, file_name), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+            file_handler.setFormatter(formatter)
+            file_handler.addFilter(_ChannelFilter(logger_name))
+            handlers.append(file_handler)
+            _file_handlers.append(file_handler)
+
+            logger = logging.getLogger(logger_name)
+            logger.setLevel(os.getenv(f'LOG_{channel.upper()}_LEVEL', level))
+            logger.propagate = False
+            logger.addHandler(_InProcessQueueHandler(_log_queue))
+            sample_every = int(os.getenv(f'LOG_{channel.upper()}_SAMPLE', sample_every))
+            if sample_every > 1:
+                logger.addFilter(SamplingFilter(sample_every))
+
+        root_logger = logging.getLogger()
+        root_logger.setLevel(os.getenv('LOG_LEVEL', 'INFO'))
+        root_logger.addHandler(_InProcessQueueHandler(_log_queue))
+
+        _listener = QueueListener(_log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def _reopen(file_handler, path=None):
+    file_handler.acquire()
+    try:
+        if file_handler.stream is not None:
+            file_handler.stream.close()
+        if path is not None:
+            file_handler.baseFilename = path
+        file_handler.stream = file_handler._open()
+    finally:
+        file_handler.release()
+
+
+def reopen():
+    """ Reopen the channel files, e.g. after the session cleanup deleted them. """
+    for file_handler in _file_handlers:
+        _reopen(file_handler)
+
+
+def set_file_suffix(suffix):
+    """
+    Switch this process to its own channel files, named with suffix before
+    the extension (ticks.txt -> ticks<suffix>.txt). Processes sharing LOG_DIR
+    would otherwise write and rotate the same files.
+    """
+    setup()
+    for file_handler, (file_name, _, _) in zip(_file_handlers, CHANNELS.values()):
+        root, extension = os.path.splitext(file_name)
+        _reopen(file_handler, os.path.join(LOG_DIR, f"{root}{suffix}{extension}"))
+
+
+def set_level(channel, level):
+    """ Change the level of a channel at runtime. """
+    get_logger(channel).setLevel(level)
+
+
+def shutdown():
+    """ Flush queued records and stop the listener thread. """
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
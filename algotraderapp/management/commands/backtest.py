@@ -0,0 +1,65 @@
+import json
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from algotraderapp import backtest
+from algotraderapp import candle_time
+from algotraderapp import log_channels
+
+
+class Command(BaseCommand):
+    help = "Replay recorded ticks through the trading engine against a simulated broker and print the trades and P&L."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ticks', help="JSON lines file of tick batches, or a tick recorder segment or directory")
+        parser.add_argument('--config', required=True,
+                            help="JSON file with the list of tradeconfiguration documents to trade")
+        parser.add_argument('--clock', choices=[candle_time.LOCAL_CLOCK, candle_time.EXCHANGE_CLOCK], default=None,
+                            help="Candle clock, defaults to CANDLE_CLOCK")
+        parser.add_argument('--conflation', action='store_true', help="Evaluate only the latest tick per instrument and batch")
+        parser.add_argument('--inline-orders', action='store_true',
+                            help="Place orders inline instead of through the synchronous order executor")
+        parser.add_argument('--slippage', type=float, default=0.0, help="Points every fill moves against the order")
+        parser.add_argument('--workdir', default=None, help="Directory for candle journals, a new temporary one by default")
+        parser.add_argument('--output', default=None, help="Write the result as JSON to this file")
+        parser.add_argument('--verbose-logs', action='store_true', help="Keep the tick and strategy log channels at their levels")
+        parser.add_argument('--log-dir', default=None, help="Directory for the channel log files, a new temporary one by default")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['config'], 'r') as file:
+                instruments = json.load(file)
+        except (OSError, json.JSONDecodeError) as error:
+            raise CommandError(f"Could not read the configuration: {error}")
+
+        # Never write into the live session's channel files
+        log_dir = options['log_dir'] or tempfile.mkdtemp(prefix='algotrader-logs-')
+        log_channels.setup(log_dir)
+
+        run_options = {}
+        if options['clock']:
+            run_options['candle_clock'] = options['clock']
+        if options['conflation']:
+            run_options['tick_conflation'] = True
+        try:
+            result = backtest.run_backtest(instruments, backtest.read_tick_batches(options['ticks']),
+                                           slippage=options['slippage'], workdir=options['workdir'],
+                                           quiet=not options['verbose_logs'], order_executor=not options['inline_orders'],
+                                           **run_options)
+        except OSError as error:
+            raise CommandError(f"Could not read the ticks: {error}")
+
+        result_data = result.to_dict()
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(result_data, file, indent=2)
+
+        for trade in result.trades:
+            self.stdout.write(f"{trade['time']}  {trade['tradingsymbol']:<24} {trade['transaction_type']:<4} "
+                              f"{trade['quantity']:>6} @ {trade['price']}  {trade['status']}")
+        for group_key, profit_loss in result.group_pnl.items():
+            self.stdout.write(f"Group {group_key}: {profit_loss:.2f} points")
+        if options['verbose_logs']:
+            self.stdout.write(f"Channel logs in {log_channels.LOG_DIR}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result_data['ticks']} ticks in {result_data['batches']} batches, {len(result.trades)} orders, "
+            f"{result_data['elapsed_seconds']}s ({result_data['speedup']}x real time)"))
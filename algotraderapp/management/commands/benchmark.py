@@ -0,0 +1,59 @@
+import json
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from algotraderapp import benchmark
+from algotraderapp import log_channels
+
+
+class Command(BaseCommand):
+    help = "Measure per tick latency and throughput of the candle, strategy, P&L and on_ticks paths on a synthetic feed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--instruments', type=int, default=10, help="Number of synthetic instruments")
+        parser.add_argument('--rate', type=int, default=5, help="Ticks per instrument per second")
+        parser.add_argument('--seconds', type=int, default=60, help="Seconds of feed to generate")
+        parser.add_argument('--history', type=int, default=100, help="Closed candles in every journal before the feed")
+        parser.add_argument('--timeframe', type=int, default=1, help="Candle timeframe in minutes")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--only', action='append', choices=benchmark.BENCHMARKS,
+                            help="Run only this benchmark, can be repeated")
+        parser.add_argument('--conflation', action='store_true', help="Run on_ticks with tick conflation")
+        parser.add_argument('--output', default=None, help="Write the results as JSON to this file")
+        parser.add_argument('--compare', default=None, help="Baseline results JSON to check for regressions")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Fraction a p50 or p99 may exceed the baseline before it counts as a regression")
+        parser.add_argument('--log-dir', default=None, help="Directory for the channel log files, a new temporary one by default")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], 'r') as file:
+                    baseline = json.load(file)
+            except (OSError, json.JSONDecodeError) as error:
+                raise CommandError(f"Could not read the baseline: {error}")
+
+        # Measure the queued logging of a live session without writing into its files
+        log_channels.setup(options['log_dir'] or tempfile.mkdtemp(prefix='algotrader-logs-'))
+
+        results = benchmark.run_benchmarks(instrument_count=options['instruments'], rate=options['rate'],
+                                           seconds=options['seconds'], history=options['history'],
+                                           timeframe=options['timeframe'], seed=options['seed'],
+                                           benchmarks=options['only'] or benchmark.BENCHMARKS,
+                                           tick_conflation=options['conflation'])
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+        for name, summary in results['results'].items():
+            self.stdout.write(f"{name:<15} p50 {summary['p50_us']:>9.2f}us  p99 {summary['p99_us']:>9.2f}us  "
+                              f"max {summary['max_us']:>10.2f}us  {summary['throughput_per_sec']:>12.1f} ticks/s  "
+                              f"({summary['calls']} calls)")
+
+        if baseline is not None:
+            regressions = benchmark.compare(baseline, results, tolerance=options['tolerance'])
+            for name, metric, previous, current in regressions:
+                self.stdout.write(self.style.ERROR(f"{name} {metric}: {previous}us -> {current}us"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} latency regressions against {options['compare']}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}"))
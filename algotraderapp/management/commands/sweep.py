@@ -0,0 +1,44 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from algotraderapp import sweep
+
+
+def _values(text, cast):
+    return [cast(value) for value in text.split(',') if value.strip()]
+
+
+class Command(BaseCommand):
+    help = "Sweep the breakout strategy over a grid of timeframes, percentages and exit thresholds on recorded 1 minute candles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('candles', nargs='+', help="1 minute candle files (journals or exported lists), one instrument each")
+        parser.add_argument('--timeframes', default='5,10,15', help="Comma separated candle timeframes in minutes")
+        parser.add_argument('--percentages', default='0,0.05,0.1,0.2',
+                            help="Comma separated trade_calculation_percentage values")
+        parser.add_argument('--thresholds', default='5,10,20,50',
+                            help="Comma separated exit_trades_threshold_points values")
+        parser.add_argument('--trade-side', choices=sweep.TRADE_SIDES, default='BOTH')
+        parser.add_argument('--processes', type=int, default=None, help="Worker processes, 1 runs in process")
+        parser.add_argument('--no-cache', action='store_true', help="Parse the candle files without the .npz cache")
+        parser.add_argument('--top', type=int, default=10, help="Number of parameter sets to print")
+        parser.add_argument('--output', default=None, help="Write all results as JSON to this file")
+
+    def handle(self, *args, **options):
+        try:
+            results = sweep.run_sweep(options['candles'], _values(options['timeframes'], int),
+                                      _values(options['percentages'], float), _values(options['thresholds'], float),
+                                      trade_side=options['trade_side'], processes=options['processes'],
+                                      cache=not options['no_cache'])
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f"Sweep failed: {error}")
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+        for result in results[:options['top']]:
+            self.stdout.write(f"timeframe {result['timeframe']:>3}  percentage {result['trade_calculation_percentage']:<6} "
+                              f"threshold {result['exit_trades_threshold_points']:<6} pnl {result['pnl']:>10.2f}  "
+                              f"max dd {result['max_drawdown']:>8.2f}  orders {result['orders']:>5}  "
+                              f"trips {result['round_trips']:>4} ({result['winning_trips']} won)")
+        self.stdout.write(self.style.SUCCESS(f"{len(results)} parameter sets over {len(options['candles'])} instruments"))
@@ -0,0 +1,190 @@
+import bisect
+import datetime
+import logging
+import threading
+
+TERMINAL_STATUSES = ('COMPLETE', 'REJECTED', 'CANCELLED')
+
+
+class OrderBook:
+    """
+    In-process copy of the day's order book.
+
+    The book is seeded once from kite.orders() and then kept current from the
+    KiteTicker on_order_update events. A low frequency reconciliation poll
+    repairs anything the socket missed; reconcile_listeners get every
+    fetched order list, so other copies of the book (the engine shards) can
+    merge it without polling themselves. Completed orders are indexed per
+    tradingsymbol and kept sorted by order_timestamp so the P&L path never has
+    to filter or sort the whole day's orders.
+    """
+
+    def __init__(self, kite, reconcile_interval=60):
+        self.kite = kite
+        self.reconcile_interval = reconcile_interval
+        self._orders = {}  # order_id -> latest order state
+        self._completed = {}  # tradingsymbol -> [(sort_key, order_id)]
+        self._order_ids_by_symbol = {}  # tradingsymbol -> {order_id}
+        self._generations = {}  # tradingsymbol -> bumped when a fill lands before existing ones
+        self._sequence = 0
+        self._sequence_by_order = {}
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._reconcile_thread = None
+        self.reconcile_listeners = []  # Called with every order list fetched by reconcile
+
+    def seed(self):
+        """ Load the full order book once from the REST API. """
+        return self.reconcile()
+
+    def reconcile(self):
+        """ Fetch kite.orders() and merge it into the book. """
+        try:
+            orders = self.kite.orders()
+        except Exception as error:
+            logging.error(f"Order book reconciliation failed: {error}")
+            return False
+        self.merge(orders)
+        for listener in self.reconcile_listeners:
+            try:
+                listener(orders)
+            except Exception as error:
+                logging.error(f"Error delivering reconciled orders: {error}")
+        return True
+
+    def merge(self, orders):
+        """ Merge a full order list, as returned by kite.orders(), into the book. """
+        with self._lock:
+            for order in orders:
+                self._apply(order, authoritative=True)
+
+    def on_order_update(self, ws, data):
+        """ KiteTicker on_order_update callback. """
+        try:
+            with self._lock:
+                self._apply(data)
+        except Exception as error:
+            logging.error(f"Error applying order update {data}: {error}")
+
+    def apply(self, order):
+        """ Merge a single order state into the book. """
+        with self._lock:
+            self._apply(order)
+
+    def _apply(self, order, authoritative=False):
+        order_id = order.get('order_id')
+        if not order_id:
+            return
+        order = dict(order)
+        order_timestamp = order.get('order_timestamp')
+        if isinstance(order_timestamp, str) and len(order_timestamp) == 19:
+            # Socket updates carry string timestamps, REST responses carry datetimes
+            order['order_timestamp'] = datetime.datetime.strptime(order_timestamp, '%Y-%m-%d %H:%M:%S')
+
+        existing = self._orders.get(order_id)
+        if (existing is not None and existing.get('status') == 'COMPLETE' and order.get('status') == 'COMPLETE' and
+                (existing.get('average_price'), existing.get('quantity')) != (order.get('average_price'), order.get('quantity'))):
+            # A fill that was already consumed changed, consumers have to replay
+            self._generations[order.get('tradingsymbol')] = self._generations.get(order.get('tradingsymbol'), 0) + 1
+        if (not authoritative and existing is not None and
+                existing.get('status') in TERMINAL_STATUSES and order.get('status') not in TERMINAL_STATUSES):
+            # Socket updates can arrive out of order, never step back from a final state
+            return
+
+        if order_id not in self._sequence_by_order:
+            self._sequence += 1
+            self._sequence_by_order[order_id] = self._sequence
+        self._orders[order_id] = order
+        self._order_ids_by_symbol.setdefault(order.get('tradingsymbol'), set()).add(order_id)
+
+        if order.get('status') == 'COMPLETE' and order.get('transaction_type') in ['BUY', 'SELL']:
+            entries = self._completed.setdefault(order['tradingsymbol'], [])
+            if not any(entry_order_id == order_id for _, entry_order_id in entries):
+                sort_key = (order.get('order_timestamp') or datetime.datetime.min, self._sequence_by_order[order_id])
+                position = bisect.bisect(entries, (sort_key, order_id))
+                if position != len(entries):
+                    # Fills already consumed incrementally are now out of order
+                    self._generations[order['tradingsymbol']] = self._generations.get(order['tradingsymbol'], 0) + 1
+                entries.insert(position, (sort_key, order_id))
+
+    def get(self, order_id):
+        with self._lock:
+            return self._orders.get(order_id)
+
+    def order_status(self, order_id, refresh_if_missing=True):
+        """
+        Return the latest known status of an order.
+
+        An order that was just placed from the tick thread cannot have been
+        updated from the socket yet, so its history is fetched once and
+        merged into the book.
+        """
+        with self._lock:
+            order = self._orders.get(order_id)
+        if order is None and refresh_if_missing:
+            order = self.refresh_order(order_id)
+        return order.get('status') if order else None
+
+    def refresh_order(self, order_id):
+        """ Fetch the history of a single order and merge its latest state. """
+        try:
+            history = self.kite.order_history(order_id)
+        except Exception as error:
+            logging.error(f"Error fetching order history for {order_id}: {error}")
+            return None
+        if not history:
+            return None
+        with self._lock:
+            self._apply(history[-1], authoritative=True)
+            return self._orders.get(order_id)
+
+    def completed_orders(self, tradingsymbol):
+        """ Completed BUY/SELL orders for a symbol sorted by order_timestamp. """
+        with self._lock:
+            return [self._orders[order_id] for _, order_id in self._completed.get(tradingsymbol, [])]
+
+    def completed_orders_since(self, tradingsymbol, generation, start):
+        """
+        Return the completed orders a consumer has not applied yet.
+
+        Returns:
+        - tuple: (generation, rebuild, orders). When rebuild is True the
+          consumer must reset its state and apply orders from the beginning.
+        """
+        with self._lock:
+            current_generation = self._generations.get(tradingsymbol, 0)
+            entries = self._completed.get(tradingsymbol, [])
+            if generation != current_generation:
+                return current_generation, True, [self._orders[order_id] for _, order_id in entries]
+            return current_generation, False, [self._orders[order_id] for _, order_id in entries[start:]]
+
+    def net_quantity(self, tradingsymbol):
+        """ Net filled quantity for a symbol, positive when long and negative when short. """
+        with self._lock:
+            net_quantity = 0
+            for order_id in self._order_ids_by_symbol.get(tradingsymbol, ()):
+                order = self._orders[order_id]
+                filled_quantity = order.get('filled_quantity')
+                if filled_quantity is None:
+                    filled_quantity = order.get('quantity', 0) if order.get('status') == 'COMPLETE' else 0
+                if order.get('transaction_type') == 'BUY':
+                    net_quantity += filled_quantity
+                elif order.get('transaction_type') == 'SELL':
+                    net_quantity -= filled_quantity
+            return net_quantity
+
+    def start_reconciliation(self):
+        """ Start the background reconciliation poll. """
+        if self._reconcile_thread is not None:
+            return
+        self._stop_event.clear()
+        self._reconcile_thread = threading.Thread(target=self._reconcile_loop, name="order-book-reconcile", daemon=True)
+        self._reconcile_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._reconcile_thread = None
+
+    def _reconcile_loop(self):
+        while not self._stop_event.wait(self.reconcile_interval):
+            self.reconcile()
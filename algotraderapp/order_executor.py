@@ -0,0 +1,202 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from .broker import request_priority, order_priority
+
+# Outcome of an order intent
+ACCEPTED = 'accepted'  # Placed and not rejected by the broker
+REJECTED = 'rejected'  # Placed and rejected by the broker
+FAILED = 'failed'  # place_order raised or no order id came back
+
+# Returned by the aggregator in place of an order id while the intent is still on the executor
+SUBMITTED = 'submitted'
+
+
+def place_market_order(kite, exchange, trading_symbol, order_type, quantity):
+    """
+    Place an intraday market order.
+
+    Parameters:
+    - order_type (str): "Buy" or "Sell", anything else places nothing.
+
+    Returns:
+    - str: The order id, or None when no order was placed.
+    """
+    if order_type == "Buy":
+        transaction_type = kite.TRANSACTION_TYPE_BUY
+    elif order_type == "Sell":
+        transaction_type = kite.TRANSACTION_TYPE_SELL
+    else:
+        return None
+    return kite.place_order(
+        variety=kite.VARIETY_REGULAR,
+        exchange=exchange,
+        tradingsymbol=trading_symbol,
+        transaction_type=transaction_type,
+        quantity=quantity,
+        order_type=kite.ORDER_TYPE_MARKET,  # Use MARKET or LIMIT based on your preference
+        product=kite.PRODUCT_MIS,  # For intraday trading
+    )
+
+
+class OrderIntent:
+    """ An order the strategy wants placed, as handed to the executor. """
+
+    __slots__ = ('instrument_token', 'trading_symbol', 'exchange', 'order_type', 'quantity',
+                 'stop_loss', 'price', 'order_mode', 'submitted_at')
+
+    def __init__(self, instrument_token, trading_symbol, exchange, order_type, quantity, stop_loss, price=None, order_mode=None):
+        self.instrument_token = instrument_token
+        self.trading_symbol = trading_symbol
+        self.exchange = exchange
+        self.order_type = order_type
+        self.quantity = quantity
+        self.stop_loss = stop_loss
+        self.price = price
+        self.order_mode = order_mode
+        self.submitted_at = None
+
+
+class OrderEvent:
+    """ Result of an intent, delivered back to the aggregator that submitted it. """
+
+    __slots__ = ('kind', 'intent', 'order_id', 'status', 'ack_latency', 'error')
+
+    def __init__(self, kind, intent, order_id=None, status=None, ack_latency=None, error=None):
+        self.kind = kind
+        self.intent = intent
+        self.order_id = order_id
+        self.status = status
+        self.ack_latency = ack_latency  # Seconds from submit to the broker returning an order id
+        self.error = error
+
+
+class OrderExecutor:
+    """
+    Places orders on a thread pool so broker round trips never block tick processing.
+
+    Intents for the same instrument run one at a time in submission order
+    (square off before reverse), different instruments run in parallel.
+    An instrument is in flight from submit until its last intent finished,
+    callers use in_flight() to hold back new decisions for it. Every
+    intent resolves its Future with an OrderEvent, which is also passed to
+    the on_event callback given at submit time.
+
+    A synchronous executor places every intent on the submitting thread
+    before submit returns. The events still go through the same callback,
+    so the backtest runs the live submit/apply_order_events flow and stays
+    deterministic.
+    """
+
+    def __init__(self, kite, order_book=None, max_workers=4, synchronous=False):
+        self.kite = kite
+        self.order_book = order_book
+        self.synchronous = synchronous
+        self._pool = None if synchronous else ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="order-executor")
+        self._pending = {}  # instrument_token -> deque of (intent, future, on_event)
+        self._condition = threading.Condition()
+        self.submitted = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.ack_count = 0
+        self.ack_total = 0.0
+        self.ack_max = 0.0
+        self.ack_last = 0.0
+
+    def submit(self, intent, on_event=None):
+        """ Queue an intent for its instrument and return a Future of its OrderEvent. """
+        future = Future()
+        intent.submitted_at = time.monotonic()
+        with self._condition:
+            self.submitted += 1
+            pending = self._pending.get(intent.instrument_token)
+            start_runner = pending is None
+            if start_runner:
+                pending = self._pending[intent.instrument_token] = deque()
+            pending.append((intent, future, on_event))
+        if start_runner:
+            if self._pool is None:
+                self._run_instrument(intent.instrument_token)
+            else:
+                self._pool.submit(self._run_instrument, intent.instrument_token)
+        return future
+
+    def in_flight(self, instrument_token):
+        return instrument_token in self._pending
+
+    def _run_instrument(self, instrument_token):
+        while True:
+            with self._condition:
+                pending = self._pending[instrument_token]
+                if not pending:
+                    del self._pending[instrument_token]
+                    self._condition.notify_all()
+                    return
+                intent, future, on_event = pending.popleft()
+
+            event = self._execute(intent)
+            future.set_result(event)
+            if on_event is not None:
+                try:
+                    on_event(event)
+                except Exception as error:
+                    logging.error(f"Error delivering order event for {intent.trading_symbol}: {error}")
+
+    def _execute(self, intent):
+        # Exits go ahead of entries when the broker client is rate limited
+        with request_priority(order_priority(intent.order_mode)):
+            return self._place(intent)
+
+    def _place(self, intent):
+        try:
+            order_id = place_market_order(self.kite, intent.exchange, intent.trading_symbol, intent.order_type, intent.quantity)
+        except Exception as error:
+            with self._condition:
+                self.failed += 1
+            return OrderEvent(FAILED, intent, error=error)
+        ack_latency = time.monotonic() - intent.submitted_at
+        if not order_id:
+            with self._condition:
+                self.failed += 1
+            return OrderEvent(FAILED, intent, ack_latency=ack_latency)
+
+        status = self.order_book.order_status(order_id) if self.order_book is not None else None
+        kind = REJECTED if status == 'REJECTED' else ACCEPTED
+        with self._condition:
+            self.ack_count += 1
+            self.ack_total += ack_latency
+            self.ack_last = ack_latency
+            if ack_latency > self.ack_max:
+                self.ack_max = ack_latency
+            if kind == REJECTED:
+                self.rejected += 1
+            else:
+                self.accepted += 1
+        return OrderEvent(kind, intent, order_id=order_id, status=status, ack_latency=ack_latency)
+
+    def drain(self, timeout=None):
+        """ Block until no intent is queued or running. """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending, timeout)
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+
+    def metrics(self):
+        with self._condition:
+            return {
+                'submitted': self.submitted,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'in_flight': len(self._pending),
+                'ack_latency_ms': {
+                    'last': round(self.ack_last * 1000, 3),
+                    'avg': round(self.ack_total / self.ack_count * 1000, 3) if self.ack_count else 0.0,
+                    'max': round(self.ack_max * 1000, 3),
+                },
+            }
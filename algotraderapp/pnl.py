@@ -0,0 +1,326 @@
+import os
+import json
+import logging
+import threading
+from multiprocessing import shared_memory
+
+
+class PositionPnL:
+    """
+    Incremental per-share P&L for a single tradingsymbol.
+
+    Fills are applied once, in order_timestamp order, using the same rules as
+    the original full rescan: the first fill opens a position, an opposite fill
+    of equal or smaller quantity books the per-share difference (partial exits
+    reduce the open quantity), and larger opposite fills are ignored. Realized
+    P&L only changes when a fill arrives, unrealized P&L is computed from the
+    last price in O(1).
+    """
+
+    def __init__(self, tradingsymbol=None):
+        self.tradingsymbol = tradingsymbol
+        self.generation = None  # Order book generation the fills were applied from
+        self.applied_fills = 0
+        self.reset()
+
+    def reset(self):
+        self.realized_profit_loss_per_share = 0
+        self.open_position = False
+        self.open_price = None
+        self.open_quantity = 0
+        self.current_order_type = None
+        self.applied_fills = 0
+
+    def _reset_position(self):
+        self.open_position = False
+        self.open_price = None
+        self.open_quantity = 0
+        self.current_order_type = None
+
+    def apply_fill(self, order):
+        """ Apply one completed BUY/SELL order. """
+        avg_price = order['average_price']
+        quantity = order['quantity']
+        transaction_type = order['transaction_type']
+        self.applied_fills += 1
+
+        if transaction_type == 'BUY':
+            if not self.open_position:
+                # Open a new Buy position
+                self.open_price = avg_price
+                self.open_quantity = quantity
+                self.current_order_type = "Buy"
+                self.open_position = True
+            elif self.current_order_type == "Sell":
+                if self.open_quantity == quantity:
+                    # Fully close Sell position
+                    self.realized_profit_loss_per_share += (self.open_price - avg_price)
+                    self._reset_position()
+                elif quantity < self.open_quantity:
+                    # Partially close Sell position
+                    self.realized_profit_loss_per_share += (self.open_price - avg_price)
+                    self.open_quantity -= quantity
+
+        elif transaction_type == 'SELL':
+            if not self.open_position:
+                # Open a new Sell position
+                self.open_price = avg_price
+                self.open_quantity = quantity
+                self.current_order_type = "Sell"
+                self.open_position = True
+            elif self.current_order_type == "Buy":
+                if self.open_quantity == quantity:
+                    # Fully close Buy position
+                    self.realized_profit_loss_per_share += (avg_price - self.open_price)
+                    self._reset_position()
+                elif quantity < self.open_quantity:
+                    # Partially close Buy position
+                    self.realized_profit_loss_per_share += (avg_price - self.open_price)
+                    self.open_quantity -= quantity
+
+    def sync(self, order_book):
+        """
+        Apply the fills the order book received since the last sync.
+
+        If a fill was inserted before fills that were already applied (late
+        socket update or reconciliation) the position is rebuilt from scratch.
+        """
+        generation, rebuild, orders = order_book.completed_orders_since(
+            self.tradingsymbol, self.generation, self.applied_fills)
+        if rebuild:
+            self.reset()
+        self.generation = generation
+        for order in orders:
+            self.apply_fill(order)
+
+    def unrealized_profit_loss_per_share(self, current_price):
+        if self.open_position:
+            if self.current_order_type == "Buy":
+                return current_price - self.open_price
+            if self.current_order_type == "Sell":
+                return self.open_price - current_price
+        return 0
+
+    def total_profit_loss_per_share(self, current_price):
+        return self.realized_profit_loss_per_share + self.unrealized_profit_loss_per_share(current_price)
+
+
+class ThresholdGroupPnL:
+    """
+    Thread-safe P&L per tradingsymbol with a running total per threshold group.
+
+    Groups are the 'exit_trades_threshold_points' buckets produced by
+    WebSocketHandler.restructure_for_combined_threshold. Every update recomputes
+    the totals of the groups the symbol belongs to, so reading a group total in
+    the tick loop is a single dict lookup. A background thread persists a
+    snapshot to current_profit_loss.json whenever values changed, keeping file
+    I/O off the tick path.
+    """
+
+    def __init__(self, grouped_instruments=None, snapshot_path="current_profit_loss.json", snapshot_interval=1.0):
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._values = {}  # tradingsymbol -> P/L per share
+        self._group_members = {}  # group key -> [tradingsymbol]
+        self._group_totals = {}  # group key -> running total
+        self._groups_by_symbol = {}  # tradingsymbol -> [group key]
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop_event = threading.Event()
+        self._writer_thread = None
+        if grouped_instruments:
+            self.set_groups(grouped_instruments)
+
+    def set_groups(self, grouped_instruments):
+        """ Register threshold groups as returned by restructure_for_combined_threshold. """
+        with self._lock:
+            self._group_members = {
+                group_key: [instrument['tradingsymbol'] for instrument in instruments]
+                for group_key, instruments in grouped_instruments.items()
+            }
+            self._groups_by_symbol = {}
+            for group_key, members in self._group_members.items():
+                for tradingsymbol in members:
+                    self._groups_by_symbol.setdefault(tradingsymbol, []).append(group_key)
+            for group_key in self._group_members:
+                self._recompute_group(group_key)
+
+    def load_snapshot(self):
+        """ Seed values from a previously written snapshot, if there is one. """
+        try:
+            with open(self.snapshot_path, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as error:
+            logging.error(f"Could not load P&L snapshot {self.snapshot_path}: {error}")
+            return
+        self.update_many(data)
+
+    def update(self, tradingsymbol, profit_loss):
+        self.update_many({tradingsymbol: profit_loss})
+
+    def update_many(self, profit_loss_data):
+        with self._lock:
+            changed_groups = set()
+            for tradingsymbol, profit_loss in profit_loss_data.items():
+                self._values[tradingsymbol] = profit_loss
+                changed_groups.update(self._groups_by_symbol.get(tradingsymbol, ()))
+            for group_key in changed_groups:
+                self._recompute_group(group_key)
+        self._dirty.set()
+
+    def _recompute_group(self, group_key):
+        # Groups hold a handful of symbols, summing in member order keeps totals identical to the old file based sum
+        self._group_totals[group_key] = sum([self._values.get(tradingsymbol, 0) for tradingsymbol in self._group_members[group_key]])
+
+    def group_total(self, group_key):
+        """ Running total for a threshold group, raises KeyError for unknown groups. """
+        return self._group_totals[group_key]
+
+    def total(self, tradingsymbols):
+        """ Sum of the P/L values for an arbitrary list of symbols. """
+        with self._lock:
+            return sum([self._values.get(tradingsymbol, 0) for tradingsymbol in tradingsymbols])
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def start(self):
+        """ Start the background snapshot writer. """
+        if self._writer_thread is not None:
+            return
+        self._stop_event.clear()
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="pnl-snapshot-writer", daemon=True)
+        self._writer_thread.start()
+
+    def stop(self):
+        """ Stop the writer and flush the latest values. """
+        self._stop_event.set()
+        writer_thread, self._writer_thread = self._writer_thread, None
+        if writer_thread is not None:
+            writer_thread.join(timeout=5)
+        self.write_snapshot()
+
+    def write_snapshot(self):
+        self._dirty.clear()
+        temp_path = self.snapshot_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(self.snapshot(), file, indent=4)
+            os.replace(temp_path, self.snapshot_path)
+            return True
+        except Exception as error:
+            logging.error(f"An error occurred while writing the P&L snapshot: {error}")
+            return False
+
+    def _writer_loop(self):
+        while not self._stop_event.is_set():
+            if self._dirty.wait(self.snapshot_interval):
+                self.write_snapshot()
+                # Coalesce bursts of updates into one write per interval
+                self._stop_event.wait(self.snapshot_interval)
+
+
+class SharedGroupPnL(ThresholdGroupPnL):
+    """
+    ThresholdGroupPnL backed by a shared memory table, for the sharded engine.
+
+    Every tradingsymbol owns one float64 slot; worker processes write the
+    slots of the symbols they trade and read group totals across all shards
+    straight from the table. The layout (symbol slots and group members) is
+    defined by the engine for all shards at once and slots are never
+    reassigned, so a config reload keeps the running values. Only the owning
+    process writes the current_profit_loss.json snapshot.
+    """
+
+    def __init__(self, shm, layout, owner=False, **kwargs):
+        self._shm = shm
+        self._table = shm.buf.cast('d')
+        self.owner = owner
+        self._slots = {}  # tradingsymbol -> slot
+        self._group_slots = {}  # group key -> [slot]
+        super().__init__(**kwargs)
+        self.set_layout(layout)
+
+    @classmethod
+    def create(cls, layout, capacity=1024, **kwargs):
+        shm = shared_memory.SharedMemory(create=True, size=capacity * 8)
+        shm.buf[:] = bytes(capacity * 8)
+        return cls(shm, layout, owner=True, **kwargs)
+
+    @classmethod
+    def attach(cls, name, layout, **kwargs):
+        return cls(shared_memory.SharedMemory(name=name), layout, **kwargs)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def capacity(self):
+        return len(self._table)
+
+    def set_layout(self, layout):
+        """
+        Apply a layout as built by the engine.
+
+        Parameters:
+        - layout (dict): {'symbols': [tradingsymbol, ...] (index is the slot),
+          'groups': {group key: [tradingsymbol, ...]}}
+        """
+        if len(layout['symbols']) > self.capacity:
+            raise ValueError(f"Shared P&L table holds {self.capacity} symbols, layout has {len(layout['symbols'])}")
+        with self._lock:
+            self._slots = {tradingsymbol: slot for slot, tradingsymbol in enumerate(layout['symbols'])}
+            self._group_slots = {
+                group_key: [self._slots[tradingsymbol] for tradingsymbol in members]
+                for group_key, members in layout['groups'].items()
+            }
+
+    def set_groups(self, grouped_instruments):
+        # Group membership spans all shards and comes from the engine layout
+        pass
+
+    def update_many(self, profit_loss_data):
+        for tradingsymbol, profit_loss in profit_loss_data.items():
+            slot = self._slots.get(tradingsymbol)
+            if slot is not None:
+                self._table[slot] = profit_loss
+        self._dirty.set()
+
+    def group_total(self, group_key):
+        """ Total of a threshold group across all shards, raises KeyError for unknown groups. """
+        table = self._table
+        return sum([table[slot] for slot in self._group_slots[group_key]])
+
+    def total(self, tradingsymbols):
+        table = self._table
+        return sum([table[self._slots[tradingsymbol]] for tradingsymbol in tradingsymbols if tradingsymbol in self._slots])
+
+    def snapshot(self):
+        return {tradingsymbol: self._table[slot] for tradingsymbol, slot in self._slots.items()}
+
+    def start(self):
+        if self.owner:
+            super().start()
+
+    def stop(self):
+        if self.owner:
+            super().stop()
+
+    def _writer_loop(self):
+        # Workers update the table from other processes, so poll for changes instead of waiting on _dirty
+        last_snapshot = None
+        while not self._stop_event.wait(self.snapshot_interval):
+            snapshot = self.snapshot()
+            if snapshot != last_snapshot and self.write_snapshot():
+                last_snapshot = snapshot
+
+    def close(self):
+        """ Release the mapping, the owner also removes the shared memory block. """
+        self._table.release()
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
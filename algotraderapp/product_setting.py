@@ -4,7 +4,52 @@ mongo_port = "27017"
 mongo_username = "admin"
 mongo_password = "adminpassword"
 mongo_database = "AlgoBot"
+# One pooled MongoClient per process, see repository.get_client
+MONGO_MAX_POOL_SIZE = 50
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000
+# Seconds the in-process trade configuration copy is trusted without a local write
+TRADE_CONFIGURATION_CACHE_TTL = 30
 # Redis configuration
 REDIS_HOST = 'localhost'  # Change as needed
 REDIS_PORT = 6379         # Change as needed
-REDIS_DB = 0              # Change as needed
\ No newline at end of file
+REDIS_DB = 0              # Change as needed
+# Candle clock: "local" buckets ticks by arrival time, "exchange" by the tick's exchange_timestamp
+CANDLE_CLOCK = "local"
+# Close candles on their interval boundary from a timer. Unlike the tick driven close, intervals without
+# ticks get a flat candle at the last price with zero volume, see CandleAggregator.close_candle
+CANDLE_CLOSE_TIMER = True
+# Candles kept in memory per instrument, the strategy needs the last three, the journal keeps all of them
+CANDLE_HISTORY_DEPTH = 100
+# Tick ingestion: worker shards (0 processes ticks in the socket thread), queue size per shard
+# and overflow policy ("block", "drop_oldest" or "conflate")
+TICK_QUEUE_SHARDS = 4
+TICK_QUEUE_MAXSIZE = 10000
+TICK_QUEUE_POLICY = "block"
+# Run stop-loss, P&L and strategy only on the latest tick per instrument in a batch, and only when the price moved
+TICK_CONFLATION = False
+# Sharded engine: worker processes (0 runs the single process WebSocketHandler), queue size per
+# worker and symbol capacity of the shared threshold group P&L table
+ENGINE_PROCESSES = 0
+ENGINE_QUEUE_MAXSIZE = 10000
+ENGINE_PNL_CAPACITY = 1024
+# Threads placing orders off the tick thread (0 places orders inline)
+ORDER_EXECUTOR_WORKERS = 4
+# Broker REST client: keep-alive connections in the pool and retries of rate limited (429) requests
+BROKER_POOL_SIZE = 10
+BROKER_MAX_RETRIES = 2
+# Record every tick batch to per day binary segment files in TICK_RECORDER_DIR, with the market depth if enabled
+TICK_RECORDER = True
+TICK_RECORDER_DIR = "tick_data"
+TICK_RECORDER_DEPTH = False
+# Per stage tick path latency histograms, served by /latency_metrics and switchable at runtime
+LATENCY_METRICS = False
+# Send ticks, candles, order signals and group P&L to the channel layer for live viewers, every interval seconds at most
+LIVE_BROADCAST = True
+LIVE_BROADCAST_INTERVAL = 0.25
+# Updates per second a viewer gets by default and at most, and instruments one viewer may subscribe to
+BROADCAST_CLIENT_RATE = 4
+BROADCAST_CLIENT_MAX_RATE = 10
+BROADCAST_CLIENT_MAX_INSTRUMENTS = 200
+# Instrument dump cache: saved per day in INSTRUMENT_MASTER_DIR, stale from INSTRUMENT_MASTER_REFRESH_TIME (IST hour, minute)
+INSTRUMENT_MASTER_DIR = "instrument_data"
+INSTRUMENT_MASTER_REFRESH_TIME = (8, 30)
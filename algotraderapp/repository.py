@@ -0,0 +1,245 @@
+import copy
+import time
+import queue
+import atexit
+import logging
+import datetime
+import threading
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from pymongo.errors import PyMongoError
+from . import candle_time
+from .product_setting import mongo_url, mongo_port, mongo_username, mongo_password, mongo_database
+from .product_setting import MONGO_MAX_POOL_SIZE, MONGO_SERVER_SELECTION_TIMEOUT_MS, TRADE_CONFIGURATION_CACHE_TTL
+
+CONFIGURATION_COLLECTION = 'tradeconfiguration'
+CONFIGURATION_LOG_COLLECTION = 'tradeconfigurationlog'
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    The process wide MongoClient.
+
+    MongoClient keeps a connection pool and is thread safe, so every view and
+    thread shares one instead of paying a connection handshake per request.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(f"mongodb://{mongo_username}:{mongo_password}@{mongo_url}:{mongo_port}/",
+                                      maxPoolSize=MONGO_MAX_POOL_SIZE,
+                                      serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS)
+    return _client
+
+
+def get_database(name=mongo_database):
+    return get_client()[name]
+
+
+class AuditLog:
+    """
+    Writes tradeconfigurationlog entries from a background thread.
+
+    record() stamps and copies the entry and returns at once; the writer
+    inserts queued entries in batches. Entries still queued at exit are
+    written by the atexit hook.
+    """
+
+    def __init__(self, collection_name=CONFIGURATION_LOG_COLLECTION, batch_size=100):
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        atexit.register(self.close)
+
+    def record(self, document, action):
+        """ Queue an audit entry for a configuration document as it was before the action, returns a copy of it. """
+        entry = copy.deepcopy(document)
+        if '_id' in entry:
+            entry['old_id'] = str(entry.pop('_id'))
+        entry['action'] = action
+        entry['timeofaction'] = str(datetime.datetime.now(candle_time.IST))
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="config-audit", daemon=True)
+                    self._thread.start()
+        self._queue.put(entry)
+        # insert_many adds _id to the queued entry
+        return dict(entry)
+
+    def close(self, timeout=10):
+        """ Write the queued entries and stop the writer. """
+        thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        stop = False
+        while not stop:
+            entries = []
+            item = self._queue.get()
+            while item is not None:
+                entries.append(item)
+                if len(entries) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                stop = True
+            if entries:
+                self._write(entries)
+
+    def _write(self, entries):
+        try:
+            get_database()[self.collection_name].insert_many(entries, ordered=False)
+            self.written += len(entries)
+        except PyMongoError as error:
+            self.failed += len(entries)
+            logging.error(f"Failed to write {len(entries)} trade configuration audit entries: {error}")
+
+
+class TradeConfigurationRepository:
+    """
+    Data access for the tradeconfiguration collection.
+
+    Reads are served from an in-process copy of the collection. Every write
+    through the repository bumps version, and the next read reloads the copy;
+    the copy also expires after cache_ttl seconds so writes made by other
+    processes show up. ensure_indexes() is called once when the server starts.
+    Returned documents are copies without _id, callers may change them.
+    """
+
+    def __init__(self, audit_log=None, cache_ttl=TRADE_CONFIGURATION_CACHE_TTL):
+        self.audit_log = audit_log if audit_log is not None else AuditLog()
+        self.cache_ttl = cache_ttl
+        self.version = 0
+        self._lock = threading.Lock()  # Serializes cache loads
+        self._version_lock = threading.Lock()
+        self._cache = None  # (version, loaded_at, {instrument_token: document})
+        self.hits = 0
+        self.loads = 0
+
+    def collection(self):
+        return get_database()[CONFIGURATION_COLLECTION]
+
+    def ensure_indexes(self):
+        """
+        Unique instrument_token on the configuration, token and time on the audit log.
+
+        Called at server start. Raises the PyMongoError when an index cannot be
+        created, for example duplicate tokens in an old collection, so the
+        server does not start without them.
+        """
+        database = get_database()
+        try:
+            database[CONFIGURATION_COLLECTION].create_index([('instrument_token', ASCENDING)], unique=True,
+                                                            name='instrument_token_unique')
+            database[CONFIGURATION_LOG_COLLECTION].create_index([('instrument_token', ASCENDING), ('timeofaction', ASCENDING)],
+                                                                name='instrument_token_timeofaction')
+        except PyMongoError as error:
+            logging.error(f"Could not create the trade configuration indexes: {error}")
+            raise
+
+    def _fresh(self, cache):
+        return cache is not None and cache[0] == self.version and time.monotonic() - cache[1] < self.cache_ttl
+
+    def _documents(self):
+        cache = self._cache
+        if self._fresh(cache):
+            self.hits += 1
+            return cache[2]
+        with self._lock:
+            # Another request may have loaded it while this one waited
+            cache = self._cache
+            if self._fresh(cache):
+                return cache[2]
+            version = self.version
+            documents = {document['instrument_token']: document for document in self.collection().find({}, {'_id': 0})}
+            # A write during the load changed version, the next read loads again
+            self._cache = (version, time.monotonic(), documents)
+            self.loads += 1
+            return documents
+
+    def invalidate(self):
+        with self._version_lock:
+            self.version += 1
+
+    def get(self, instrument_token):
+        document = self._documents().get(instrument_token)
+        return copy.deepcopy(document) if document is not None else None
+
+    def list(self):
+        return copy.deepcopy(list(self._documents().values()))
+
+    def insert(self, document):
+        """ Insert a configuration, returns the inserted id. """
+        try:
+            return self.collection().insert_one(dict(document)).inserted_id
+        finally:
+            self.invalidate()
+
+    def update(self, instrument_token, data):
+        """
+        Update fields of a configuration and audit the previous version.
+
+        Returns:
+        - tuple: (modified count, audit entry, updated document), (0, None, None) when not found.
+        """
+        collection = self.collection()
+        previous = collection.find_one({'instrument_token': instrument_token})
+        if previous is None:
+            return 0, None, None
+        updated = previous
+        if data:
+            try:
+                updated = collection.find_one_and_update({'instrument_token': instrument_token}, {'$set': data},
+                                                         return_document=ReturnDocument.AFTER)
+            finally:
+                self.invalidate()
+            if updated is None:
+                # Deleted since it was read
+                return 0, None, None
+        entry = self.audit_log.record(previous, 'updation')
+        # $set with the stored values leaves the document as it was
+        modified_count = int(updated != previous)
+        updated = dict(updated)
+        updated.pop('_id', None)
+        return modified_count, entry, updated
+
+    def delete(self, instrument_token):
+        """
+        Delete a configuration and audit it.
+
+        Returns:
+        - tuple: (acknowledged, audit entry), (False, None) when not found.
+        """
+        collection = self.collection()
+        previous = collection.find_one({'instrument_token': instrument_token})
+        if previous is None:
+            return False, None
+        entry = self.audit_log.record(previous, 'deletion')
+        try:
+            result = collection.delete_one({'instrument_token': instrument_token})
+        finally:
+            self.invalidate()
+        return result.acknowledged, entry
+
+    def metrics(self):
+        return {
+            'version': self.version,
+            'cache_hits': self.hits,
+            'cache_loads': self.loads,
+            'audit_written': self.audit_log.written,
+            'audit_failed': self.audit_log.failed,
+        }
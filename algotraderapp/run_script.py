@@ -1,18 +1,30 @@
-import os
 import threading
-import json
 import logging
 from django.http import JsonResponse
 from kiteconnect import KiteConnect, KiteTicker
 import time
-import datetime
-from .product_setting import REDIS_HOST, REDIS_PORT, REDIS_DB
+from .product_setting import REDIS_HOST, REDIS_PORT, REDIS_DB, CANDLE_CLOCK
+from .product_setting import TICK_QUEUE_SHARDS, TICK_QUEUE_MAXSIZE, TICK_QUEUE_POLICY, TICK_CONFLATION
+from .product_setting import ORDER_EXECUTOR_WORKERS, CANDLE_CLOSE_TIMER, CANDLE_HISTORY_DEPTH
+from .product_setting import TICK_RECORDER, TICK_RECORDER_DIR, TICK_RECORDER_DEPTH, LATENCY_METRICS
+from .product_setting import LIVE_BROADCAST, LIVE_BROADCAST_INTERVAL
 import redis
 import math
-import asyncio
-import sys
-from zoneinfo import ZoneInfo
-from collections import defaultdict
+from collections import defaultdict, deque
+from .candle_store import CandleJournal
+from .candle_buffer import Candle, CandleHistory
+from .order_book import OrderBook
+from .pnl import PositionPnL, ThresholdGroupPnL
+from .instrument_table import compile_instrument_table
+from .tick_queue import ShardedTickQueue
+from .candle_scheduler import CandleCloseScheduler
+from .tick_recorder import TickRecorder
+from .latency import LatencyMetrics
+from .broadcast import LiveBroadcaster
+from .order_executor import OrderExecutor, OrderIntent, place_market_order, ACCEPTED, REJECTED, SUBMITTED
+from .broker import request_priority, order_priority
+from . import log_channels
+from . import candle_time
 # Initialize Redis client using Django settings
 # redis_client = redis.StrictRedis(
 #     host=REDIS_HOST,
@@ -20,17 +32,30 @@ from collections import defaultdict
 #     db=REDIS_DB
 # )
 
-logging.basicConfig(level=logging.DEBUG)
+# Queued, per-channel logging so the tick thread never blocks on disk, set up by the process entry points
+tick_logger = log_channels.get_logger('ticks')
+strategy_logger = log_channels.get_logger('strategy')
+order_logger = log_channels.get_logger('orders')
+pnl_logger = log_channels.get_logger('pnl')
+websocket_logger = log_channels.get_logger('websocket')
 
 
 class CandleAggregator:
-    def __init__(self, instrument_token,tradingsymbol ,interval_minutes=15 ,file_path='minute_candles.json',trade_side="BOTH",instrument_details_dict = []):
+    def __init__(self, instrument_token,tradingsymbol ,interval_minutes=15 ,file_path='minute_candles.json',trade_side="BOTH",instrument_details_dict = [],order_book=None,group_pnl=None,order_executor=None,latency=None):
         self.file_path = str(instrument_token)+'_'+str(interval_minutes) + '_' + file_path
         self.instrument_token = instrument_token  # Add the instrument token
         self.tradingsymbol = tradingsymbol  # Add the instrument token
         self.interval_minutes = interval_minutes
         self.current_candle = None
-        self.candles = []  # This can remain as a list if needed elsewhere
+        self.current_candle_start = None  # Epoch (IST) of the current candle's start_time
+        self.scheduled_close = None  # Boundary epoch handed to the candle close scheduler
+        self.candle_close_listeners = []  # Called with (aggregator, closed_candle) when a candle closes on its boundary
+        self.signal_listeners = []  # Called with (aggregator, signal dict) when an order is submitted or placed
+        # Breakout and stop-loss levels from the two candles before the forming one, see update_levels
+        self.x_value_higher = None
+        self.x_value_lower = None
+        self._levels_key = (None, None)  # (candle history version, percentage) the levels belong to
+        self.candles = CandleHistory(CANDLE_HISTORY_DEPTH)  # Latest candles, the forming one last once saved
         self.trade_side = trade_side
         # Attributes for order management
         self.current_stop_loss = None
@@ -43,15 +68,41 @@ class CandleAggregator:
         self.previous_trailing_candle = None
         self.open_positions = False
         self.instrument_details_dict = instrument_details_dict
-        # Load previous candles from the file, if available
-        if os.path.exists(self.file_path):
-            with open(self.file_path, 'r') as file:
-                try:
-                    self.candles = json.load(file)
-                except json.JSONDecodeError:
-                    self.candles = []
-        else:
-            self.candles = []
+        self.order_book = order_book  # Shared OrderBook kept current from order updates
+        self.position_pnl = None  # Incremental P/L accumulator for this symbol
+        self.group_pnl = group_pnl  # Shared P/L totals per exit threshold group
+        self.group_key = None  # Threshold group resolved by the compiled instrument table
+        self.order_executor = order_executor  # Places orders off the tick thread, None places them inline
+        self.order_events = deque()  # OrderEvents from the executor, applied on the tick thread
+        self.latency = latency  # Stage latency histograms of the handler, None records nothing
+        # Tick conflation state, only touched by the worker that owns this instrument
+        self.last_evaluated_price = None
+        self.last_evaluated_candle_count = None
+        self.evaluations = 0
+        self.skipped_superseded = 0  # A later tick of the same batch was evaluated instead
+        self.skipped_unchanged = 0  # Price and candles unchanged since the last evaluation
+        # Load previous candles from the journal, if available
+        self.candle_journal = CandleJournal(self.file_path)
+        for candle in self.candle_journal.load()[-self.candles.depth:]:
+            self.candles.save(Candle.from_dict(candle))
+
+    def should_evaluate(self, last_price, superseded):
+        """
+        Decide whether the stop-loss, P&L and strategy pipeline runs for a tick
+        in conflation mode. Candles are always updated, only the latest tick of
+        a batch is evaluated, and only if the price moved or a candle was added.
+        """
+        if superseded:
+            self.skipped_superseded += 1
+            return False
+        candle_count = len(self.candles)
+        if last_price == self.last_evaluated_price and candle_count == self.last_evaluated_candle_count:
+            self.skipped_unchanged += 1
+            return False
+        self.last_evaluated_price = last_price
+        self.last_evaluated_candle_count = candle_count
+        self.evaluations += 1
+        return True
 
     def _reset_position(self):
         """Reset the open position attributes."""
@@ -60,367 +111,400 @@ class CandleAggregator:
         self.open_quantity = 0
         self.current_order_type = None
 
+    def get_order_book(self, kite):
+        """ Return the shared order book, seeding a private one if none was supplied. """
+        if self.order_book is None:
+            self.order_book = OrderBook(kite)
+            self.order_book.seed()
+        return self.order_book
+
+    def get_group_pnl(self):
+        """ Return the shared threshold group accumulator, creating a private one if none was supplied. """
+        if self.group_pnl is None:
+            self.group_pnl = ThresholdGroupPnL(self.instrument_details_dict)
+        return self.group_pnl
+
     def save_candles(self, new_candle):
         try:
-            # Load existing candles from the file
-            if os.path.exists(self.file_path):
-                with open(self.file_path, 'r') as file:
-                    try:
-                        previous_candles = json.load(file)
-                        # Convert the list to a dictionary for easier updates
-                        candle_dict = {candle['start_time']: candle for candle in previous_candles}
-                    except json.JSONDecodeError:
-                        candle_dict = {}
-            else:
-                candle_dict = {}
-
-            # Update or add the new candle
-            candle_dict[new_candle['start_time']] = new_candle
-            
-            # Save the updated candles to the JSON file
-            with open(self.file_path, 'w') as file:
-                json.dump(list(candle_dict.values()), file, indent=4)
-            
-            logging.info(f"Candle with start_time {new_candle['start_time']} updated or added successfully.")
-            # Return all candles in the format: a list of dictionaries
-            return list(candle_dict.values())
+            # Update or add the new candle, only the journal tail is rewritten on disk
+            self.candle_journal.save(new_candle)
+            tick_logger.debug("Candle with start %s updated or added successfully.", new_candle.start)
+            # Return the candle history
+            return self.candles.save(new_candle)
         except Exception as error:
-            logging.error(f"error {error}")
-            return []
+            tick_logger.error("Error saving candle for %s: %s", self.instrument_token, error)
+            return self.candles
 
     def process_tick(self, tick):
         """ Process a new tick and update the candle data. """
         try:
             # Ensure required fields exist in the tick data
             if 'last_price' not in tick or 'last_traded_quantity' not in tick or 'current_datetime' not in tick:
-                logging.error(f"Missing required fields in tick: {tick}")
+                tick_logger.error("Missing required fields in tick: %s", tick)
                 return  # Skip processing this tick if essential fields are missing
 
             last_price = tick['last_price']
-            with open('last_price_log.txt', 'a') as log_file: log_file.write(f"last_price: {tick['last_price']},{tick['current_datetime']}\n")
-
-            # Parse tick time
-            tick_time = datetime.datetime.strptime(str(tick['current_datetime']), '%Y-%m-%d %H:%M:%S.%f%z')
-
-            # Make tick_time timezone-naive by stripping the tzinfo
-            tick_time = tick_time.replace(tzinfo=None)
+            tick_logger.debug("last_price: %s,%s", last_price, tick['current_datetime'])
 
-            # Align the tick time to the nearest second and reset microseconds
-            candle_start_time = tick_time.replace(second=0, microsecond=0)
+            # Tick time as IST epoch seconds, on_ticks resolves it once per tick
+            tick_epoch = tick.get('epoch')
+            if tick_epoch is None:
+                tick_epoch = candle_time.to_epoch(tick['current_datetime'])
 
-            # If no candle exists, create the first candle at the tick's time
+            # If no candle exists, create the first candle at the start of the tick's minute
             if self.current_candle is None:
-                self.current_candle = {
-                    'start_time': candle_start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    'open': last_price,
-                    'high': last_price,
-                    'low': last_price,
-                    'close': last_price,
-                    'volume': tick['last_traded_quantity'],
-                    'ohlc_high':tick['ohlc']['high'],
-                    'ohlc_low':tick['ohlc']['low'],
-                    'final_save': False
-                }
+                self.current_candle_start = candle_time.bucket_start(tick_epoch)
+                self.current_candle = Candle(self.current_candle_start, last_price, last_price, last_price, last_price,
+                                             tick['last_traded_quantity'], tick['ohlc']['high'], tick['ohlc']['low'])
             else:
-                # Get the start time of the current candle and make it timezone-naive
-                last_candle_start_time = datetime.datetime.strptime(self.current_candle['start_time'], '%Y-%m-%d %H:%M:%S')
-                last_candle_start_time = last_candle_start_time.replace(second=0, microsecond=0, tzinfo=None)
-
                 # Calculate the next candle's start time
-                next_candle_start_time = last_candle_start_time + datetime.timedelta(minutes=self.interval_minutes)
+                next_candle_start = self.current_candle_start + self.interval_minutes * 60
+                candle = self.current_candle
 
-                # Check if the tick_time indicates the need for a new candle
-                if tick_time >= next_candle_start_time:
+                # Check if the tick time indicates the need for a new candle
+                if tick_epoch >= next_candle_start:
                     # Update the current candle's OHLC values before closing
-                    if not self.current_candle['final_save']:
-                        if self.current_candle['ohlc_high']!= tick['ohlc']['high']:
-                            self.current_candle['high'] = max(self.current_candle['high'], last_price, tick['ohlc']['high'])
-                        else:
-                            self.current_candle['high'] = max(self.current_candle['high'], last_price)
-                        if self.current_candle['ohlc_low']!= tick['ohlc']['low']:
-                            self.current_candle['low'] = min(self.current_candle['low'], last_price, tick['ohlc']['low'])
-                        else:
-                            self.current_candle['low'] = min(self.current_candle['low'], last_price)
-                        self.current_candle['close'] = last_price
-                        self.current_candle['volume'] += tick['last_traded_quantity']
-                        self.current_candle['ohlc_high'] = tick['ohlc']['high']
-                        self.current_candle['ohlc_low'] = tick['ohlc']['low']
-                        self.current_candle['final_save'] = True
+                    if not candle.final_save:
+                        self._update_candle(candle, tick, last_price)
+                        candle.final_save = True
                         # Save the closed candle
-                        self.candles = self.save_candles(self.current_candle)
-                        logging.info(f"Candle closed and saved: {self.current_candle}")
+                        self.candles = self.save_candles(candle)
+                        tick_logger.info("Candle closed and saved: %s", candle)
                         return 
 
                     # Start a new candle at the next interval
-                    self.current_candle = {
-                        'start_time': next_candle_start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                        'open': last_price,
-                        'high': last_price,
-                        'low': last_price,
-                        'close': last_price,
-                        'volume': tick['last_traded_quantity'],
-                        'ohlc_high':tick['ohlc']['high'],
-                        'ohlc_low':tick['ohlc']['low'],
-                        'final_save': False
-                    }
+                    self.current_candle_start = next_candle_start
+                    self.current_candle = Candle(next_candle_start, last_price, last_price, last_price, last_price,
+                                                 tick['last_traded_quantity'], tick['ohlc']['high'], tick['ohlc']['low'])
                 else:
                     # Update the current candle's OHLC values and volume
-                    if self.current_candle['ohlc_high']!= tick['ohlc']['high']:
-                        self.current_candle['high'] = max(self.current_candle['high'], last_price, tick['ohlc']['high'])
-                    else:
-                        self.current_candle['high'] = max(self.current_candle['high'], last_price)
-                    if self.current_candle['ohlc_low']!= tick['ohlc']['low']:
-                        self.current_candle['low'] = min(self.current_candle['low'], last_price, tick['ohlc']['low'])
-                    else:
-                        self.current_candle['low'] = min(self.current_candle['low'], last_price)
-                    self.current_candle['close'] = last_price
-                    self.current_candle['volume'] += tick['last_traded_quantity']
-                    self.current_candle['ohlc_high'] = tick['ohlc']['high']
-                    self.current_candle['ohlc_low'] = tick['ohlc']['low']
+                    self._update_candle(candle, tick, last_price)
 
                     # Save the updated candle
-                    self.candles = self.save_candles(self.current_candle)
-                    logging.debug(f"Candle updated and saved: {self.current_candle}")
+                    self.candles = self.save_candles(candle)
+                    tick_logger.debug("Candle updated and saved: %s", candle)
 
         except KeyError as e:
-            logging.error(f"KeyError: Missing expected key {e} in tick: {tick}")
+            tick_logger.error("KeyError: Missing expected key %s in tick: %s", e, tick)
         except ValueError as e:
-            logging.error(f"ValueError: Invalid value in tick data: {tick}, Error: {e}")
+            tick_logger.error("ValueError: Invalid value in tick data: %s, Error: %s", tick, e)
         except Exception as e:
-            logging.error(f"Unexpected error while processing tick: {tick}, Error: {e}")
+            tick_logger.error("Unexpected error while processing tick: %s, Error: %s", tick, e)
 
 
-    def check_strategy(self, instrument_token, percentage):
-        """ Check the strategy based on the previous two candles and the percentage for buy/sell signals. """
-        
-        # Open the log file in append mode
-        with open(f'strategy_{instrument_token}_log.txt', 'a') as log_file:
-            
-            # Log initial info
-            print(f"Checking strategy for instrument_token: {instrument_token}, percentage: {percentage}", file=log_file)
-
-            # Check if there are enough candles
-            if len(self.candles) < 3:
-                print(f"Not enough candles. Candles count: {len(self.candles)}", file=log_file)
-                return None  # Not enough candles to make a decision
-
-            # Get previous two candles
-            prev_candle_1 = self.candles[-2]  # Most recent completed candle
-            prev_candle_2 = self.candles[-3]  # The candle before the most recent one
-
-            print(f"Previous Candle 1: {prev_candle_1}, Previous Candle 2: {prev_candle_2}", file=log_file)
-
-            # Calculate the high and low for the strategy
-            max_high = max(prev_candle_1['high'], prev_candle_2['high'])
-            min_low = min(prev_candle_1['low'], prev_candle_2['low'])
-
-            print(f"max_high: {max_high}, min_low: {min_low}", file=log_file)
-
-            # Calculate x_value_higher and x_value_lower using the user-defined percentage
-            self.x_value_higher = math.ceil(max_high + ((percentage / 100) * max_high))
-            self.x_value_lower = math.floor(min_low - ((percentage / 100) * min_low))
-
-            print(f"x_value_higher: {self.x_value_higher}, x_value_lower: {self.x_value_lower}", file=log_file)
-
-            # Get the current candle's high and low values
-            current_high = self.current_candle['close']
-            current_low = self.current_candle['close']
-
-            print(f"Current Candle High: {current_high}, Current Candle Low: {current_low}", file=log_file)
-
-            # Initialize response data
-            response = {}
-
-            # Check for Buy or Sell signals and calculate stop loss
-            if current_high > self.x_value_higher:
-                stop_loss = self.calculate_stop_loss_func("Buy", percentage)
-                response = {
-                    "instrument_token": instrument_token,
-                    "order_type": "Buy",
-                    "stop_loss": stop_loss
-                }
-                print(f"Buy signal generated. Stop Loss: {stop_loss}", file=log_file)
-            elif current_low < self.x_value_lower:
-                stop_loss = self.calculate_stop_loss_func("Sell", percentage)
-                response = {
-                    "instrument_token": instrument_token,
-                    "order_type": "Sell",
-                    "stop_loss": stop_loss
-                }
-                print(f"Sell signal generated. Stop Loss: {stop_loss}", file=log_file)
-            else:
-                print(f"No signals generated. Conditions not met.", file=log_file)
+    def _update_candle(self, candle, tick, last_price):
+        """ Fold a tick into the candle, a new day high or low in the tick's ohlc counts as traded. """
+        ohlc = tick['ohlc']
+        if candle.ohlc_high != ohlc['high']:
+            candle.high = max(candle.high, last_price, ohlc['high'])
+        else:
+            candle.high = max(candle.high, last_price)
+        if candle.ohlc_low != ohlc['low']:
+            candle.low = min(candle.low, last_price, ohlc['low'])
+        else:
+            candle.low = min(candle.low, last_price)
+        candle.close = last_price
+        candle.volume += tick['last_traded_quantity']
+        candle.ohlc_high = ohlc['high']
+        candle.ohlc_low = ohlc['low']
 
-            #Adjusting Strategy based on user defined order sides
-            if response and "order_type" in response:
-                if (self.trade_side == "BUY" and response["order_type"].lower() == "sell") or \
-                (self.trade_side == "SELL" and response["order_type"].lower() == "buy"):response = {}
+    def close_candle(self, boundary, carry_forward=True):
+        """
+        Close the current candle at its interval boundary, called by the candle close scheduler.
 
-            print(f"Response: {response}", file=log_file)
+        This differs from the close on the first tick after the boundary,
+        which folds that tick into the closed candle and opens the next
+        candle with the tick after it: the next candle opens right away at
+        the boundary at the last price. An interval without ticks is saved
+        as a flat candle with zero volume, so the two candles before the
+        forming one are always the last two intervals.
 
-            return response
+        Parameters:
+        - boundary (int): IST epoch the current candle ends at.
+        - carry_forward (bool): Open the next candle at the last price, also when no tick arrives in it.
 
-    def calculate_stop_loss_func(self, order_type, percentage):
-        """ Calculate the stop loss for the current order based on previous candles. """
+        Returns:
+        - Candle: The closed candle, None when the event is stale because a tick already moved the candle on.
+        """
+        if self.current_candle is None or boundary != self.current_candle_start + self.interval_minutes * 60:
+            return None
 
-        # Open the log file in append mode
-        with open('calculate_stop_loss_func.txt', 'a') as log_file:
-            
-            # Print that stop loss calculation has started
-            print(f"Calculating stop loss for order_type: {order_type} with percentage: {percentage}", file=log_file)
+        closed_candle = self.current_candle
+        if not closed_candle.final_save:
+            closed_candle.final_save = True
+            self.candles = self.save_candles(closed_candle)
+            tick_logger.info("Candle closed at boundary and saved: %s", closed_candle)
+
+        if carry_forward:
+            last_price = closed_candle.close
+            self.current_candle_start = boundary
+            self.current_candle = Candle(boundary, last_price, last_price, last_price, last_price, 0,
+                                         closed_candle.ohlc_high, closed_candle.ohlc_low)
+            # Saved right away so the forming candle is the last one in the history, as after a tick update
+            self.candles = self.save_candles(self.current_candle)
+
+        for listener in self.candle_close_listeners:
+            try:
+                listener(self, closed_candle)
+            except Exception as error:
+                strategy_logger.error("Error in candle close listener for %s: %s", self.tradingsymbol, error)
+        return closed_candle
+
+    def update_levels(self, percentage):
+        """
+        Recompute the breakout levels when the two candles before the forming
+        one changed, which happens once per candle close.
 
-            # Get the previous two candles
-            prev_candle_1 = self.candles[-2]
-            prev_candle_2 = self.candles[-3]
+        x_value_higher is the Buy breakout and the Sell stop loss, x_value_lower
+        the Sell breakout and the Buy stop loss. Between candle closes this is
+        a version check, nothing is allocated.
 
-            # Print previous candles information
-            print(f"Previous Candle 1: {prev_candle_1}, Previous Candle 2: {prev_candle_2}", file=log_file)
+        Returns:
+        - bool: False when there are not enough candles for levels.
+        """
+        candles = self.candles
+        if len(candles) < 3:
+            return False
+        levels_key = self._levels_key
+        if candles.version == levels_key[0] and percentage == levels_key[1]:
+            return True
 
-            # Determine floor and ceiling values from previous candles
-            floor_value = min(prev_candle_1['low'], prev_candle_2['low'])  # Minimum low for Buy
-            ceil_value = max(prev_candle_1['high'], prev_candle_2['high'])  # Maximum high for Sell
+        # Most recent completed candle and the one before it
+        prev_candle_1 = candles.slot(2)
+        prev_candle_2 = candles.slot(3)
 
-            # Print floor and ceiling values
-            print(f"Floor Value: {floor_value}, Ceiling Value: {ceil_value}", file=log_file)
+        # Calculate the high and low for the strategy
+        max_high = max(candles.high[prev_candle_1], candles.high[prev_candle_2])
+        min_low = min(candles.low[prev_candle_1], candles.low[prev_candle_2])
 
-            # Calculate stop loss based on the order type
-            if order_type == "Buy":
-                stop_loss = math.floor(floor_value - (percentage / 100 * floor_value))
-                print(f"Calculated Buy Stop Loss: {stop_loss}", file=log_file)
-            elif order_type == "Sell":
-                stop_loss = math.ceil(ceil_value + (percentage / 100 * ceil_value))
-                print(f"Calculated Sell Stop Loss: {stop_loss}", file=log_file)
-            else:
-                stop_loss = None
-                print(f"Unknown order type: {order_type}. Stop loss set to None.", file=log_file)
+        # Calculate x_value_higher and x_value_lower using the user-defined percentage
+        self.x_value_higher = math.ceil(max_high + ((percentage / 100) * max_high))
+        self.x_value_lower = math.floor(min_low - ((percentage / 100) * min_low))
+        self._levels_key = (candles.version, percentage)
+
+        strategy_logger.debug("%s: max_high: %s, min_low: %s, x_value_higher: %s, x_value_lower: %s",
+                              self.tradingsymbol, max_high, min_low, self.x_value_higher, self.x_value_lower)
+        return True
 
-            # Return the calculated stop loss
-            return stop_loss
+    def check_strategy(self, instrument_token, percentage):
+        """ Check the strategy based on the previous two candles and the percentage for buy/sell signals. """
 
+        # Levels are cached per candle close, the per tick check is two comparisons
+        if not self.update_levels(percentage):
+            return None  # Not enough candles to make a decision
+
+        current_price = self.current_candle.close
+
+        # Initialize response data
+        response = {}
+
+        # Check for Buy or Sell signals and calculate stop loss
+        if current_price > self.x_value_higher:
+            stop_loss = self.calculate_stop_loss_func("Buy", percentage)
+            response = {
+                "instrument_token": instrument_token,
+                "order_type": "Buy",
+                "stop_loss": stop_loss
+            }
+            strategy_logger.info("%s: Buy signal generated. Stop Loss: %s", instrument_token, stop_loss)
+        elif current_price < self.x_value_lower:
+            stop_loss = self.calculate_stop_loss_func("Sell", percentage)
+            response = {
+                "instrument_token": instrument_token,
+                "order_type": "Sell",
+                "stop_loss": stop_loss
+            }
+            strategy_logger.info("%s: Sell signal generated. Stop Loss: %s", instrument_token, stop_loss)
+
+        #Adjusting Strategy based on user defined order sides
+        if response and "order_type" in response:
+            if (self.trade_side == "BUY" and response["order_type"].lower() == "sell") or \
+            (self.trade_side == "SELL" and response["order_type"].lower() == "buy"):
+                strategy_logger.info("%s: %s signal ignored for trade side %s", instrument_token, response["order_type"], self.trade_side)
+                response = {}
+        return response
 
-    def place_single_order(self,kite,instrument_token, trading_symbol, exchange, exit_trades_threshold_points, order_type, quantity, stop_loss, price=None,percentage = 0.00,order_mode="Reverse_side"):
-        log_file = 'order_placement.log'
-        with open(log_file, 'a') as f:  # Open log file in append mode
+    def calculate_stop_loss_func(self, order_type, percentage):
+        """ Stop loss for a new order from the cached levels of the previous candles. """
+
+        # Buy stops below the lower level, Sell above the higher level
+        self.update_levels(percentage)
+        if order_type == "Buy":
+            stop_loss = self.x_value_lower
+        elif order_type == "Sell":
+            stop_loss = self.x_value_higher
+        else:
+            stop_loss = None
+
+        strategy_logger.info("%s: %s stop loss %s, percentage %s", self.tradingsymbol, order_type, stop_loss, percentage)
+
+        # Return the calculated stop loss
+        return stop_loss
+
+
+    def emit_signal(self, instrument_token, trading_symbol, order_type, quantity, stop_loss, price, order_mode, order_id=None):
+        """ Tell the signal listeners about an order that was submitted or placed. """
+        if not self.signal_listeners:
+            return
+        signal = {
+            'instrument_token': instrument_token,
+            'tradingsymbol': trading_symbol,
+            'transaction_type': order_type,
+            'quantity': quantity,
+            'stop_loss': stop_loss,
+            'price': price,
+            'order_mode': order_mode,
+            'order_id': order_id,
+        }
+        for listener in self.signal_listeners:
             try:
-                # Check for existing orders
-                order_id = None
-
-                f.write(f"----------------------------------------------------------------------------------------------------------------------------\n")
-                f.write(f"----------------------------------------------------------------------------------------------------------------------------\n")
-                f.write(f"Attempting {order_mode } at {datetime.datetime.now(ZoneInfo('Asia/Kolkata'))} to place order for {trading_symbol} - {order_type} {quantity} stop loss {stop_loss} price {price}.\n")
-                if self.close_trade_for_the_day:
-                    f.write(f" Trade Closed for Attempted {order_mode} for {trading_symbol}")
-                    return 
-                # If no existing order, proceed to place a new one
-                if order_type == "Buy":
-                    order_id = kite.place_order(
-                                    variety=kite.VARIETY_REGULAR,  # Set order type to Cover Order
-                                    exchange=exchange,
-                                    tradingsymbol=trading_symbol,
-                                    transaction_type=kite.TRANSACTION_TYPE_BUY,
-                                    quantity=quantity,
-                                    order_type=kite.ORDER_TYPE_MARKET,  # Use MARKET or LIMIT based on your preference
-                                    product=kite.PRODUCT_MIS,  # For intraday trading
-                                )
-
-                elif order_type == "Sell":
-                    order_id = kite.place_order(
-                                    variety=kite.VARIETY_REGULAR,  # Set order type to Cover Order
-                                    exchange=exchange,
-                                    tradingsymbol=trading_symbol,
-                                    transaction_type=kite.TRANSACTION_TYPE_SELL,
-                                    quantity=quantity,
-                                    order_type=kite.ORDER_TYPE_MARKET,  # Use MARKET or LIMIT based on your preference
-                                    product=kite.PRODUCT_MIS,  # For intraday trading
-                                )
+                listener(self, signal)
+            except Exception as error:
+                order_logger.error("Error in signal listener for %s: %s", trading_symbol, error)
+
+    def place_single_order(self,kite,instrument_token, trading_symbol, exchange, exit_trades_threshold_points, order_type, quantity, stop_loss, price=None,percentage = 0.00,order_mode="Reverse_side"):
+        try:
+            # Check for existing orders
+            order_id = None
 
+            order_logger.info("Attempting %s to place order for %s - %s %s stop loss %s price %s.",
+                              order_mode, trading_symbol, order_type, quantity, stop_loss, price)
+            if self.close_trade_for_the_day:
+                order_logger.info("Trade Closed for Attempted %s for %s", order_mode, trading_symbol)
+                return 
+            latency = self.latency
+            timed = latency is not None and latency.enabled
+            if timed:
+                submit_started = time.perf_counter()
+            if self.order_executor is not None:
+                # Placed on the executor: assume it goes through, apply_order_events undoes rejected orders
+                # and logs the order id once the broker returned it
+                intent = OrderIntent(instrument_token, trading_symbol, exchange, order_type, quantity, stop_loss, price, order_mode)
+                self.order_executor.submit(intent, self.order_events.append)
+                if timed:
+                    latency.observe('order_submit', trading_symbol, time.perf_counter() - submit_started)
+                self.current_order_type = order_type
+                self.current_stop_loss = stop_loss
+                self.order_active = True
+                order_logger.info("%s %s order submitted for %s, Stop Loss: %s, Quantity: %s, Price: %s",
+                                  order_type, order_mode, trading_symbol, stop_loss, quantity, price)
+                self.emit_signal(instrument_token, trading_symbol, order_type, quantity, stop_loss, price, order_mode)
+                return SUBMITTED
+
+            # If no existing order, proceed to place a new one
+            with request_priority(order_priority(order_mode)):
+                order_id = place_market_order(kite, exchange, trading_symbol, order_type, quantity)
+            if timed:
+                # Inline the tick thread waits for the acknowledgement
+                submit_latency = time.perf_counter() - submit_started
+                latency.observe('order_submit', trading_symbol, submit_latency)
                 if order_id:
-                    all_orders = kite.orders()
-                    result = not all_orders or all_orders[-1]['status'] != 'REJECTED'
-                    f.write(str(result))
-                    if all_orders==[] or (all_orders!=[] and all_orders[-1]['status'] != 'REJECTED'):
-                        self.current_order_type = order_type
-                        self.current_stop_loss = stop_loss
-                        # Update the current stop loss in the object for the new reverse order
-                        self.order_active = True
-                        f.write(f"{order_type} {order_mode} order placed for {trading_symbol}. Order ID: {order_id}, Stop Loss: {self.current_stop_loss}, Quantity: {quantity}, Price: {price}\n")
-                        # Fetch all orders
-                    else:
-                        self.current_order_type = None
-                        self.current_stop_loss = None
-                        # Update the current stop loss in the object for the new reverse order
-                        self.order_active = False
-                        f.write(f"{order_type} {order_mode} order NOT placed REJECTED for {trading_symbol}. Order ID: {order_id}, Stop Loss: {self.current_stop_loss}, Quantity: {quantity}, Price: {price}\n")
-                        sys.exit()
-                f.write(f"Order placed successfully for {trading_symbol}. Order ID: {order_id}\n")
-                return order_id
-
-            except Exception as e:
-                f.write(f"Error placing order for {trading_symbol}: {str(e)}\n")
-                return None
+                    latency.observe('order_ack', trading_symbol, submit_latency)
+
+            if order_id:
+                with request_priority(order_priority(order_mode)):
+                    order_status = self.get_order_book(kite).order_status(order_id)
+                if order_status != 'REJECTED':
+                    self.current_order_type = order_type
+                    self.current_stop_loss = stop_loss
+                    # Update the current stop loss in the object for the new reverse order
+                    self.order_active = True
+                    order_logger.info("%s %s order placed for %s. Order ID: %s, Stop Loss: %s, Quantity: %s, Price: %s",
+                                      order_type, order_mode, trading_symbol, order_id, self.current_stop_loss, quantity, price)
+                    self.emit_signal(instrument_token, trading_symbol, order_type, quantity, stop_loss, price, order_mode, order_id)
+                else:
+                    self.current_order_type = None
+                    self.current_stop_loss = None
+                    # Update the current stop loss in the object for the new reverse order
+                    self.order_active = False
+                    order_logger.error("%s %s order NOT placed REJECTED for %s. Order ID: %s, Stop Loss: %s, Quantity: %s, Price: %s",
+                                       order_type, order_mode, trading_symbol, order_id, self.current_stop_loss, quantity, price)
+                    return None
+            order_logger.info("Order placed successfully for %s. Order ID: %s", trading_symbol, order_id)
+            return order_id
+
+        except Exception as e:
+            order_logger.error("Error placing order for %s: %s", trading_symbol, e)
+            return None
+
+    def apply_order_events(self):
+        """
+        Apply the outcome of orders placed through the executor.
+
+        Called from the tick thread that owns this aggregator, so order state
+        is only ever changed by one thread. place_single_order already set the
+        expected state when the intent was submitted; rejected and failed
+        orders undo it.
+        """
+        while self.order_events:
+            event = self.order_events.popleft()
+            intent = event.intent
+            if event.ack_latency is not None and self.latency is not None and self.latency.enabled:
+                self.latency.observe('order_ack', intent.trading_symbol, event.ack_latency)
+            if event.kind == ACCEPTED:
+                if self.current_candle is not None:
+                    # Book the fill into this symbol's share of the threshold group P&L right away
+                    profit_loss = self.calculate_incremental_profit_loss_per_share(
+                        self.order_executor.kite, self.current_candle.close, intent.trading_symbol)
+                    self.update_group_pnl({intent.trading_symbol: profit_loss})
+                order_logger.info("%s %s order placed for %s. Order ID: %s, Stop Loss: %s, Quantity: %s, Price: %s, Ack: %.1f ms",
+                                  intent.order_type, intent.order_mode, intent.trading_symbol, event.order_id,
+                                  intent.stop_loss, intent.quantity, intent.price, event.ack_latency * 1000)
+            else:
+                self.current_order_type = None
+                self.current_stop_loss = None
+                self.order_active = False
+                if event.kind == REJECTED:
+                    order_logger.error("%s %s order NOT placed REJECTED for %s. Order ID: %s, Stop Loss: %s, Quantity: %s, Price: %s",
+                                       intent.order_type, intent.order_mode, intent.trading_symbol, event.order_id,
+                                       intent.stop_loss, intent.quantity, intent.price)
+                else:
+                    order_logger.error("Error placing %s order for %s: %s", intent.order_mode, intent.trading_symbol, event.error)
 
     def handle_reverse_order(self, kite,instrument_token, trading_symbol, exchange, exit_trades_threshold_points, strategy_response, lot_size, percentage):
         """
         Handles reverse order logic when stop-loss is hit.
         """
-        # Set up a dedicated logger for this function
-        reverse_order_logger = logging.getLogger("reverse_order_logger")
-        reverse_order_logger.setLevel(logging.DEBUG)
-
-        # Create a file handler specific for reverse order handling logs
-        file_handler = logging.FileHandler("reverse_order.log")
-        file_handler.setLevel(logging.DEBUG)
-
-        # Define a log format and set it for the handler
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-
-        # Add the handler to the logger, avoiding duplicate handlers if the function is called multiple times
-        if not reverse_order_logger.handlers:
-            reverse_order_logger.addHandler(file_handler)
-
-        #reverse_order_logger.info("Executing handle_reverse_order.")
+        #order_logger.info("Executing handle_reverse_order.")
         
         # Check if stop-loss is hit
         stop_loss_price = self.current_stop_loss
         #reverse_order_logger.debug(f"Stop-loss price fetched: {stop_loss_price}")
         
         # Get the latest tick data to compare the stop-loss price
-        current_price = self.current_candle['close']
+        current_price = self.current_candle.close
         #reverse_order_logger.debug(f"Current price from candle data: {current_price}")
 
         # Check stop-loss condition
         if (self.current_order_type == 'Buy' and stop_loss_price and current_price <= stop_loss_price) or \
         (self.current_order_type== 'Sell' and stop_loss_price and current_price >= stop_loss_price):
             
-            reverse_order_logger.info(f"Stop-loss hit for {instrument_token} at price: {current_price}")
-            print(f"Stop-loss hit for {instrument_token}. Current price: {current_price}, Stop-loss: {stop_loss_price} inside reverse handling function", file=open("reverse_logic entered.log", "a"))
+            order_logger.info("Stop-loss hit for %s. Current price: %s, Stop-loss: %s inside reverse handling function",
+                              instrument_token, current_price, stop_loss_price)
 
             # Calculate daily profit or loss before reversing the order
-            reverse_order_logger.info("Calculating daily profit or loss.")
             self.fetch_and_calculate_daily_profit_loss(kite,current_price,instrument_token, trading_symbol, exchange, exit_trades_threshold_points, strategy_response, lot_size, percentage)
             # Stop-loss hit, place reverse order
             reverse_order_type = "Sell" if strategy_response['order_type'] == "Buy" else "Buy"
-            reverse_order_logger.info(f"Reverse order type determined as: {reverse_order_type}")
+            order_logger.info("Reverse order type determined as: %s", reverse_order_type)
             
             # Place the reverse order at the stop-loss price for square off
-            # Fetch current positions
-            for position in kite.positions()['net']:
-                if position['tradingsymbol'] ==  trading_symbol and position['quantity']!=0:
-                    #squaringoffopenpositions
-                    reverse_order_id_sq_off = self.place_single_order(
-                                                        kite,
-                                                        instrument_token,
-                                                        trading_symbol,
-                                                        exchange,
-                                                        exit_trades_threshold_points,
-                                                        reverse_order_type,
-                                                        lot_size,
-                                                        stop_loss_price,
-                                                        stop_loss_price,  # Using stop-loss price as the price for the reverse order
-                                                        percentage,
-                                                        order_mode="Square OFF"
-                                                    )
+            # Net position from the local order book
+            if self.get_order_book(kite).net_quantity(trading_symbol) != 0:
+                #squaringoffopenpositions
+                reverse_order_id_sq_off = self.place_single_order(
+                                                    kite,
+                                                    instrument_token,
+                                                    trading_symbol,
+                                                    exchange,
+                                                    exit_trades_threshold_points,
+                                                    reverse_order_type,
+                                                    lot_size,
+                                                    stop_loss_price,
+                                                    stop_loss_price,  # Using stop-loss price as the price for the reverse order
+                                                    percentage,
+                                                    order_mode="Square OFF"
+                                                )
             # for position in kite.positions()['net']:
             #     if position['tradingsymbol'] ==  trading_symbol and position['quantity']==0:
             #         #squaredoffsuccessfully
@@ -441,20 +525,22 @@ class CandleAggregator:
                                                         order_mode="Reverse Mode"
                                                     )
                 
-                if reverse_order_id:
-                    reverse_order_logger.info(f"Reverse order placed with ID: {reverse_order_id} for {reverse_order_type} on {trading_symbol}")
+                if reverse_order_id == SUBMITTED:
+                    order_logger.info("Reverse order submitted for %s on %s", reverse_order_type, trading_symbol)
+                elif reverse_order_id:
+                    order_logger.info("Reverse order placed with ID: %s for %s on %s", reverse_order_id, reverse_order_type, trading_symbol)
                 else:
-                    reverse_order_logger.warning(f"Failed to place reverse order for {trading_symbol}.")
+                    order_logger.warning("Failed to place reverse order for %s.", trading_symbol)
             else:
                 #if order is not both side make order inactive
                 self.order_active = False
         else:
-            reverse_order_logger.debug("Stop-loss condition not met. No reverse order placed.")
+            order_logger.debug("Stop-loss condition not met. No reverse order placed.")
 
     
     def fetch_and_calculate_daily_profit_loss(self,kite,current_price,instrument_token, trading_symbol, exchange, exit_trades_threshold_points, strategy_response, lot_size, percentage):
         """
-        Fetch orders from Kite API and calculate daily profit or loss, with extensive logging.
+        Read orders from the local order book and calculate daily profit or loss, with extensive logging.
         """
         # Create a logger
         # fetch_and_calculate_daily_profit_loss = logging.getLogger("daily_profit_loss_calculation")
@@ -475,49 +561,32 @@ class CandleAggregator:
         #fetch_and_calculate_daily_profit_loss.info("Starting fetch_and_calculate_daily_profit_loss process.")
         
         try:
-            # Fetch all orders
-            all_orders = kite.orders()
-            #fetch_and_calculate_daily_profit_loss.debug(f"Fetched {len(all_orders)} orders from Kite API.")
-
-            # Filter for completed buy/sell orders
-            completed_orders = [
-                order for order in all_orders if order['status'] == 'COMPLETE' and
-                order['transaction_type'] in ['BUY', 'SELL'] and 
-                order['tradingsymbol'] == trading_symbol
-            ]
-            #fetch_and_calculate_daily_profit_loss.debug(f"Filtered completed buy/sell orders. Count: {len(completed_orders)}")
-
-            # Sort orders by timestamp
-            sorted_orders = sorted(completed_orders, key=lambda x: x['order_timestamp'])
-            #fetch_and_calculate_daily_profit_loss.debug("Sorted orders by timestamp.")
-
-            # Calculate daily profit or loss based on the sorted orders
-            daily_profit_loss_per_share = self.calculate_total_profit_loss_per_share(sorted_orders, current_price,trading_symbol)
+            # Apply only the fills that arrived since the last tick, unrealized P/L comes from the current price
+            daily_profit_loss_per_share = self.calculate_incremental_profit_loss_per_share(kite, current_price, trading_symbol)
             #fetch_and_calculate_daily_profit_loss.info(f"Calculated daily profit/loss: {daily_profit_loss_per_share}")
-            self.write_profit_loss_to_json({trading_symbol:daily_profit_loss_per_share})
+            self.update_group_pnl({trading_symbol:daily_profit_loss_per_share})
 
 
             # combinedthresholdinstrumentdetails = {}
             # for single_dict in self.instrument_details_dict[str(int(exit_trades_threshold_points))]:
             #     combinedthresholdinstrumentdetails[single_dict['tradingsymbol']] = single_dict['lot_size']
 
-            trading_symbols_list = [x['tradingsymbol'] for x in  self.instrument_details_dict[str(int(exit_trades_threshold_points))]]
-
-            # Assign the daily profit/loss to the profit threshold points
-            self.profit_threshold_points = self.fetch_profit_loss_from_json_dict(trading_symbols_list)
+            # Assign the running group profit/loss to the profit threshold points
+            group_key = self.group_key if self.group_key is not None else str(int(exit_trades_threshold_points))
+            self.profit_threshold_points = self.get_group_pnl().group_total(group_key)
 
             #self.profit_threshold_points = 0 #assigned to zero for testing
-            #fetch_and_calculate_daily_profit_loss.info(f"Updated profit threshold points for {trading_symbol} and  list {trading_symbols_list}: {self.profit_threshold_points}")
+            #fetch_and_calculate_daily_profit_loss.info(f"Updated profit threshold points for {trading_symbol}: {self.profit_threshold_points}")
             if self.profit_threshold_points>=exit_trades_threshold_points:
                 self.should_close_trade(kite,current_price,instrument_token, trading_symbol, exchange, exit_trades_threshold_points, strategy_response, lot_size, percentage)
 
-            # Optional console output
-            print(f"Total Profit/Loss for the day: {daily_profit_loss_per_share} ,self.profit_threshold_points:{self.profit_threshold_points},exit_trades_threshold_points:{exit_trades_threshold_points}")
+            pnl_logger.debug("Total Profit/Loss for the day for %s: %s, profit_threshold_points: %s, exit_trades_threshold_points: %s",
+                             trading_symbol, daily_profit_loss_per_share, self.profit_threshold_points, exit_trades_threshold_points)
 
             #fetch_and_calculate_daily_profit_loss.info("Completed fetch_and_calculate_daily_profit_loss process successfully.")
             return daily_profit_loss_per_share
         except Exception as error:
-            print("error in fetch_and_calculate_daily_profit_loss",error)
+            pnl_logger.error("Error in fetch_and_calculate_daily_profit_loss for %s: %s", trading_symbol, error)
             #fetch_and_calculate_daily_profit_loss.error(f"Error in fetch_and_calculate_daily_profit_loss: {error}", exc_info=True)
             return 0
 
@@ -525,146 +594,70 @@ class CandleAggregator:
     def calculate_total_profit_loss_per_share(self, sorted_orders, current_price,trading_symbol):
         """
         Calculate total profit or loss per share, including realized and unrealized P/L.
+        Replays sorted_orders from scratch, the tick path uses calculate_incremental_profit_loss_per_share.
         """
         try:
-            # Set up logging with a FileHandler
-            logger = logging.getLogger("calculate_total_profit_loss_per_share")
-            logger.setLevel(logging.INFO)
-
-            # Avoid duplicate handlers
-            if not logger.handlers:
-                file_handler = logging.FileHandler("calculate_total_profit_loss_per_share.log")
-                formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-                file_handler.setFormatter(formatter)
-                logger.addHandler(file_handler)
-
-            realized_profit_loss_per_share = 0  # Realized P/L per share
-            unrealized_profit_loss_per_share = 0  # Unrealized P/L per share
-            self.open_position = False
-            self.open_price = None
-            self.open_quantity = 0
-            self.current_order_type = None
-
+            position_pnl = PositionPnL(trading_symbol)
             for order in sorted_orders:
-                avg_price = order['average_price']
-                quantity = order['quantity']  # Keeping track for open positions
-                transaction_type = order['transaction_type']
-
-                if transaction_type == 'BUY':
-                    if not self.open_position:
-                        # Open a new Buy position
-                        self.open_price = avg_price
-                        self.open_quantity = quantity
-                        self.current_order_type = "Buy"
-                        self.open_position = True
-                    elif self.current_order_type == "Sell":
-                        if self.open_quantity == quantity:
-                            # Fully close Sell position
-                            realized_profit_loss_per_share += (self.open_price - avg_price)
-                            self._reset_position()
-                        elif quantity < self.open_quantity:
-                            # Partially close Sell position
-                            realized_profit_loss_per_share += (self.open_price - avg_price)
-                            self.open_quantity -= quantity
-                        else:
-                            pass
-
-                elif transaction_type == 'SELL':
-                    if not self.open_position:
-                        # Open a new Sell position
-                        self.open_price = avg_price
-                        self.open_quantity = quantity
-                        self.current_order_type = "Sell"
-                        self.open_position = True
-                    elif self.current_order_type == "Buy":
-                        if self.open_quantity == quantity:
-                            # Fully close Buy position
-                            realized_profit_loss_per_share += (avg_price - self.open_price)
-                            self._reset_position()
-                        elif quantity < self.open_quantity:
-                            # Partially close Buy position
-                            realized_profit_loss_per_share += (avg_price - self.open_price)
-                            self.open_quantity -= quantity
-                        else:
-                            pass
-
-            # Calculate unrealized profit or loss per share for open positions
-            if self.open_position:
-                if self.current_order_type == "Buy":
-                    unrealized_profit_loss_per_share = (current_price - self.open_price)
-                elif self.current_order_type == "Sell":
-                    unrealized_profit_loss_per_share = (self.open_price - current_price)
+                position_pnl.apply_fill(order)
+            return self._publish_position_pnl(position_pnl, current_price)
 
-            # Total profit or loss per share
-            total_profit_loss_per_share = realized_profit_loss_per_share + unrealized_profit_loss_per_share
-
-            # logging.info(f"Realized P/L per share: {realized_profit_loss_per_share}")
-            # logging.info(f"Unrealized P/L per share: {unrealized_profit_loss_per_share}")
-            logging.info(f"Total P/L per share: {total_profit_loss_per_share}")
+        except Exception as error:
+            pnl_logger.error("Error in calculate_total_profit_loss_per_share: %s", error, exc_info=True)
+            return 0
 
-            return total_profit_loss_per_share
+    def calculate_incremental_profit_loss_per_share(self, kite, current_price, trading_symbol):
+        """
+        Calculate total profit or loss per share from the running position accumulator.
+        Realized P/L only moves when the order book has new fills for the symbol.
+        """
+        try:
+            if self.position_pnl is None:
+                self.position_pnl = PositionPnL(trading_symbol)
+            self.position_pnl.sync(self.get_order_book(kite))
+            return self._publish_position_pnl(self.position_pnl, current_price)
 
         except Exception as error:
-            logging.error(f"Error in calculate_total_profit_loss_per_share: {error}", exc_info=True)
+            pnl_logger.error("Error in calculate_incremental_profit_loss_per_share: %s", error, exc_info=True)
             return 0
 
+    def _publish_position_pnl(self, position_pnl, current_price):
+        """ Mirror the position state onto the aggregator and return the total P/L per share. """
+        self.open_position = position_pnl.open_position
+        self.open_price = position_pnl.open_price
+        self.open_quantity = position_pnl.open_quantity
+        self.current_order_type = position_pnl.current_order_type
 
+        # Total profit or loss per share
+        total_profit_loss_per_share = position_pnl.total_profit_loss_per_share(current_price)
+        pnl_logger.debug("Total P/L per share for %s: %s", position_pnl.tradingsymbol, total_profit_loss_per_share)
+        return total_profit_loss_per_share
 
-    def update_trailing_stop_loss(self, kite, percentage,tradingsymbol):
-        """ Update trailing stop loss for open orders based on the latest candle values. """
-        try:
-            # Set up logging with a FileHandler
-            logger = logging.getLogger("trailing_stop_loss")
-            logger.setLevel(logging.INFO)
 
-            # Avoid duplicate handlers
-            if not logger.handlers:
-                file_handler = logging.FileHandler("trailing_stop_loss_updates.log")
-                formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-                file_handler.setFormatter(formatter)
-                logger.addHandler(file_handler)
 
+    def update_trailing_stop_loss(self, kite, percentage,tradingsymbol):
+        """ Trail the stop loss of the open order to the cached levels of the latest closed candles. """
+        try:
             # Check for minimum candles
-            if len(self.candles) < 3:
-                #logger.info("Insufficient candle data (less than 3 candles). Exiting function.")
+            if not self.update_levels(percentage):
                 return
 
-            prev_candle_1 = self.candles[-2]
-            prev_candle_2 = self.candles[-3]
-
-            # Check if previous trailing candle is the same
-            # if self.previous_trailing_candle == prev_candle_1:
-            #     logger.info("Previous trailing candle is the same as the last candle. Exiting function.")
-            #     return
-            # else:
-            #     self.previous_trailing_candle = prev_candle_1
-
-            # Calculate high and low values
-            x_value_higher = max(prev_candle_1['high'], prev_candle_2['high'])
-            x_value_lower = min(prev_candle_1['low'], prev_candle_2['low'])
-
-
+            # Buy trails below the lower level, Sell above the higher level
             order_type = self.current_order_type
-
-            # Calculate new trailing stop loss
             if order_type == "Buy":
-                new_stop_loss = math.floor(x_value_lower - (percentage / 100 * x_value_lower))
-                if self.current_stop_loss == new_stop_loss:
-                    #logger.info("Trailing stop loss for BUY order is unchanged. Exiting function.")
-                    return
-                logger.info(f"Updated trailing stop loss for BUY order of {tradingsymbol} to {new_stop_loss}")
-                self.current_stop_loss = new_stop_loss
-
+                new_stop_loss = self.x_value_lower
             elif order_type == "Sell":
-                new_stop_loss = math.ceil(x_value_higher + (percentage / 100 * x_value_higher))
-                if self.current_stop_loss == new_stop_loss:
-                    #logger.info("Trailing stop loss for SELL order is unchanged. Exiting function.")
-                    return
-                logger.info(f"Updated trailing stop loss for SELL order of {tradingsymbol} to {new_stop_loss}")
-                self.current_stop_loss = new_stop_loss
+                new_stop_loss = self.x_value_higher
+            else:
+                return
+
+            if self.current_stop_loss == new_stop_loss:
+                return
+            strategy_logger.info("Updated trailing stop loss for %s order of %s to %s", order_type.upper(), tradingsymbol, new_stop_loss)
+            self.current_stop_loss = new_stop_loss
 
         except Exception as error:
-            logger.exception(f"Error in update_trailing_stop_loss for {tradingsymbol}: {error}")
+            strategy_logger.exception("Error in update_trailing_stop_loss for %s: %s", tradingsymbol, error)
 
 
     def should_close_trade(self,kite,current_price,instrument_token, trading_symbol, exchange, exit_trades_threshold_points, strategy_response, lot_size, percentage):
@@ -679,156 +672,126 @@ class CandleAggregator:
             Returns:
                 bool: True if the trade should be closed, False otherwise.
             """
-            # Set up a dedicated logger for this function
-            close_order_logger = logging.getLogger("close_trade_logger")
-            close_order_logger.setLevel(logging.DEBUG)
-
-            # Avoid duplicate handlers
-            if not close_order_logger.handlers:
-                file_handler = logging.FileHandler("close_trade_logger.log")
-                formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-                file_handler.setFormatter(formatter)
-                close_order_logger.addHandler(file_handler)
-
             if self.close_trade_for_the_day:
-                print("in should_close_trade close_trade already for",trading_symbol)
+                order_logger.debug("in should_close_trade close_trade already for %s", trading_symbol)
                 return True
             if not self.close_trade_for_the_day and self.profit_threshold_points and self.profit_threshold_points>=exit_trades_threshold_points and (self.current_order_type == 'Buy' or self.current_order_type== 'Sell'):            
-                close_order_logger.info(f"Threshold hit for {exit_trades_threshold_points} and {self.profit_threshold_points} and {self.profit_threshold_points>=exit_trades_threshold_points} {trading_symbol} at price: {current_price}")
+                order_logger.info("Threshold hit for %s and %s %s at price: %s",
+                                  exit_trades_threshold_points, self.profit_threshold_points, trading_symbol, current_price)
 
                 # Calculate daily profit or loss before reversing the order
                 #self.fetch_and_calculate_daily_profit_loss(kite,current_price,instrument_token, trading_symbol, exchange, exit_trades_threshold_points, strategy_response, lot_size, percentage)
                 # Stop-loss hit, place reverse order
                 reverse_order_type = "Sell" if self.current_order_type and self.current_order_type == "Buy" else "Buy"
-                close_order_logger.info(f"Reverse order type determined as: {reverse_order_type}")
+                order_logger.info("Reverse order type determined as: %s", reverse_order_type)
                 
                 # Place the reverse order at the stop-loss price for square off
-                # Fetch current positions
-                for position in kite.positions()['net']:
-                    if position['tradingsymbol'] ==  trading_symbol and position['quantity']!=0:
-                        #squaringoffopenpositions
-                        close_order_logger.info(f"Reverse order placement  {reverse_order_type} for {trading_symbol} with {position['quantity']}")
-                        reverse_order_id_sq_off = self.place_single_order(
-                                                            kite,
-                                                            instrument_token,
-                                                            trading_symbol,
-                                                            exchange,
-                                                            exit_trades_threshold_points,
-                                                            reverse_order_type,
-                                                            lot_size,
-                                                            current_price,
-                                                            current_price,  # Using stop-loss price as the price for the reverse order
-                                                            percentage,
-                                                            order_mode="Final Square Off"
-                                                        )
-                close_order_logger.info(
-                                            f"datetime:{datetime.datetime.now(ZoneInfo('Asia/Kolkata'))} - Closing trade for {trading_symbol} due to threshold."
-                                            f"Closing trade for the day for instrument {instrument_token}. "
-                                            f"Exit threshold points: {exit_trades_threshold_points}, "
-                                            f"Profit threshold points: {self.profit_threshold_points}"
-                                        )
-                logging.info(
-                    f"datetime:{datetime.datetime.now(ZoneInfo('Asia/Kolkata'))} - Closing trade for {trading_symbol} due to threshold."
-                    f"Closing trade for the day for instrument {instrument_token}. "
-                    f"Exit threshold points: {exit_trades_threshold_points}, "
-                    f"Profit threshold points: {self.profit_threshold_points}"
-                )
+                # Net position from the local order book
+                net_quantity = self.get_order_book(kite).net_quantity(trading_symbol)
+                if net_quantity != 0:
+                    #squaringoffopenpositions
+                    order_logger.info("Reverse order placement %s for %s with %s", reverse_order_type, trading_symbol, net_quantity)
+                    reverse_order_id_sq_off = self.place_single_order(
+                                                        kite,
+                                                        instrument_token,
+                                                        trading_symbol,
+                                                        exchange,
+                                                        exit_trades_threshold_points,
+                                                        reverse_order_type,
+                                                        lot_size,
+                                                        current_price,
+                                                        current_price,  # Using stop-loss price as the price for the reverse order
+                                                        percentage,
+                                                        order_mode="Final Square Off"
+                                                    )
+                order_logger.info("Closing trade for the day for %s (%s) due to threshold. "
+                                  "Exit threshold points: %s, Profit threshold points: %s",
+                                  trading_symbol, instrument_token, exit_trades_threshold_points, self.profit_threshold_points)
                 self.close_trade_for_the_day = True
                 return True  # Trade should be closed
             return False  # Trade should not be closed
         except Exception as error:
-            logging.error(f"Error should_close_trade: {str(error)}")
-            close_order_logger.info(f"Error should_close_trade: {str(error)}")
+            order_logger.error("Error should_close_trade: %s", error)
             return False
 
 
-    def write_profit_loss_to_json(self,profit_loss_data, filename="current_profit_loss.json"):
+    def update_group_pnl(self, profit_loss_data):
         """
-        Appends profit or loss data to a JSON file in the format
+        Set the P/L of one or more symbols in the shared threshold group accumulator,
+        which persists its snapshot to current_profit_loss.json in the background.
         :param profit_loss_data: Dictionary containing stock symbols and their profit/loss values
-        :param filename: The name of the JSON file to write to (default: profit_loss.json)
         """
         try:
-            # Set up logging with a FileHandler
-            logger = logging.getLogger("trailing_stop_loss")
-            logger.setLevel(logging.INFO)
-
-            # Avoid duplicate handlers
-            if not logger.handlers:
-                file_handler = logging.FileHandler("trailing_stop_loss_updates.log")
-                formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-                file_handler.setFormatter(formatter)
-                logger.addHandler(file_handler)
-
-            try:
-                # Read existing data from the file if it exists
-                try:
-                    with open(filename, 'r') as file:
-                        existing_data = json.load(file)
-                except FileNotFoundError:
-                    # Create the file with an empty dictionary if it doesn't exist
-                    with open(filename, 'w') as file:
-                        json.dump({}, file)
-                    existing_data = {}
-
-                # Update the existing data with the new profit/loss data
-                existing_data.update(profit_loss_data)
-
-                # Write the updated data back to the file
-                with open(filename, 'w') as file:
-                    json.dump(existing_data, file, indent=4)
-
-                #logger.info(f"Profit/loss data successfully updated in {filename}.")
-                print(f"Profit/loss data successfully updated in {filename}.")
-                return True
-            except Exception as e:
-                logger.error(f"An error occurred while updating the file: {e}")
-                print(f"An error occurred while updating the file: {e}")
-                return False
-        except Exception as e:
-            logger.error(f"An error occurred while updating the file: {e}")
-            print(f"An error occurred while updating the file: {e}")
+            self.get_group_pnl().update_many(profit_loss_data)
+            return True
+        except Exception as error:
+            pnl_logger.error("An error occurred while updating profit/loss: %s", error)
             return False
-    def fetch_profit_loss_from_json_dict(self,keys, filename="current_profit_loss.json"):
+
+    def group_pnl_total(self, keys):
         """
-        Fetches profit or loss values for one or more keys from a JSON file.
+        Sum of the P/L values of one or more symbols in the shared accumulator.
 
-        :param keys: List of keys to fetch values for.
-        :param filename: The name of the JSON file to read from (default: profit_loss.json)
-        :return: Dictionary containing the requested keys and their profit/loss values.
+        :param keys: List of trading symbols.
+        :return: Sum of the profit/loss values of the requested keys.
         """
         try:
-            # Read data from the file
-            with open(filename, 'r') as file:
-                data = json.load(file)
-
-            # Extract values for the requested keys
-            result = [data.get(key, 0) for key in keys]
-            return sum(result)
-        except FileNotFoundError:
-            print(f"The file {filename} does not exist.")
-            return 0
-        except Exception as e:
-            print(f"An error occurred while reading the file: {e}")
+            return self.get_group_pnl().total(keys)
+        except Exception as error:
+            pnl_logger.error("An error occurred while reading profit/loss: %s", error)
             return 0
 
 # WebSocket Handler Class
 class WebSocketHandler:
-    def __init__(self, kite, instruments=[]):
+    def __init__(self, kite, instruments=[], candle_clock=CANDLE_CLOCK, tick_queue_shards=TICK_QUEUE_SHARDS,
+                 tick_conflation=TICK_CONFLATION, group_pnl=None, order_executor_workers=ORDER_EXECUTOR_WORKERS,
+                 candle_close_timer=CANDLE_CLOSE_TIMER, clock=candle_time.ist_now, tick_recorder=TICK_RECORDER,
+                 latency_metrics=LATENCY_METRICS, live_broadcast=LIVE_BROADCAST, synchronous_orders=False,
+                 instrument_master=None):
         self.websocket_running = True
         self.kite = kite
+        self.clock = clock  # Returns the current IST datetime, the backtest passes a simulated clock
+        self.candle_clock = candle_clock  # candle_time.LOCAL_CLOCK or candle_time.EXCHANGE_CLOCK
+        self.tick_conflation = tick_conflation  # Evaluate only the latest tick per token per batch
+        # Ticks are processed by shard workers off the socket thread, 0 shards processes them in on_ticks
+        self.tick_queue = None
+        if tick_queue_shards:
+            self.tick_queue = ShardedTickQueue(self.process_ticks, shards=tick_queue_shards,
+                                               maxsize=TICK_QUEUE_MAXSIZE, policy=TICK_QUEUE_POLICY)
+        # Serializes process_ticks between the feed and the candle close timer when there is no tick queue
+        self._process_lock = threading.RLock()
+        # Closes candles on their interval boundary instead of on the first tick after it
+        self.candle_scheduler = None
+        if candle_close_timer:
+            self.candle_scheduler = CandleCloseScheduler(self.on_candle_boundary, clock=candle_clock)
+        # Raw tick batches go to binary day segments for replay and analysis
+        self.tick_recorder = None
+        if tick_recorder:
+            self.tick_recorder = TickRecorder(TICK_RECORDER_DIR, depth=TICK_RECORDER_DEPTH)
         self.kite_ticker = KiteTicker(kite.api_key, kite.access_token)
         
-        # Store instrument details
-        self.instruments = instruments
-        self.instrument_tokens = [int(x['instrument_token']) for x in instruments]
-        # Create a CandleAggregator instance for each instrument, passing the instrument_token
-        self.candle_aggregators = {
-            x['instrument_token']: CandleAggregator(instrument_token=int(x['instrument_token']),
-                                                    tradingsymbol=x['instrument_details']['tradingsymbol'],
-                                                    interval_minutes=int(x['timeframe']),trade_side=x['trade_side'],
-                                                    instrument_details_dict = self.restructure_for_combined_threshold(instruments)) for x in instruments
-        }
+        # Order book shared by all aggregators, kept current from order update events
+        self.order_book = OrderBook(kite)
+        # Orders are placed on a thread pool, 0 workers places them inline on the tick thread.
+        # synchronous_orders keeps the executor flow but places them on the tick thread (backtests).
+        self.order_executor = None
+        if order_executor_workers or synchronous_orders:
+            self.order_executor = OrderExecutor(kite, self.order_book, max_workers=order_executor_workers,
+                                                synchronous=synchronous_orders)
+        # Per stage latency histograms of the tick path, switched on and off at runtime
+        self.latency = LatencyMetrics(enabled=latency_metrics)
+        # Shared running P/L totals per exit threshold group, the sharded engine passes a cross process table
+        self.group_pnl = group_pnl if group_pnl is not None else ThresholdGroupPnL()
+        # Ticks, candles, signals and group P&L for the live viewers, sent to channel layer groups
+        self.broadcaster = None
+        if live_broadcast:
+            self.broadcaster = LiveBroadcaster(self.broadcast_candle_history, self.broadcast_group_totals,
+                                               interval=LIVE_BROADCAST_INTERVAL)
+        self.candle_aggregators = {}
+        # Resolves instrument_details from the day's instrument dump, the stored ones are from the day of adding
+        self.instrument_master = instrument_master
+        # Store instrument details and compile the runtime instrument table
+        self.reload_config(instruments)
 
         # Define on_ticks method
         self.kite_ticker.on_ticks = self.on_ticks
@@ -837,6 +800,60 @@ class WebSocketHandler:
         self.kite_ticker.on_error = self.on_error
         self.kite_ticker.on_noreconnect = self.on_noreconnect
         self.kite_ticker.on_reconnect = self.on_reconnect
+        self.kite_ticker.on_order_update = self.order_book.on_order_update
+
+    def reload_config(self, instruments):
+        """
+        Compile the trade configuration into the runtime instrument table.
+
+        Called once at start and whenever the configuration changes. Existing
+        aggregators are kept so candles and positions survive a reload, unless
+        the timeframe of the instrument changed.
+        """
+        if self.instrument_master is not None:
+            instruments = self.instrument_master.resolve(instruments)
+        # Instruments grouped by exit threshold
+        instrument_details_dict = self.restructure_for_combined_threshold(instruments)
+        self.group_pnl.set_groups(instrument_details_dict)
+
+        # Create a CandleAggregator instance for each instrument, passing the instrument_token
+        candle_aggregators = {}
+        for x in instruments:
+            candle_aggregator = self.candle_aggregators.get(x['instrument_token'])
+            if candle_aggregator is None or candle_aggregator.interval_minutes != int(x['timeframe']):
+                candle_aggregator = CandleAggregator(instrument_token=int(x['instrument_token']),
+                                                     tradingsymbol=x['instrument_details']['tradingsymbol'],
+                                                     interval_minutes=int(x['timeframe']),trade_side=x['trade_side'],
+                                                     instrument_details_dict = instrument_details_dict,
+                                                     order_book=self.order_book,
+                                                     group_pnl=self.group_pnl,
+                                                     order_executor=self.order_executor,
+                                                     latency=self.latency)
+            candle_aggregator.trade_side = x['trade_side']
+            candle_aggregator.instrument_details_dict = instrument_details_dict
+            if self.broadcaster is not None and self.broadcaster.publish_signal not in candle_aggregator.signal_listeners:
+                candle_aggregator.signal_listeners.append(self.broadcaster.publish_signal)
+            candle_aggregators[x['instrument_token']] = candle_aggregator
+
+        instrument_table = compile_instrument_table(instruments, instrument_details_dict, candle_aggregators)
+        for runtime in instrument_table.values():
+            runtime.aggregator.group_key = runtime.group_key
+
+        previous_tokens = set(getattr(self, 'instrument_tokens', []))
+        self.instruments = instruments
+        self.candle_aggregators = candle_aggregators
+        self.instrument_table = instrument_table
+        self.instrument_tokens = [int(x['instrument_token']) for x in instruments]
+        self.symbols_by_token = {int(x['instrument_token']): x['instrument_details']['tradingsymbol'] for x in instruments}
+
+        # Keep the live subscription in line with the new configuration
+        if self.kite_ticker.is_connected():
+            removed_tokens = list(previous_tokens - set(self.instrument_tokens))
+            added_tokens = list(set(self.instrument_tokens) - previous_tokens)
+            if removed_tokens:
+                self.kite_ticker.unsubscribe(removed_tokens)
+            if added_tokens:
+                self.kite_ticker.subscribe(added_tokens)
 
     def on_connect(self, ws, response):
         logging.info("WebSocket connected. Subscribing to instruments.")
@@ -867,96 +884,169 @@ class WebSocketHandler:
             logging.error(f"Error while reconnecting WebSocket: {e}")
 
     def on_ticks(self, ws, ticks):
-        # Process each tick and store candles
+        """
+        KiteTicker callback. Stamps the arrival time on every tick and hands
+        the batch to the tick queue workers, or processes it in place when
+        the queue is disabled.
+        """
         try:
-            #logging.info(f"Received ticks: {ticks}")
-            print(f"datetime:{datetime.datetime.now(ZoneInfo('Asia/Kolkata'))} Received ticks: {ticks}", file=open('ticks.txt', 'a'))
-            current_datetime = datetime.datetime.now(ZoneInfo("Asia/Kolkata"))
+            if tick_logger.isEnabledFor(logging.DEBUG):
+                # Copy the ticks, processing adds fields before the listener formats them
+                tick_logger.debug("Received ticks: %s", [dict(tick) for tick in ticks])
+            # Read the clock once per batch
+            current_datetime = self.clock()
+            if self.tick_recorder is not None:
+                self.tick_recorder.record(ticks, current_datetime)
             # Check if the current time is before 9 AM
-            if  datetime.datetime.now(ZoneInfo("Asia/Kolkata")).hour < 9:
+            if self.candle_clock == candle_time.LOCAL_CLOCK and current_datetime.hour < 9:
                 # Continue if the time is before 9 AM
                 return None
-            
+            current_epoch = candle_time.to_epoch(current_datetime)
             for tick in ticks:
+                tick['current_datetime'] = current_datetime
+                tick['epoch'] = current_epoch
+            if self.latency.enabled:
+                self.latency.observe_arrival(ticks, current_datetime, self.symbols_by_token)
+
+            self.handle_ticks(ticks)
+        except Exception as error:
+            logging.error(f"Error in on_ticks: {error}")
+            return None
+
+    def handle_ticks(self, ticks):
+        """ Close the candles whose boundary the batch reached, then queue or process the stamped ticks. """
+        if self.broadcaster is not None:
+            self.broadcaster.publish_ticks(ticks)
+        if self.candle_scheduler is not None and ticks:
+            if self.candle_clock == candle_time.EXCHANGE_CLOCK:
+                exchange_epochs = [candle_time.to_epoch(tick['exchange_timestamp']) for tick in ticks if tick.get('exchange_timestamp')]
+                batch_epoch = max(exchange_epochs) if exchange_epochs else ticks[0]['epoch']
+            else:
+                batch_epoch = ticks[0]['epoch']
+            self.candle_scheduler.advance(batch_epoch)
+
+        if self.tick_queue is not None:
+            self.tick_queue.put_many(ticks)
+        else:
+            with self._process_lock:
+                self.process_ticks(ticks)
+
+    def on_candle_boundary(self, instrument_token, boundary):
+        """
+        Candle close scheduler callback. The close event is processed like a
+        tick, by the worker that owns the instrument, so it is ordered with
+        the ticks around it and never races them.
+        """
+        event = {'instrument_token': instrument_token, 'candle_close': boundary, 'epoch': boundary}
+        if self.tick_queue is not None:
+            self.tick_queue.put_many([event])
+        else:
+            with self._process_lock:
+                self.process_ticks([event])
+
+    def schedule_candle_close(self, candle_aggregator):
+        """ Schedule the end of the aggregator's current candle, once per candle. """
+        if self.candle_scheduler is None or candle_aggregator.current_candle_start is None:
+            return
+        boundary = candle_aggregator.current_candle_start + candle_aggregator.interval_minutes * 60
+        if boundary != candle_aggregator.scheduled_close:
+            candle_aggregator.scheduled_close = boundary
+            self.candle_scheduler.schedule(candle_aggregator.instrument_token, boundary)
+
+    def process_ticks(self, ticks):
+        """ Run candles, stop-loss, P&L and order placement for a batch of stamped ticks. """
+        # Process each tick and store candles
+        try:
+            if self.tick_conflation:
+                # Position of the latest tick per token in this batch
+                latest_tick_index = {tick['instrument_token']: index for index, tick in enumerate(ticks)}
+            for index, tick in enumerate(ticks):
                 try:
                     instrument_token = tick['instrument_token']
                     #logging.info(f"Processing tick for instrument_token: {instrument_token}")
                     #logging.debug(f"Tick data: {tick}")
 
-                    if current_datetime.hour>=23:
-                        print("Time More than 11 PM, Bot Will not trade further for the day")
-                        continue
-                    if current_datetime.hour < 9:
-                        print("Time less than 9 AM, trading not started yet")
-                        continue  # Skip the rest of the loop until it's 9:15 AM or later
-
-                    # Get instrument-specific data
-                    instrument_data = next((x for x in self.instruments if int(x['instrument_token']) == instrument_token), None)
-                    if instrument_data is None:
-                        logging.error(f"Instrument data not found for token: {instrument_token}")
+                    # Get the compiled instrument configuration
+                    runtime = self.instrument_table.get(instrument_token)
+                    if runtime is None:
+                        tick_logger.error("Instrument data not found for token: %s", instrument_token)
                         continue
 
+                    # Bucket by the batch arrival time stamped in on_ticks, or by the exchange timestamp of the tick
+                    if self.candle_clock == candle_time.EXCHANGE_CLOCK and tick.get('exchange_timestamp'):
+                        tick['current_datetime'] = tick['exchange_timestamp']
+                        tick['epoch'] = candle_time.to_epoch(tick['exchange_timestamp'])
 
-                    logging.info(f"Instrument data found for token: {instrument_token}, Data: {instrument_data}")
-                    lot_size = int(instrument_data['lot_size'])
-                    percentage = float(instrument_data['trade_calculation_percentage'])
-                    trading_symbol = instrument_data['instrument_details']['tradingsymbol']
-                    exchange = instrument_data['instrument_details']['exchange']
-                    exit_trades_threshold_points = float(instrument_data['exit_trades_threshold_points'])
-
-                    if exchange in ['NFO','NSE','BSE'] and current_datetime.hour>=15:
-                        print("Time More than 3 PM for equity, Bot Will not trade further for the day")
+                    # Skip ticks outside the trading session of the instrument's exchange,
+                    # a candle close event belongs to the candle it ends
+                    candle_close = tick.get('candle_close')
+                    session_epoch = tick['epoch'] if candle_close is None else candle_close - 1
+                    if not runtime.in_session(candle_time.minute_of_day(session_epoch)):
                         continue
 
-                    if exchange in ['NFO','NSE','BSE'] and (current_datetime.hour < 9 or (current_datetime.hour == 9 and current_datetime.minute < 15)):
-                        continue  # Skip the rest of the loop until it's 9:15 AM or later
-
-                    tick['current_datetime'] = datetime.datetime.now(ZoneInfo("Asia/Kolkata"))
+                    lot_size = runtime.lot_size
+                    percentage = runtime.percentage
+                    trading_symbol = runtime.tradingsymbol
+                    exchange = runtime.exchange
+                    exit_trades_threshold_points = runtime.exit_trades_threshold_points
 
                     # Process the tick using the respective CandleAggregator for the instrument
-                    candle_aggregator = self.candle_aggregators.get(str(instrument_token))
-                    if candle_aggregator is None:
-                        logging.error(f"Candle aggregator not found for token: {instrument_token}")
-                        continue
+                    candle_aggregator = runtime.aggregator
+
+                    latency = self.latency
+                    timed = latency.enabled
+                    if timed and 'received_perf' in tick:
+                        latency.observe('queue_wait', trading_symbol, time.perf_counter() - tick['received_perf'])
 
                     # Call the async function directly
                     #asyncio.run(candle_aggregator.fetch_and_calculate_daily_profit_loss(self.kite))
 
-                    logging.info("tsymbol:order_active:exit,current_profit,closed - %s,%s, %s, %s, %s, %s", 
-                                        str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
-                                        trading_symbol, 
-                                        candle_aggregator.order_active, 
-                                        exit_trades_threshold_points, 
-                                        candle_aggregator.profit_threshold_points, 
+                    tick_logger.debug("tsymbol:order_active:exit,current_profit,closed - %s, %s, %s, %s, %s",
+                                        trading_symbol,
+                                        candle_aggregator.order_active,
+                                        exit_trades_threshold_points,
+                                        candle_aggregator.profit_threshold_points,
                                         candle_aggregator.close_trade_for_the_day)
 
+                    # Apply the outcome of orders placed since the last tick, also for instruments closed for the day
+                    candle_aggregator.apply_order_events()
 
                     if candle_aggregator.close_trade_for_the_day:
-                        logging.info(
-                            f"closed trade for the day for instrument {trading_symbol}. "
-                            f"Exit threshold points: {exit_trades_threshold_points}, "
-                            f"Profit threshold points: {candle_aggregator.profit_threshold_points}"
-                        )
-                        print("------------------closed1--------------------------------",trading_symbol,exit_trades_threshold_points,candle_aggregator.profit_threshold_points)
+                        strategy_logger.debug("closed trade for the day for instrument %s. Exit threshold points: %s, Profit threshold points: %s",
+                                              trading_symbol, exit_trades_threshold_points, candle_aggregator.profit_threshold_points)
                         continue
 
-                    trading_symbols_list = [x['tradingsymbol'] for x in  candle_aggregator.instrument_details_dict[str(int(exit_trades_threshold_points))]]
-                    print(trading_symbols_list)
-                    if not candle_aggregator.order_active and (trading_symbol in trading_symbols_list) and not candle_aggregator.close_trade_for_the_day:
+                    if not candle_aggregator.order_active and (trading_symbol in runtime.group_symbols) and not candle_aggregator.close_trade_for_the_day:
                         # Assign the daily profit/loss to the profit threshold points
-                        candle_aggregator.profit_threshold_points = candle_aggregator.fetch_profit_loss_from_json_dict(trading_symbols_list)
+                        candle_aggregator.profit_threshold_points = self.group_pnl.group_total(runtime.group_key)
                         if candle_aggregator.profit_threshold_points>=exit_trades_threshold_points:
-                            logging.info(
-                            f"****************1234*****************************************************"
-                            f"closing trade for the day for instrument at second stage {trading_symbol}. "
-                            f"Exit threshold points: {exit_trades_threshold_points}, "
-                            f"Profit threshold points: {candle_aggregator.profit_threshold_points}"
-                            )
+                            strategy_logger.info("closing trade for the day for instrument at second stage %s. Exit threshold points: %s, Profit threshold points: %s",
+                                                 trading_symbol, exit_trades_threshold_points, candle_aggregator.profit_threshold_points)
                             candle_aggregator.close_trade_for_the_day = True
                     
                     
-                    logging.info(f"Candle aggregator found for token: {instrument_token}")
-                    candle_aggregator.process_tick(tick)
+                    if timed:
+                        stage_started = time.perf_counter()
+                    if candle_close is None:
+                        candle_aggregator.process_tick(tick)
+                    else:
+                        # Timer event: close on the boundary, then evaluate on the carried forward price
+                        carry_forward = runtime.in_session(candle_time.minute_of_day(candle_close))
+                        if candle_aggregator.close_candle(candle_close, carry_forward) is None or not carry_forward:
+                            continue
+                        tick['last_price'] = candle_aggregator.current_candle.close
+                    if timed:
+                        latency.observe('candle_update', trading_symbol, time.perf_counter() - stage_started)
+                    self.schedule_candle_close(candle_aggregator)
+
+                    # Hold back decisions while an order for the instrument is in flight
+                    if self.order_executor is not None and self.order_executor.in_flight(instrument_token):
+                        continue
+
+                    # Conflation: every tick builds candles, decisions run on the latest price only
+                    if self.tick_conflation and not candle_aggregator.should_evaluate(
+                            tick['last_price'], index != latest_tick_index[instrument_token]):
+                        continue
 
                     # Log the current candle and updated tick info
                     #logging.debug(f"Updated tick processed: {tick}")
@@ -964,20 +1054,28 @@ class WebSocketHandler:
 
                     # Update trailing stop loss based on the latest tick
                     new_stop_loss = candle_aggregator.update_trailing_stop_loss(self.kite, percentage,trading_symbol)
-                    logging.info(f"Updated trailing stop loss for token {instrument_token}: {new_stop_loss}")
+                    strategy_logger.debug("Updated trailing stop loss for token %s: %s", instrument_token, new_stop_loss)
 
                     # Check if the current price hits the stored stop loss
-                    current_price = candle_aggregator.current_candle['close']
+                    current_price = candle_aggregator.current_candle.close
                     # Call the async function directly
+                    if timed:
+                        stage_started = time.perf_counter()
                     candle_aggregator.fetch_and_calculate_daily_profit_loss(self.kite,current_price,instrument_token, trading_symbol, exchange, exit_trades_threshold_points, {}, lot_size, percentage)
-                    logging.info(f"Current price for token {instrument_token}: {current_price}, Stop-loss: {candle_aggregator.current_stop_loss}, Order Type:{candle_aggregator.current_order_type}")
+                    if timed:
+                        latency.observe('pnl_refresh', trading_symbol, time.perf_counter() - stage_started)
+                    if self.order_executor is not None and self.order_executor.in_flight(instrument_token):
+                        # The threshold check just submitted a square off
+                        continue
+                    tick_logger.debug("Current price for token %s: %s, Stop-loss: %s, Order Type:%s",
+                                      instrument_token, current_price, candle_aggregator.current_stop_loss, candle_aggregator.current_order_type)
                     if (candle_aggregator.order_active and
                             ((candle_aggregator.current_order_type == 'Buy' and candle_aggregator.current_stop_loss and current_price <= candle_aggregator.current_stop_loss) or
                             (candle_aggregator.current_order_type == 'Sell' and candle_aggregator.current_stop_loss and current_price >= candle_aggregator.current_stop_loss))):
                         
                         # Stop-loss hit, handle reverse order
-                        logging.warning(f"Stop-loss hit for {instrument_token}. Current price: {current_price}, Stop-loss: {candle_aggregator.current_stop_loss}")
-                        print(f"{datetime.datetime.now(ZoneInfo('Asia/Kolkata'))} Stop-loss hit for {instrument_token}. Current price: {current_price}, Stop-loss: {candle_aggregator.current_stop_loss},Order Type:{candle_aggregator.current_order_type}", file=open("reverse_logic entered.log", "a"))
+                        order_logger.warning("Stop-loss hit for %s. Current price: %s, Stop-loss: %s, Order Type:%s",
+                                             instrument_token, current_price, candle_aggregator.current_stop_loss, candle_aggregator.current_order_type)
                         candle_aggregator.handle_reverse_order(
                             self.kite,
                             instrument_token, 
@@ -991,30 +1089,27 @@ class WebSocketHandler:
 
                         # Mark order as inactive to prevent new orders until a fresh signal
                         #candle_aggregator.order_active = False  
-                        logging.info(f"Reverse order added continuing the flow")
+                        order_logger.info("Reverse order added continuing the flow")
                         continue
                     if (candle_aggregator.order_active):
-                        print("the order is already active, continuing exection")
                         continue
                     # Check strategy based on the candle data and the specific percentage
+                    if timed:
+                        stage_started = time.perf_counter()
                     strategy_response = candle_aggregator.check_strategy(instrument_token, percentage)
+                    if timed:
+                        latency.observe('strategy_check', trading_symbol, time.perf_counter() - stage_started)
                     #logging.debug(f"Strategy response for token {instrument_token}: {strategy_response}")
 
 
                     if candle_aggregator.close_trade_for_the_day:
-                        logging.info(
-                            f"------------------closed--------------------------------"
-                            f"Part 2 closed trade for the day for instrument {trading_symbol}. "
-                            f"Exit threshold points: {exit_trades_threshold_points}, "
-                            f"Profit threshold points: {candle_aggregator.profit_threshold_points}"
-                            f"------------------****--------------------------------"
-                        )
-                        print("------------------closed--------------------------------",trading_symbol,exit_trades_threshold_points,candle_aggregator.profit_threshold_points)
+                        strategy_logger.info("Part 2 closed trade for the day for instrument %s. Exit threshold points: %s, Profit threshold points: %s",
+                                             trading_symbol, exit_trades_threshold_points, candle_aggregator.profit_threshold_points)
                         continue
 
                     #this will be first order placement when no order has been placed for the day, rest 
                     if strategy_response and not candle_aggregator.order_active:
-                        logging.info(f"Placing order for token {instrument_token} based on strategy through normal mode")
+                        order_logger.info("Placing order for token %s based on strategy through normal mode", instrument_token)
                         # Place order with lot size and stop loss from strategy
                         order_id = candle_aggregator.place_single_order(
                             self.kite,
@@ -1029,7 +1124,10 @@ class WebSocketHandler:
                             order_mode="Normal Order"
                         )
                         if order_id:
-                            logging.info(f"Order placed successfully: {order_id} for {strategy_response['order_type']} {instrument_token}")
+                            if order_id == SUBMITTED:
+                                order_logger.info("Order submitted for %s %s", strategy_response['order_type'], instrument_token)
+                            else:
+                                order_logger.info("Order placed successfully: %s for %s %s", order_id, strategy_response['order_type'], instrument_token)
 
                             # Mark the order as active and store the current stop loss and order type
                             candle_aggregator.order_active = True
@@ -1040,21 +1138,22 @@ class WebSocketHandler:
 
                             # Update trailing stop loss immediately after placing the order
                             candle_aggregator.update_trailing_stop_loss(self.kite, percentage,trading_symbol)
-                            logging.info(f"Trailing stop loss updated after placing order for {instrument_token}.")
+                            strategy_logger.info("Trailing stop loss updated after placing order for %s.", instrument_token)
                         else:
-                            logging.error(f"Failed to place order for token {instrument_token}. Strategy response: {strategy_response}")
+                            order_logger.error("Failed to place order for token %s. Strategy response: %s", instrument_token, strategy_response)
 
                 except KeyError as ke:
                     logging.error(f"KeyError processing tick for token {tick.get('instrument_token', 'Unknown')}: {ke}")
                     logging.debug(f"Tick data at KeyError: {tick}")
-                    return None
+                    # A worker batch can span several socket batches, only skip the failing tick
+                    continue
                 except Exception as e:
                     logging.error(f"Error processing tick for token {tick.get('instrument_token', 'Unknown')}: {e}")
                     logging.debug(f"Exception details: {str(e)}. Tick data: {tick}")
-                    return None
+                    continue
 
         except Exception as error:
-            logging.error(f"Error in on_ticks: {error}")
+            logging.error(f"Error in process_ticks: {error}")
             logging.debug(f"Exception details: {str(error)}. Ticks: {ticks}")
             return None
 
@@ -1063,39 +1162,121 @@ class WebSocketHandler:
     def stop_websocket(self):
         """Stop the WebSocket and handle cleanup, with logging."""
         try:
-            # Set up logging with a FileHandler
-            logger = logging.getLogger("stop_websocket")
-            logger.setLevel(logging.INFO)
-
-            # Avoid duplicate handlers
-            if not logger.handlers:
-                file_handler = logging.FileHandler("stop_websocket_run_script_.log")
-                formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-                file_handler.setFormatter(formatter)
-                logger.addHandler(file_handler)
-
-            logger.info("Attempting to stop the WebSocket.")
+            websocket_logger.info("Attempting to stop the WebSocket.")
 
             # Check if the WebSocket is already stopped
             if not self.websocket_running:
-                logger.warning("WebSocket stop called, but it was not running.")
+                websocket_logger.warning("WebSocket stop called, but it was not running.")
                 return
 
             # Perform unsubscription
             self.kite_ticker.unsubscribe(self.instrument_tokens)
-            logger.info(f"Unsubscribed from tokens: {self.instrument_tokens}")
+            websocket_logger.info(f"Unsubscribed from tokens: {self.instrument_tokens}")
             # Close the WebSocket connection
             self.kite_ticker.close(1000, "No More Trade Required")
-            logger.info("WebSocket closed with code 1000 and reason 'No More Trade Required'.")
+            websocket_logger.info("WebSocket closed with code 1000 and reason 'No More Trade Required'.")
+
+            # Let the shard workers finish the batch in hand before the journals are closed
+            if self.candle_scheduler is not None:
+                self.candle_scheduler.stop()
+            if self.tick_queue is not None:
+                self.tick_queue.stop()
+            if self.order_executor is not None:
+                self.order_executor.shutdown()
+
+            self.order_book.stop()
+            self.group_pnl.stop()
+            if self.tick_recorder is not None:
+                self.tick_recorder.close()
+            if self.broadcaster is not None:
+                self.broadcaster.stop()
+
+            # Compact the candle journals and release their file handles
+            for candle_aggregator in self.candle_aggregators.values():
+                candle_aggregator.candle_journal.close()
 
             # Update the running state
             self.websocket_running = False
-            logger.info("WebSocket stopped successfully.")
+            websocket_logger.info("WebSocket stopped successfully.")
         except Exception as error:
             # Log any exception that occurs during the stop process
-            logger.error(f"Failed to stop WebSocket: {error}")
+            websocket_logger.error(f"Failed to stop WebSocket: {error}")
 
         #self.kite_ticker.
+    def queue_metrics(self):
+        """ Depth, drop counters and lag of every tick queue shard. """
+        if self.tick_queue is None:
+            return []
+        return self.tick_queue.metrics()
+
+    def order_metrics(self):
+        """ Order executor counters and submit-to-ack latency. """
+        if self.order_executor is None:
+            return {}
+        return self.order_executor.metrics()
+
+    def conflation_metrics(self):
+        """ Evaluated and skipped decision pipeline runs per instrument. """
+        metrics = {}
+        for candle_aggregator in self.candle_aggregators.values():
+            metrics[candle_aggregator.tradingsymbol] = {
+                'evaluations': candle_aggregator.evaluations,
+                'skipped_superseded': candle_aggregator.skipped_superseded,
+                'skipped_unchanged': candle_aggregator.skipped_unchanged,
+            }
+        return metrics
+
+    def scheduler_metrics(self):
+        """ Candle close events fired and how late they ran. """
+        if self.candle_scheduler is None:
+            return {}
+        return self.candle_scheduler.metrics()
+
+    def latency_snapshots(self):
+        """ Stage latency histograms of this process, see latency.render_prometheus. """
+        return [self.latency.snapshot()]
+
+    def set_latency_metrics(self, enabled):
+        """ Switch the stage latency histograms on or off. """
+        self.latency.set_enabled(enabled)
+
+    def recorder_metrics(self):
+        """ Records and bytes written by the tick recorder. """
+        if self.tick_recorder is None:
+            return {}
+        return self.tick_recorder.metrics()
+
+    def broadcast_candle_history(self, instrument_token):
+        """ CandleHistory of a subscribed instrument by integer token, for the live broadcaster. """
+        runtime = self.instrument_table.get(instrument_token)
+        if runtime is None or runtime.aggregator is None:
+            return None
+        return runtime.aggregator.candles
+
+    def broadcast_group_totals(self):
+        """ Running P&L of every threshold group with a subscribed instrument. """
+        totals = {}
+        for runtime in self.instrument_table.values():
+            if runtime.group_key is not None and runtime.group_key not in totals:
+                try:
+                    totals[runtime.group_key] = self.group_pnl.group_total(runtime.group_key)
+                except KeyError:
+                    continue
+        return totals
+
+    def broadcast_metrics(self):
+        """ Flushes and messages of the live broadcaster. """
+        if self.broadcaster is None:
+            return {}
+        return self.broadcaster.metrics()
+
+    def candle_history(self, instrument_token, timeframe):
+        """ The in-memory CandleHistory of an instrument and timeframe, None when it is not subscribed with it. """
+        candle_aggregator = self.candle_aggregators.get(str(instrument_token))
+        if candle_aggregator is None or candle_aggregator.interval_minutes != int(timeframe):
+            return None
+        return candle_aggregator.candles
+
     def is_running(self):
         """ Start the WebSocket and listen for ticks, with connection checks and retries. """
         # Connect to the WebSocket initially
@@ -1103,6 +1284,20 @@ class WebSocketHandler:
 
     def run_websocket(self):
         """ Start the WebSocket and listen for ticks, with connection checks and retries. """
+        # Seed the order book once, then keep it current from order updates and a slow poll
+        self.order_book.seed()
+        self.order_book.start_reconciliation()
+        self.group_pnl.load_snapshot()
+        self.group_pnl.start()
+        if self.tick_queue is not None:
+            self.tick_queue.start()
+        if self.candle_scheduler is not None:
+            self.candle_scheduler.start()
+        if self.tick_recorder is not None:
+            self.tick_recorder.start()
+        if self.broadcaster is not None:
+            self.broadcaster.start()
+
         # Connect to the WebSocket initially
         self.kite_ticker.connect(threaded=True)
 
@@ -1141,5 +1336,5 @@ class WebSocketHandler:
         
         except (KeyError, TypeError) as error:
             # Log the error for better debugging
-            print(f"Error restructuring data: {error}")
+            logging.error(f"Error restructuring data: {error}")
             return {}
\ No newline at end of file
@@ -0,0 +1,345 @@
+import os
+import logging
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .candle_store import load_candles
+from . import candle_time
+
+# Trade sides as configured in tradeconfiguration
+TRADE_SIDES = ('BOTH', 'BUY', 'SELL')
+# Parsed candle files are cached next to them as <file>.npz
+CACHE_SUFFIX = '.npz'
+COLUMNS = ('start', 'open', 'high', 'low', 'close')
+
+
+class ParameterSet:
+    """ One point of the sweep grid. """
+
+    __slots__ = ('timeframe', 'percentage', 'exit_trades_threshold_points')
+
+    def __init__(self, timeframe, percentage, exit_trades_threshold_points):
+        self.timeframe = timeframe
+        self.percentage = percentage
+        self.exit_trades_threshold_points = exit_trades_threshold_points
+
+    def key(self):
+        return (self.timeframe, self.percentage, self.exit_trades_threshold_points)
+
+    def to_dict(self):
+        return {
+            'timeframe': self.timeframe,
+            'trade_calculation_percentage': self.percentage,
+            'exit_trades_threshold_points': self.exit_trades_threshold_points,
+        }
+
+
+def cache_path(path):
+    return path + CACHE_SUFFIX
+
+
+def load_minute_candles(path, cache=True):
+    """
+    Load a 1 minute candle file (journal or exported list) as column arrays.
+
+    sweep_instrument loads each file once and derives every timeframe from
+    the same arrays. With cache the arrays are kept in <path>.npz, which is
+    used as long as the size and modification time of the file match, so
+    repeated sweeps over the same files skip parsing the JSON.
+
+    Returns:
+    - dict: 'start' (int64 IST epochs), 'open', 'high', 'low', 'close' (float64), sorted by start.
+    """
+    stat = os.stat(path)
+    source = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    if cache:
+        columns = _read_cache(cache_path(path), source)
+        if columns is not None:
+            return columns
+
+    candles = load_candles(path)
+    candles.sort(key=lambda candle: candle['start_time'])
+    start = np.array([candle_time.parse_start_time(candle['start_time']) for candle in candles], dtype=np.int64)
+    columns = {'start': start}
+    for field in ('open', 'high', 'low', 'close'):
+        columns[field] = np.array([candle[field] for candle in candles], dtype=np.float64)
+    if cache:
+        _write_cache(cache_path(path), source, columns)
+    return columns
+
+
+def _read_cache(path, source):
+    """ Columns of a cache file written for source (size, mtime), None when missing or stale. """
+    try:
+        with np.load(path) as archive:
+            if not np.array_equal(archive['source'], source):
+                return None
+            return {field: archive[field] for field in COLUMNS}
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as error:
+        logging.warning(f"Ignoring unreadable candle cache {path}: {error}")
+        return None
+
+
+def _write_cache(path, source, columns):
+    # Written aside and renamed, a concurrent sweep never reads a partial file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            np.savez(file, source=source, **columns)
+        os.replace(temp_path, path)
+    except OSError as error:
+        logging.warning(f"Could not write the candle cache {path}: {error}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def split_days(candles):
+    """ Split column arrays into one dict of columns per trading day. """
+    days = candles['start'] // 86400
+    if not len(days):
+        return []
+    boundaries = np.flatnonzero(np.diff(days)) + 1
+    return [{field: column[begin:end] for field, column in candles.items()}
+            for begin, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(days)])]
+
+
+def price_path(day):
+    """
+    Approximate the tick path of a day from its 1 minute candles.
+
+    Every minute contributes open, the extreme away from the close, the other
+    extreme and close (O-L-H-C for up candles, O-H-L-C for down candles), so
+    stop losses and breakouts touched inside the minute are seen.
+
+    Returns:
+    - tuple: (prices, minute index of every price)
+    """
+    up = day['close'] >= day['open']
+    first_extreme = np.where(up, day['low'], day['high'])
+    second_extreme = np.where(up, day['high'], day['low'])
+    prices = np.stack([day['open'], first_extreme, second_extreme, day['close']], axis=1).ravel()
+    minutes = np.repeat(np.arange(len(day['start'])), 4)
+    return prices, minutes
+
+
+def breakout_levels(day, timeframe, percentages):
+    """
+    Breakout levels of check_strategy for every minute of a day.
+
+    Minutes are grouped into timeframe candles anchored at the day's first
+    minute, as CandleAggregator starts its first candle at the first tick's
+    minute and steps by the interval from there. Intervals without a minute
+    have no candle. The levels of a minute come from the two candles before
+    the one it belongs to.
+
+    Returns:
+    - tuple: (higher, lower), arrays of shape (len(percentages), minutes), NaN
+      while fewer than two earlier candles exist.
+    """
+    buckets = (day['start'] - day['start'][0]) // (timeframe * 60)
+    # Candle index of every minute, intervals without a minute have no candle
+    groups = np.concatenate(([0], np.cumsum(np.diff(buckets) != 0)))
+    candle_count = int(groups[-1]) + 1
+    candle_high = np.full(candle_count, -np.inf)
+    candle_low = np.full(candle_count, np.inf)
+    np.maximum.at(candle_high, groups, day['high'])
+    np.minimum.at(candle_low, groups, day['low'])
+
+    # Levels of candle c from candles c-1 and c-2
+    max_high = np.full(candle_count, np.nan)
+    min_low = np.full(candle_count, np.nan)
+    max_high[2:] = np.maximum(candle_high[1:-1], candle_high[:-2])
+    min_low[2:] = np.minimum(candle_low[1:-1], candle_low[:-2])
+
+    factors = (np.asarray(percentages, dtype=np.float64) / 100)[:, None]
+    higher = np.ceil(max_high[None, :] + factors * max_high[None, :])
+    lower = np.floor(min_low[None, :] - factors * min_low[None, :])
+    return higher[:, groups], lower[:, groups]
+
+
+def simulate_day(prices, higher, lower, thresholds, trade_side='BOTH'):
+    """
+    Run the breakout strategy on one day's price path for a whole grid at once.
+
+    Mirrors WebSocketHandler.process_ticks for a single instrument in its own
+    threshold group: trail the stop to the levels, square off and stop for
+    the day once P/L per share reaches the threshold, square off and reverse
+    (or only square off for one sided trade sides) on a stop-loss hit, and
+    enter on a close beyond the levels with the opposite level as stop.
+
+    Parameters:
+    - prices (ndarray): Price path, shape (steps,).
+    - higher, lower (ndarray): Levels per grid point and step, shape (grid, steps).
+    - thresholds (ndarray): exit_trades_threshold_points per grid point.
+
+    Returns:
+    - dict: Arrays per grid point: pnl, max_drawdown, orders, round_trips, winning_trips.
+    """
+    grid = len(thresholds)
+    position = np.zeros(grid, dtype=np.int8)
+    entry = np.zeros(grid)
+    stop = np.zeros(grid)
+    realized = np.zeros(grid)
+    closed = np.zeros(grid, dtype=bool)
+    orders = np.zeros(grid, dtype=np.int64)
+    round_trips = np.zeros(grid, dtype=np.int64)
+    winning_trips = np.zeros(grid, dtype=np.int64)
+    peak = np.zeros(grid)
+    max_drawdown = np.zeros(grid)
+    allow_buy = trade_side in ('BOTH', 'BUY')
+    allow_sell = trade_side in ('BOTH', 'SELL')
+    reverse = trade_side == 'BOTH'
+
+    for step, price in enumerate(prices):
+        step_higher = higher[:, step]
+        step_lower = lower[:, step]
+        valid = ~np.isnan(step_higher)
+
+        # Trailing stop follows the levels of the latest closed candles
+        stop = np.where(valid & (position == 1), step_lower, stop)
+        stop = np.where(valid & (position == -1), step_higher, stop)
+
+        # Threshold exit on realized plus unrealized P/L
+        open_profit = position * (price - entry)
+        closing = ~closed & (realized + open_profit >= thresholds)
+        squared_off = closing & (position != 0)
+        winning_trips += squared_off & (open_profit > 0)
+        round_trips += squared_off
+        orders += squared_off
+        realized = np.where(closing, realized + open_profit, realized)
+        position = np.where(closing, 0, position).astype(np.int8)
+        closed |= closing
+        active = ~closed
+
+        # Stop-loss hit: square off, then reverse with the same stop
+        stopped = active & (((position == 1) & (price <= stop)) | ((position == -1) & (price >= stop)))
+        open_profit = position * (price - entry)
+        realized = np.where(stopped, realized + open_profit, realized)
+        winning_trips += stopped & (open_profit > 0)
+        round_trips += stopped
+        orders += stopped
+        if reverse:
+            position = np.where(stopped, -position, position).astype(np.int8)
+            entry = np.where(stopped, price, entry)
+            orders += stopped
+        else:
+            position = np.where(stopped, 0, position).astype(np.int8)
+
+        # Breakout entries while flat
+        flat = active & ~stopped & (position == 0) & valid
+        above = price > step_higher
+        buy = flat & above & allow_buy
+        sell = flat & ~above & (price < step_lower) & allow_sell
+        position = np.where(buy, 1, np.where(sell, -1, position)).astype(np.int8)
+        entry = np.where(buy | sell, price, entry)
+        stop = np.where(buy, step_lower, np.where(sell, step_higher, stop))
+        orders += buy | sell
+
+        equity = realized + position * (price - entry)
+        peak = np.maximum(peak, equity)
+        max_drawdown = np.maximum(max_drawdown, peak - equity)
+
+    # Open positions are marked to the last price
+    pnl = realized + position * (prices[-1] - entry) if len(prices) else realized
+    return {
+        'pnl': pnl,
+        'max_drawdown': max_drawdown,
+        'orders': orders,
+        'round_trips': round_trips,
+        'winning_trips': winning_trips,
+    }
+
+
+def sweep_instrument(path, timeframes, percentages, thresholds, trade_side='BOTH', cache=True):
+    """
+    Evaluate every parameter set on every day of one candle file.
+
+    Returns:
+    - list: (ParameterSet key, metrics dict) per parameter set, counts and P&L summed
+      over the days, max_drawdown the worst intraday drawdown.
+    """
+    days = split_days(load_minute_candles(path, cache))
+    # One simulation per day covers the whole grid, levels are stacked per timeframe
+    grid = list(itertools.product(timeframes, percentages, thresholds))
+    level_index = np.array([timeframes.index(timeframe) * len(percentages) + percentages.index(percentage)
+                            for timeframe, percentage, _ in grid])
+    grid_thresholds = np.array([threshold for _, _, threshold in grid], dtype=np.float64)
+
+    totals = {name: np.zeros(len(grid)) for name in ('pnl', 'orders', 'round_trips', 'winning_trips')}
+    max_drawdown = np.zeros(len(grid))
+    for day in days:
+        prices, minutes = price_path(day)
+        levels = [breakout_levels(day, timeframe, percentages) for timeframe in timeframes]
+        higher = np.concatenate([timeframe_higher for timeframe_higher, _ in levels])[level_index]
+        lower = np.concatenate([timeframe_lower for _, timeframe_lower in levels])[level_index]
+        day_metrics = simulate_day(prices, higher[:, minutes], lower[:, minutes], grid_thresholds, trade_side)
+        max_drawdown = np.maximum(max_drawdown, day_metrics['max_drawdown'])
+        for name in totals:
+            totals[name] += day_metrics[name]
+
+    return [(ParameterSet(*parameters).key(), {
+        'pnl': float(totals['pnl'][index]),
+        'max_drawdown': float(max_drawdown[index]),
+        'orders': int(totals['orders'][index]),
+        'round_trips': int(totals['round_trips'][index]),
+        'winning_trips': int(totals['winning_trips'][index]),
+        'days': len(days),
+    }) for index, parameters in enumerate(grid)]
+
+
+def run_sweep(candle_files, timeframes, percentages, thresholds, trade_side='BOTH', processes=None, cache=True):
+    """
+    Sweep the breakout strategy over a parameter grid and a set of instruments.
+
+    Every candle file (1 minute candles of one instrument) is a task on a
+    process pool; inside a task the whole percentage x threshold grid runs
+    vectorized, day by day. Instruments are independent, each is treated as
+    its own threshold group.
+
+    Parameters:
+    - candle_files (list): Candle journal or exported candle files, one instrument each.
+    - timeframes, percentages, thresholds (list): Values of timeframe,
+      trade_calculation_percentage and exit_trades_threshold_points to combine.
+    - processes (int): Pool size, None uses the CPU count, 1 runs in process.
+    - cache (bool): Read and write the parsed candles in <file>.npz, see load_minute_candles.
+
+    Returns:
+    - list: One dict per parameter set with the summed pnl, orders, round
+      trips and winning trips, the worst instrument drawdown and the per
+      instrument results, best pnl first.
+    """
+    if trade_side not in TRADE_SIDES:
+        raise ValueError(f"Unknown trade side: {trade_side}")
+    timeframes = [int(timeframe) for timeframe in timeframes]
+    percentages = [float(percentage) for percentage in percentages]
+    thresholds = [float(threshold) for threshold in thresholds]
+
+    per_instrument = {}
+    if processes == 1:
+        for path in candle_files:
+            per_instrument[path] = sweep_instrument(path, timeframes, percentages, thresholds, trade_side, cache)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {path: pool.submit(sweep_instrument, path, timeframes, percentages, thresholds, trade_side, cache)
+                       for path in candle_files}
+            for path, future in futures.items():
+                try:
+                    per_instrument[path] = future.result()
+                except Exception as error:
+                    logging.error(f"Sweep of {path} failed: {error}")
+
+    summary = {}
+    for path, results in per_instrument.items():
+        for key, metrics in results:
+            entry = summary.get(key)
+            if entry is None:
+                entry = summary[key] = dict(ParameterSet(*key).to_dict(), pnl=0.0, max_drawdown=0.0, orders=0,
+                                            round_trips=0, winning_trips=0, instruments={})
+            entry['pnl'] += metrics['pnl']
+            entry['max_drawdown'] = max(entry['max_drawdown'], metrics['max_drawdown'])
+            for name in ('orders', 'round_trips', 'winning_trips'):
+                entry[name] += metrics[name]
+            entry['instruments'][os.path.basename(path)] = metrics
+    return sorted(summary.values(), key=lambda entry: entry['pnl'], reverse=True)
@@ -1,3 +1,1533 @@
-from django.test import TestCase
+import os
+import csv
+import gzip
+import json
+import time
+import datetime
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import get_channel_layer
+from django.test import TestCase, override_settings
+import numpy as np
+from pymongo.errors import DuplicateKeyError
+from . import broadcast, candle_query, candle_time, consumers, latency, log_channels, repository, sweep, views
+from .backtest import SimulatedBroker, SimulatedClock, close_journals, read_tick_batches, run_backtest, sandbox
+from .benchmark import FEED_START, LatencySamples, compare, make_instruments, run_benchmarks, synthetic_batches
+from .broadcast import LiveBroadcaster
+from .broker import EXIT, POLL, RATE_LIMITS, BrokerClient, TokenBucket, split_rate_limits
+from .candle_buffer import Candle, CandleHistory
+from .candle_scheduler import TimingWheel, CandleCloseScheduler
+from .candle_store import CandleJournal, load_candles
+from .engine import ShardedEngine, build_layout
+from .instrument_master import InstrumentMaster, snapshot_days
+from .instrument_table import compile_instrument_table
+from .order_book import OrderBook
+from .order_executor import SUBMITTED
+from .pnl import PositionPnL, SharedGroupPnL, ThresholdGroupPnL
+from .run_script import CandleAggregator, WebSocketHandler
+from .tick_recorder import TickRecorder, day_segments, iter_day, open_segment
+from .tick_queue import BLOCK, CONFLATE, DROP_OLDEST, ShardedTickQueue, TickShard
 
-# Create your tests here.
+
+def setUpModule():
+    # Channel files of anything that sets up logging go to a temporary directory, never the project's
+    directory = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(directory.cleanup)
+    patcher = mock.patch.object(log_channels, 'LOG_DIR', directory.name)
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
+
+def make_candle(start_time, close, final_save=False, volume=10):
+    """ A candle starting at start_time ('YYYY-MM-DD HH:MM:SS') around close. """
+    return Candle(candle_time.parse_start_time(start_time), close - 1, close + 2, close - 2, close, volume,
+                  close + 50, close - 50, final_save)
+
+
+def make_order(order_id, transaction_type, quantity, status='COMPLETE', filled_quantity=None, price=100.0,
+               timestamp='2024-01-01 09:20:00', tradingsymbol='NIFTY24JANFUT'):
+    """ An order in the shape of Kite order updates. """
+    if filled_quantity is None:
+        filled_quantity = quantity if status == 'COMPLETE' else 0
+    return {
+        'order_id': order_id,
+        'tradingsymbol': tradingsymbol,
+        'transaction_type': transaction_type,
+        'quantity': quantity,
+        'filled_quantity': filled_quantity,
+        'average_price': price,
+        'status': status,
+        'order_timestamp': timestamp,
+    }
+
+
+def rescan_profit_loss_per_share(sorted_orders, current_price):
+    """ Total P&L per share by rescanning every fill, as calculate_total_profit_loss_per_share did before PositionPnL. """
+    realized = 0
+    open_position, open_price, open_quantity, order_type = False, None, 0, None
+    for order in sorted_orders:
+        price, quantity = order['average_price'], order['quantity']
+        side = 'Buy' if order['transaction_type'] == 'BUY' else 'Sell'
+        if not open_position:
+            open_position, open_price, open_quantity, order_type = True, price, quantity, side
+        elif order_type != side and quantity <= open_quantity:
+            realized += (price - open_price) if order_type == 'Buy' else (open_price - price)
+            if quantity == open_quantity:
+                open_position, open_price, open_quantity, order_type = False, None, 0, None
+            else:
+                open_quantity -= quantity
+    unrealized = 0
+    if open_position:
+        unrealized = (current_price - open_price) if order_type == 'Buy' else (open_price - current_price)
+    return realized + unrealized
+
+
+def enter_sandbox(test_case):
+    """ Run the rest of a test in a temporary working directory, left again on cleanup. """
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    sandbox_context = sandbox(directory.name, quiet=True)
+    sandbox_context.__enter__()
+    test_case.addCleanup(sandbox_context.__exit__, None, None, None)
+    return directory.name
+
+
+def make_handler(test_case, broker, instruments, **options):
+    """ A WebSocketHandler processing ticks inline, its journals closed on cleanup. """
+    options = dict({'tick_queue_shards': 0, 'order_executor_workers': 0, 'candle_close_timer': False,
+                    'clock': broker.clock, 'tick_recorder': False, 'live_broadcast': False}, **options)
+    handler = WebSocketHandler(broker, instruments, **options)
+    test_case.addCleanup(close_journals, handler)
+    return handler
+
+
+class InstrumentTableTests(TestCase):
+
+    def test_configurations_are_parsed_once_with_their_group_and_session(self):
+        instruments = make_instruments(2, exit_trades_threshold_points=50)
+        instruments.append(dict(make_instruments(1, timeframe=5, exit_trades_threshold_points=80)[0],
+                                instrument_token='200000', instrument_details={'tradingsymbol': 'CRUDE', 'exchange': 'MCX'}))
+        instruments.append(dict(make_instruments(1)[0], instrument_token='300000', lot_size='one'))
+        # The shape restructure_for_combined_threshold returns
+        grouped = {'50': [{'tradingsymbol': 'BENCH0'}, {'tradingsymbol': 'BENCH1'}], '80': [{'tradingsymbol': 'CRUDE'}]}
+        with self.assertLogs(level='ERROR'):
+            table = compile_instrument_table(instruments, grouped)
+
+        self.assertEqual(sorted(table), [100000, 100001, 200000])
+        runtime = table[100001]
+        self.assertEqual((runtime.tradingsymbol, runtime.lot_size, runtime.percentage, runtime.timeframe),
+                         ('BENCH1', 1, 0.1, 1))
+        self.assertEqual(runtime.group_key, '50')
+        self.assertEqual(runtime.group_symbols, frozenset({'BENCH0', 'BENCH1'}))
+        self.assertEqual(table[200000].group_symbols, frozenset({'CRUDE'}))
+        # NFO trades 09:15 to 15:00, MCX 09:00 to 23:00
+        self.assertFalse(runtime.in_session(9 * 60 + 14))
+        self.assertTrue(runtime.in_session(9 * 60 + 15))
+        self.assertFalse(runtime.in_session(15 * 60))
+        self.assertTrue(table[200000].in_session(22 * 60 + 59))
+
+    def test_a_reload_keeps_aggregators_unless_the_timeframe_changed(self):
+        enter_sandbox(self)
+        broker = SimulatedBroker(SimulatedClock(FEED_START))
+        handler = make_handler(self, broker, make_instruments(2))
+        first, second = handler.candle_aggregators['100000'], handler.candle_aggregators['100001']
+        instruments = make_instruments(2)
+        instruments[1]['timeframe'] = '5'
+        instruments[0]['trade_side'] = 'BUY'
+        handler.reload_config(instruments)
+        self.assertIs(handler.candle_aggregators['100000'], first)
+        self.assertEqual(first.trade_side, 'BUY')
+        self.assertIsNot(handler.candle_aggregators['100001'], second)
+        self.assertEqual(handler.instrument_table[100001].aggregator.interval_minutes, 5)
+        self.assertIs(handler.instrument_table[100000].aggregator, first)
+
+
+class CandleJournalTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, '256265_1_minute_candles.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_lines(self):
+        with open(self.file_path, 'r') as file:
+            return file.read().splitlines()
+
+    def test_updates_of_the_forming_candle_overwrite_the_tail_record(self):
+        journal = CandleJournal(self.file_path)
+        journal.save(make_candle('2024-01-01 09:15:00', 100, final_save=True))
+        journal.save(make_candle('2024-01-01 09:16:00', 101))
+        journal.save(make_candle('2024-01-01 09:16:00', 103))
+        journal.save(make_candle('2024-01-01 09:16:00', 102.5))
+
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])['close'], 100)
+        self.assertEqual(json.loads(lines[1])['close'], 102.5)
+        self.assertEqual([candle['start_time'] for candle in load_candles(self.file_path)],
+                         ['2024-01-01 09:15:00', '2024-01-01 09:16:00'])
+        journal.close()
+
+    def test_a_rewritten_older_candle_wins_and_is_compacted_on_close(self):
+        journal = CandleJournal(self.file_path)
+        journal.save(make_candle('2024-01-01 09:15:00', 100, final_save=True))
+        journal.save(make_candle('2024-01-01 09:16:00', 101))
+        journal.save(make_candle('2024-01-01 09:15:00', 99, final_save=True))
+
+        self.assertEqual(len(self.read_lines()), 3)
+        self.assertEqual([candle['close'] for candle in load_candles(self.file_path)], [99, 101])
+        journal.close()
+        self.assertEqual(len(self.read_lines()), 2)
+        self.assertEqual([candle['close'] for candle in load_candles(self.file_path)], [99, 101])
+
+    def test_a_torn_last_line_is_skipped(self):
+        journal = CandleJournal(self.file_path)
+        journal.save(make_candle('2024-01-01 09:15:00', 100, final_save=True))
+        journal.save(make_candle('2024-01-01 09:16:00', 101))
+        journal.close()
+        with open(self.file_path, 'a') as file:
+            file.write('{"start_time":"2024-01-01 09:17:00","open":10')
+
+        with self.assertLogs(level='WARNING'):
+            candles = load_candles(self.file_path)
+        self.assertEqual([candle['start_time'] for candle in candles], ['2024-01-01 09:15:00', '2024-01-01 09:16:00'])
+
+    def test_the_legacy_json_list_loads_and_is_rewritten_as_a_journal(self):
+        legacy = [make_candle('2024-01-01 09:15:00', 100, final_save=True).to_dict(),
+                  make_candle('2024-01-01 09:16:00', 101).to_dict(),
+                  make_candle('2024-01-01 09:16:00', 104).to_dict()]
+        with open(self.file_path, 'w') as file:
+            json.dump(legacy, file, indent=4)
+
+        candles = load_candles(self.file_path)
+        self.assertEqual([(candle['start_time'], candle['close']) for candle in candles],
+                         [('2024-01-01 09:15:00', 100), ('2024-01-01 09:16:00', 104)])
+
+        journal = CandleJournal(self.file_path)
+        self.assertEqual(journal.load(), candles)
+        self.assertEqual(len(self.read_lines()), 2)
+        # The forming candle of the legacy file is the journal's tail record
+        journal.save(make_candle('2024-01-01 09:16:00', 105))
+        self.assertEqual(len(self.read_lines()), 2)
+        self.assertEqual(load_candles(self.file_path)[-1]['close'], 105)
+        journal.close()
+
+
+class OrderBookTests(TestCase):
+
+    def setUp(self):
+        self.order_book = OrderBook(kite=None)
+
+    def test_net_quantity_never_steps_back_from_a_completed_fill(self):
+        order_book = self.order_book
+        order_book.on_order_update(None, make_order('1', 'BUY', 10, status='OPEN', filled_quantity=0))
+        self.assertEqual(order_book.net_quantity('NIFTY24JANFUT'), 0)
+        order_book.on_order_update(None, make_order('1', 'BUY', 10))
+        self.assertEqual(order_book.net_quantity('NIFTY24JANFUT'), 10)
+        # A partial fill update delivered after the completion is ignored
+        order_book.on_order_update(None, make_order('1', 'BUY', 10, status='OPEN', filled_quantity=4))
+        self.assertEqual(order_book.net_quantity('NIFTY24JANFUT'), 10)
+        self.assertEqual(order_book.order_status('1'), 'COMPLETE')
+
+        order_book.on_order_update(None, make_order('2', 'SELL', 10, status='OPEN', filled_quantity=6))
+        self.assertEqual(order_book.net_quantity('NIFTY24JANFUT'), 4)
+        order_book.on_order_update(None, make_order('2', 'SELL', 10))
+        order_book.on_order_update(None, make_order('2', 'SELL', 10, status='OPEN', filled_quantity=8))
+        self.assertEqual(order_book.net_quantity('NIFTY24JANFUT'), 0)
+
+    def test_rejected_and_other_symbols_do_not_count(self):
+        order_book = self.order_book
+        order_book.apply(make_order('1', 'SELL', 5))
+        order_book.apply(make_order('2', 'SELL', 5, status='REJECTED'))
+        order_book.apply(make_order('3', 'BUY', 7, tradingsymbol='BANKNIFTY24JANFUT'))
+        self.assertEqual(order_book.net_quantity('NIFTY24JANFUT'), -5)
+        self.assertEqual(order_book.net_quantity('BANKNIFTY24JANFUT'), 7)
+
+    def test_a_fill_arriving_before_earlier_ones_asks_consumers_to_replay(self):
+        order_book = self.order_book
+        order_book.apply(make_order('1', 'BUY', 10, price=100.0, timestamp='2024-01-01 09:20:00'))
+        generation, rebuild, orders = order_book.completed_orders_since('NIFTY24JANFUT', None, 0)
+        self.assertTrue(rebuild)
+        generation, rebuild, orders = order_book.completed_orders_since('NIFTY24JANFUT', generation, 0)
+        self.assertFalse(rebuild)
+        self.assertEqual([order['order_id'] for order in orders], ['1'])
+
+        order_book.apply(make_order('2', 'SELL', 10, price=104.0, timestamp='2024-01-01 09:25:00'))
+        _, rebuild, orders = order_book.completed_orders_since('NIFTY24JANFUT', generation, 1)
+        self.assertFalse(rebuild)
+        self.assertEqual([order['order_id'] for order in orders], ['2'])
+
+        # Delivered late, but filled before both
+        order_book.apply(make_order('0', 'SELL', 10, price=98.0, timestamp='2024-01-01 09:15:00'))
+        _, rebuild, orders = order_book.completed_orders_since('NIFTY24JANFUT', generation, 2)
+        self.assertTrue(rebuild)
+        self.assertEqual([order['order_id'] for order in orders], ['0', '1', '2'])
+        self.assertEqual([order['order_id'] for order in order_book.completed_orders('NIFTY24JANFUT')], ['0', '1', '2'])
+
+
+class PositionPnLTests(TestCase):
+    # Entry, partial exits, a stop-loss reversal (square off then the opposite entry),
+    # an oversized opposite fill that the rules ignore, and a same side add that is ignored too
+    FILLS = [
+        ('BUY', 10, 100.0),
+        ('SELL', 4, 103.5),
+        ('SELL', 3, 101.0),
+        ('SELL', 3, 99.25),
+        ('SELL', 10, 99.0),
+        ('BUY', 25, 97.0),
+        ('SELL', 5, 98.0),
+        ('BUY', 10, 96.5),
+        ('BUY', 5, 95.0),
+        ('SELL', 5, 95.5),
+        ('BUY', 5, 96.0),
+    ]
+
+    def orders(self):
+        return [make_order(str(index), side, quantity, price=price, timestamp=f'2024-01-01 09:{20 + index}:00')
+                for index, (side, quantity, price) in enumerate(self.FILLS)]
+
+    def test_incremental_fills_match_a_full_rescan_after_every_fill(self):
+        orders = self.orders()
+        position_pnl = PositionPnL('NIFTY24JANFUT')
+        for count, order in enumerate(orders, 1):
+            position_pnl.apply_fill(order)
+            for current_price in (90.0, order['average_price'], 110.0):
+                self.assertAlmostEqual(position_pnl.total_profit_loss_per_share(current_price),
+                                       rescan_profit_loss_per_share(orders[:count], current_price))
+
+    def test_sync_from_the_order_book_replays_after_a_late_fill(self):
+        orders = self.orders()
+        order_book = OrderBook(kite=None)
+        position_pnl = PositionPnL('NIFTY24JANFUT')
+        # The third fill is delivered last
+        delivered = orders[:2] + orders[3:] + orders[2:3]
+        for count, order in enumerate(delivered, 1):
+            order_book.apply(order)
+            position_pnl.sync(order_book)
+            expected_orders = sorted(delivered[:count], key=lambda order: order['order_timestamp'])
+            self.assertAlmostEqual(position_pnl.total_profit_loss_per_share(100.0),
+                                   rescan_profit_loss_per_share(expected_orders, 100.0))
+        self.assertEqual(position_pnl.applied_fills, len(orders))
+
+
+class ThresholdGroupPnLTests(TestCase):
+    GROUPS = {
+        '30': [{'tradingsymbol': 'NIFTY24JANFUT', 'lot_size': '50'}, {'tradingsymbol': 'BANKNIFTY24JANFUT', 'lot_size': '15'}],
+        '80': [{'tradingsymbol': 'RELIANCE', 'lot_size': '1'}],
+    }
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.directory.name, 'current_profit_loss.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_group_totals_follow_every_update(self):
+        group_pnl = ThresholdGroupPnL(self.GROUPS, snapshot_path=self.snapshot_path)
+        self.assertEqual(group_pnl.group_total('30'), 0)
+        group_pnl.update_many({'NIFTY24JANFUT': 12.5, 'RELIANCE': -4.0})
+        group_pnl.update('BANKNIFTY24JANFUT', 3.0)
+        group_pnl.update('NIFTY24JANFUT', 10.0)
+        self.assertEqual(group_pnl.group_total('30'), 13.0)
+        self.assertEqual(group_pnl.group_total('80'), -4.0)
+        self.assertEqual(group_pnl.total(['RELIANCE', 'NIFTY24JANFUT', 'UNKNOWN']), 6.0)
+        with self.assertRaises(KeyError):
+            group_pnl.group_total('1000000000')
+
+    def test_regrouping_keeps_the_values(self):
+        group_pnl = ThresholdGroupPnL(self.GROUPS, snapshot_path=self.snapshot_path)
+        group_pnl.update_many({'NIFTY24JANFUT': 12.5, 'BANKNIFTY24JANFUT': 3.0, 'RELIANCE': -4.0})
+        group_pnl.set_groups({'30': self.GROUPS['30'][:1], '80': self.GROUPS['30'][1:] + self.GROUPS['80']})
+        self.assertEqual(group_pnl.group_total('30'), 12.5)
+        self.assertEqual(group_pnl.group_total('80'), -1.0)
+
+    def test_the_snapshot_round_trips(self):
+        group_pnl = ThresholdGroupPnL(self.GROUPS, snapshot_path=self.snapshot_path)
+        group_pnl.update_many({'NIFTY24JANFUT': 12.5, 'RELIANCE': -4.0})
+        self.assertTrue(group_pnl.write_snapshot())
+
+        restored = ThresholdGroupPnL(self.GROUPS, snapshot_path=self.snapshot_path)
+        restored.load_snapshot()
+        self.assertEqual(restored.snapshot(), {'NIFTY24JANFUT': 12.5, 'RELIANCE': -4.0})
+        self.assertEqual(restored.group_total('30'), 12.5)
+
+
+class CandleClockTests(TestCase):
+
+    def test_naive_and_aware_times_map_to_the_same_ist_epoch(self):
+        naive = datetime.datetime(2024, 1, 1, 9, 15, 42, 500000)
+        aware = datetime.datetime(2024, 1, 1, 3, 45, 42, tzinfo=datetime.timezone.utc)
+        self.assertEqual(candle_time.to_epoch(naive), candle_time.to_epoch(aware))
+        epoch = candle_time.to_epoch(naive)
+        self.assertEqual(candle_time.format_epoch(candle_time.bucket_start(epoch)), '2024-01-01 09:15:00')
+        self.assertEqual(candle_time.format_epoch(candle_time.bucket_start(epoch, 5 * 60)), '2024-01-01 09:15:00')
+        self.assertEqual(candle_time.minute_of_day(epoch), 9 * 60 + 15)
+        self.assertEqual(candle_time.parse_start_time('2024-01-01 09:15:42'), epoch)
+        self.assertEqual(candle_time.from_epoch(epoch), naive.replace(microsecond=0))
+
+    def feed(self, candle_clock):
+        """ Two ticks of instrument 100000, the 09:15:58 trade arrives after the minute turned. Returns its current candle. """
+        # Each clock writes its own journal
+        enter_sandbox(self)
+        broker = SimulatedBroker(SimulatedClock(FEED_START))
+        handler = make_handler(self, broker, make_instruments(1), candle_clock=candle_clock)
+        for arrival, exchange_timestamp, price in (((9, 15, 30), (9, 15, 29), 100.0), ((9, 16, 1), (9, 15, 58), 101.0)):
+            broker.clock.set(datetime.datetime(2024, 1, 1, *arrival))
+            handler.on_ticks(None, [{'instrument_token': 100000, 'last_price': price, 'last_traded_quantity': 1,
+                                     'ohlc': {'high': 120.0, 'low': 90.0},
+                                     'exchange_timestamp': datetime.datetime(2024, 1, 1, *exchange_timestamp)}])
+        return handler.candle_aggregators['100000'].current_candle
+
+    def test_the_exchange_clock_buckets_ticks_by_their_exchange_timestamp(self):
+        # The local clock closes the 09:15 candle with the late trade, the exchange clock keeps it forming
+        self.assertTrue(self.feed(candle_time.LOCAL_CLOCK).final_save)
+        exchange = self.feed(candle_time.EXCHANGE_CLOCK)
+        self.assertFalse(exchange.final_save)
+        self.assertEqual((exchange.start_time, exchange.close, exchange.volume), ('2024-01-01 09:15:00', 101.0, 2))
+
+
+class TickConflationTests(TestCase):
+
+    def test_only_the_latest_changed_tick_of_a_batch_is_evaluated(self):
+        enter_sandbox(self)
+        broker = SimulatedBroker(SimulatedClock(FEED_START))
+        handler = make_handler(self, broker, make_instruments(2), tick_conflation=True)
+
+        def tick(instrument_token, price):
+            return {'instrument_token': instrument_token, 'last_price': price, 'last_traded_quantity': 1,
+                    'ohlc': {'high': 1200.0, 'low': 900.0}}
+
+        handler.on_ticks(None, [tick(100000, 1000.0), tick(100001, 1010.0), tick(100000, 1002.0), tick(100000, 1001.0)])
+        # Every tick builds the candle
+        candle = handler.candle_aggregators['100000'].current_candle
+        self.assertEqual((candle.high, candle.close, candle.volume), (1002.0, 1001.0, 3))
+        handler.on_ticks(None, [tick(100000, 1001.0)])
+        handler.on_ticks(None, [tick(100000, 1003.0)])
+        self.assertEqual(handler.conflation_metrics(), {
+            'BENCH0': {'evaluations': 2, 'skipped_superseded': 2, 'skipped_unchanged': 1},
+            'BENCH1': {'evaluations': 1, 'skipped_superseded': 0, 'skipped_unchanged': 0},
+        })
+
+
+class TimingWheelTests(TestCase):
+
+    def test_timers_fire_on_their_deadline_in_deadline_order(self):
+        wheel = TimingWheel(slots=60)
+        wheel.advance(1000)
+        wheel.schedule(1005, 'a')
+        wheel.schedule(1003, 'b')
+        # Same slot, one rotation later
+        wheel.schedule(1065, 'c')
+        self.assertEqual(wheel.advance(1002), [])
+        self.assertEqual(wheel.advance(1005), [(1003, 'b'), (1005, 'a')])
+        self.assertEqual(wheel.pending, 1)
+        self.assertEqual(wheel.advance(1064), [])
+        self.assertEqual(wheel.advance(1065), [(1065, 'c')])
+        self.assertEqual(wheel.pending, 0)
+
+    def test_overdue_timers_and_clock_jumps_fire_on_the_next_advance(self):
+        wheel = TimingWheel(slots=60)
+        wheel.advance(1000)
+        wheel.schedule(990, 'late')
+        self.assertEqual(wheel.advance(1000), [(990, 'late')])
+        wheel.schedule(1010, 'a')
+        wheel.schedule(1200, 'b')
+        self.assertEqual(wheel.advance(5000), [(1010, 'a'), (1200, 'b')])
+
+    def test_a_candle_closes_on_its_boundary_without_a_tick(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with sandbox(directory.name, quiet=True):
+            aggregator = CandleAggregator(256265, 'NIFTY 50', interval_minutes=1)
+            try:
+                closed = []
+                scheduler = CandleCloseScheduler(lambda instrument_token, boundary: closed.append(aggregator.close_candle(boundary)),
+                                                 clock=candle_time.EXCHANGE_CLOCK)
+                for second, price in ((10, 100.0), (40, 101.5)):
+                    aggregator.process_tick({
+                        'last_price': price,
+                        'last_traded_quantity': 5,
+                        'ohlc': {'high': 120.0, 'low': 90.0},
+                        'current_datetime': datetime.datetime(2024, 1, 1, 9, 15, second, tzinfo=candle_time.IST),
+                    })
+                boundary = candle_time.parse_start_time('2024-01-01 09:16:00')
+                scheduler.schedule(256265, boundary)
+
+                scheduler.advance(boundary - 1)
+                self.assertEqual(closed, [])
+                scheduler.advance(boundary)
+                self.assertEqual(len(closed), 1)
+                self.assertTrue(closed[0].final_save)
+                self.assertEqual((closed[0].open, closed[0].close), (100.0, 101.5))
+                # The next candle opens at the last price and is the forming one in the history
+                self.assertEqual(aggregator.current_candle.start, boundary)
+                self.assertEqual(aggregator.current_candle.open, 101.5)
+                self.assertEqual(len(aggregator.candles), 2)
+                self.assertTrue(aggregator.candles[-2].final_save)
+                self.assertEqual(aggregator.candles[-1].start, boundary)
+                self.assertEqual(scheduler.fired, 1)
+            finally:
+                # The journal path is relative to the sandbox, release it before leaving
+                aggregator.candle_journal.close()
+
+    def test_an_interval_without_ticks_is_saved_as_a_flat_candle(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with sandbox(directory.name, quiet=True):
+            aggregator = CandleAggregator(256265, 'NIFTY 50', interval_minutes=1)
+            try:
+                aggregator.process_tick({
+                    'last_price': 101.5,
+                    'last_traded_quantity': 5,
+                    'ohlc': {'high': 120.0, 'low': 90.0},
+                    'current_datetime': datetime.datetime(2024, 1, 1, 9, 15, 10, tzinfo=candle_time.IST),
+                })
+                first = candle_time.parse_start_time('2024-01-01 09:16:00')
+                aggregator.close_candle(first)
+                # No tick from 09:16 to 09:17, the carried candle closes flat at the last price
+                flat = aggregator.close_candle(first + 60)
+                self.assertEqual(flat.start, first)
+                self.assertEqual((flat.open, flat.high, flat.low, flat.close, flat.volume), (101.5, 101.5, 101.5, 101.5, 0))
+                self.assertTrue(flat.final_save)
+                self.assertEqual([candle.start for candle in aggregator.candles], [first - 60, first, first + 60])
+                self.assertEqual(aggregator.candles[-2].volume, 0)
+
+                # A tick in the forming candle folds into the carried open
+                aggregator.process_tick({
+                    'last_price': 103.0,
+                    'last_traded_quantity': 2,
+                    'ohlc': {'high': 120.0, 'low': 90.0},
+                    'current_datetime': datetime.datetime(2024, 1, 1, 9, 17, 20, tzinfo=candle_time.IST),
+                })
+                forming = aggregator.current_candle
+                self.assertEqual((forming.open, forming.high, forming.close, forming.volume), (101.5, 103.0, 103.0, 2))
+
+                # Without carry forward nothing opens until the next tick
+                aggregator.close_candle(first + 120, carry_forward=False)
+                self.assertEqual(aggregator.current_candle.start, first + 60)
+                self.assertTrue(aggregator.current_candle.final_save)
+                self.assertIsNone(aggregator.close_candle(first + 180))
+            finally:
+                aggregator.candle_journal.close()
+
+
+class CandleHistoryTests(TestCase):
+    MINUTES = ['2024-01-01 09:15:00', '2024-01-01 09:16:00', '2024-01-01 09:17:00', '2024-01-01 09:18:00',
+               '2024-01-01 09:19:00']
+
+    def test_the_ring_wraps_around_and_keeps_the_latest_candles(self):
+        history = CandleHistory(depth=3)
+        for index, start_time in enumerate(self.MINUTES):
+            history.save(make_candle(start_time, 100 + index, final_save=True))
+
+        self.assertEqual(len(history), 5)
+        self.assertEqual(history.retained(), 3)
+        self.assertEqual([candle.close for candle in history], [102, 103, 104])
+        self.assertEqual(history[-1].start_time, '2024-01-01 09:19:00')
+        self.assertEqual(history[-3].close, 102)
+        # Positive positions count from the first candle ever saved, like list indexes did
+        self.assertEqual(history[2].close, 102)
+        with self.assertRaises(IndexError):
+            history[-4]
+        with self.assertRaises(IndexError):
+            history[1]
+
+    def test_version_changes_only_when_a_closed_candle_changes(self):
+        history = CandleHistory(depth=3)
+        history.save(make_candle(self.MINUTES[0], 100, final_save=True))
+        history.save(make_candle(self.MINUTES[1], 101))
+        version = history.version
+        # Updates of the forming candle keep the cached levels valid
+        history.save(make_candle(self.MINUTES[1], 102))
+        self.assertEqual(history.version, version)
+        self.assertEqual(history[-1].close, 102)
+        history.save(make_candle(self.MINUTES[0], 99, final_save=True))
+        self.assertEqual(history.version, version + 1)
+        self.assertEqual(history[-2].close, 99)
+        history.save(make_candle(self.MINUTES[2], 103))
+        self.assertEqual(history.version, version + 2)
+
+    def test_revisions_report_changed_candles_and_dropped_ones(self):
+        history = CandleHistory(depth=3)
+        history.save(make_candle(self.MINUTES[0], 100, final_save=True))
+        history.save(make_candle(self.MINUTES[1], 101))
+        revision, candles = history.changed_since(0)
+        self.assertEqual((revision, [candle.close for candle in candles]), (2, [100, 101]))
+
+        history.save(make_candle(self.MINUTES[1], 102, final_save=True))
+        history.save(make_candle(self.MINUTES[2], 103))
+        revision, candles = history.changed_since(revision)
+        self.assertEqual((revision, [candle.close for candle in candles]), (4, [102, 103]))
+        self.assertEqual(history.dropped, 0)
+
+        # The first candle falls off, last written at revision 1
+        history.save(make_candle(self.MINUTES[3], 104))
+        self.assertEqual(history.dropped, 1)
+        # The second one was rewritten at revision 3, which is what falls off with it
+        history.save(make_candle(self.MINUTES[4], 105))
+        self.assertEqual(history.dropped, 3)
+        # A candle that is no longer retained is not written back
+        history.save(make_candle(self.MINUTES[0], 90, final_save=True))
+        self.assertEqual(history.revision, 6)
+        revision, candles = history.changed_since(4)
+        self.assertEqual((revision, [candle.close for candle in candles]), (6, [104, 105]))
+
+
+class BreakoutLevelsTests(TestCase):
+    MINUTES = CandleHistoryTests.MINUTES
+
+    def setUp(self):
+        enter_sandbox(self)
+        self.aggregator = CandleAggregator(256265, 'NIFTY 50', interval_minutes=1)
+        self.addCleanup(self.aggregator.candle_journal.close)
+
+    def save(self, index, close, final_save=True):
+        self.aggregator.candles.save(make_candle(self.MINUTES[index], close, final_save=final_save))
+
+    def test_levels_are_computed_once_per_candle_close(self):
+        self.save(0, 100)
+        self.save(1, 105, final_save=False)
+        self.assertFalse(self.aggregator.update_levels(1))
+        self.save(1, 105)
+        self.save(2, 110, final_save=False)
+        self.assertTrue(self.aggregator.update_levels(1))
+        # Highs 102 and 107, lows 98 and 103 of the two candles before the forming one
+        self.assertEqual((self.aggregator.x_value_higher, self.aggregator.x_value_lower), (109, 97))
+
+        # Updates of the forming candle keep the cached levels
+        self.save(2, 130, final_save=False)
+        with mock.patch.object(self.aggregator.candles, 'slot', side_effect=AssertionError("levels recomputed")):
+            self.assertTrue(self.aggregator.update_levels(1))
+
+        self.save(2, 110)
+        self.save(3, 111, final_save=False)
+        self.aggregator.update_levels(1)
+        self.assertEqual((self.aggregator.x_value_higher, self.aggregator.x_value_lower), (114, 101))
+        # A new percentage recomputes them on the same candles
+        self.aggregator.update_levels(2)
+        self.assertEqual((self.aggregator.x_value_higher, self.aggregator.x_value_lower), (115, 100))
+
+    def test_the_stop_loss_trails_the_cached_level_of_the_open_side(self):
+        for index, close in enumerate((100, 105)):
+            self.save(index, close)
+        self.save(2, 110, final_save=False)
+        self.aggregator.current_order_type = 'Buy'
+        self.aggregator.update_trailing_stop_loss(None, 1, 'NIFTY 50')
+        self.assertEqual(self.aggregator.current_stop_loss, 97)
+        self.aggregator.current_order_type = 'Sell'
+        self.aggregator.update_trailing_stop_loss(None, 1, 'NIFTY 50')
+        self.assertEqual(self.aggregator.current_stop_loss, 109)
+        self.aggregator.current_order_type = None
+        self.aggregator.update_trailing_stop_loss(None, 1, 'NIFTY 50')
+        self.assertEqual(self.aggregator.current_stop_loss, 109)
+
+
+class CandleQueryTests(TestCase):
+    URL = '/algotraderapp/fetch_candle_data'
+    MINUTES = CandleHistoryTests.MINUTES
+
+    def setUp(self):
+        # Journals are looked up relative to the working directory
+        enter_sandbox(self)
+        self.history = CandleHistory(depth=3)
+        handler = mock.Mock(spec=['candle_history'])
+        handler.candle_history.side_effect = lambda instrument_token, timeframe: self.history if instrument_token == '256265' else None
+        patcher = mock.patch.object(views, 'ws_handler', handler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def save(self, index, close, final_save=True):
+        self.history.save(make_candle(self.MINUTES[index], close, final_save=final_save))
+
+    def fetch(self, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(self.URL, dict({'instrumentToken': '256265', 'timeframe': '1'}, **params), **headers)
+
+    def test_since_returns_only_candles_changed_after_the_revision(self):
+        self.save(0, 100)
+        self.save(1, 101, final_save=False)
+        body = self.fetch().json()
+        self.assertEqual((body['source'], body['incremental']), ('memory', False))
+        self.assertEqual([candle['close'] for candle in body['candle_data']], [100, 101])
+
+        unchanged = self.fetch(since=body['revision']).json()
+        self.assertEqual((unchanged['incremental'], unchanged['candle_data']), (True, []))
+        self.assertEqual(unchanged['revision'], body['revision'])
+
+        self.save(1, 102)
+        self.save(2, 103, final_save=False)
+        changed = self.fetch(since=body['revision']).json()
+        self.assertTrue(changed['incremental'])
+        self.assertEqual([(candle['start_time'], candle['close']) for candle in changed['candle_data']],
+                         [(self.MINUTES[1], 102), (self.MINUTES[2], 103)])
+
+    def test_since_from_another_generation_gets_everything(self):
+        self.save(0, 100)
+        self.save(1, 101)
+        body = self.fetch(since='0123abcd-2').json()
+        self.assertFalse(body['incremental'])
+        self.assertEqual(len(body['candle_data']), 2)
+
+    def test_limit_keeps_the_last_candles(self):
+        for index in range(3):
+            self.save(index, 100 + index)
+        body = self.fetch(limit='2').json()
+        self.assertEqual([candle['close'] for candle in body['candle_data']], [101, 102])
+
+    def test_candles_that_fell_off_the_ring_come_from_the_journal(self):
+        journal = CandleJournal(candle_query.journal_path('256265', '1'))
+        for index in range(5):
+            candle = make_candle(self.MINUTES[index], 100 + index, final_save=True)
+            journal.save(candle)
+            self.history.save(candle)
+        journal.close()
+        body = self.fetch(since=f'{self.history.generation}-1').json()
+        self.assertEqual((body['source'], body['incremental']), ('journal', False))
+        self.assertEqual([candle['close'] for candle in body['candle_data']], [100, 101, 102, 103, 104])
+
+    def test_an_unchanged_response_is_answered_with_304(self):
+        self.save(0, 100)
+        response = self.fetch(limit='5')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"candles-'))
+
+        not_modified = self.fetch(etag=etag, limit='5')
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+        # The ETag covers the query
+        self.assertEqual(self.fetch(etag=etag, limit='4').status_code, 200)
+
+        self.save(0, 101)
+        changed = self.fetch(etag=etag, limit='5')
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_journal_answers_are_the_same_with_either_encoder(self):
+        journal = CandleJournal(candle_query.journal_path('260105', '1'))
+        for index in range(2):
+            journal.save(make_candle(self.MINUTES[index], 100.05 + index, final_save=True))
+        journal.close()
+        with mock.patch.object(candle_query, 'orjson', None):
+            fallback = self.fetch(instrumentToken='260105').content
+        body = json.loads(fallback)
+        self.assertEqual(body['source'], 'journal')
+        self.assertEqual(body['candle_data'], load_candles(candle_query.journal_path('260105', '1')))
+        if candle_query.orjson is not None:
+            self.assertEqual(self.fetch(instrumentToken='260105').content, fallback)
+
+    def test_invalid_parameters_are_rejected(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.fetch(since='not-a-revision').status_code, 400)
+            self.assertEqual(self.fetch(limit='0').status_code, 400)
+            self.assertEqual(self.client.get(self.URL, {'timeframe': '1'}).status_code, 400)
+
+
+class OrderExecutorTests(TestCase):
+
+    def setUp(self):
+        enter_sandbox(self)
+        self.broker = SimulatedBroker(SimulatedClock(FEED_START))
+        self.handler = make_handler(self, self.broker, make_instruments(1), synchronous_orders=True)
+        self.aggregator = self.handler.candle_aggregators['100000']
+
+    def place(self, order_type='Buy'):
+        return self.aggregator.place_single_order(self.broker, 100000, 'BENCH0', 'NFO', 10 ** 9, order_type, 1, 990.0,
+                                                  1000.0, order_mode="Normal Order")
+
+    def test_a_submitted_order_returns_the_marker_and_stays_active_once_accepted(self):
+        self.broker.set_price('BENCH0', 1000.0)
+        self.assertEqual(self.place(), SUBMITTED)
+        self.assertTrue(self.aggregator.order_active)
+        with self.assertLogs('algotrader.orders', 'INFO') as logs:
+            self.aggregator.apply_order_events()
+        self.assertTrue(self.aggregator.order_active)
+        self.assertEqual(self.aggregator.current_order_type, 'Buy')
+        # The real order id is logged once the broker returned it
+        self.assertIn('Order ID: BT00000001', logs.output[0])
+        self.assertEqual(self.handler.order_executor.metrics()['accepted'], 1)
+
+    def test_a_rejected_order_rolls_back_the_expected_state(self):
+        # No price for the symbol yet, the simulated broker rejects the order
+        self.assertEqual(self.place(), SUBMITTED)
+        self.assertTrue(self.aggregator.order_active)
+        with self.assertLogs('algotrader.orders', 'ERROR'):
+            self.aggregator.apply_order_events()
+        self.assertFalse(self.aggregator.order_active)
+        self.assertIsNone(self.aggregator.current_order_type)
+        self.assertIsNone(self.aggregator.current_stop_loss)
+        self.assertEqual(self.handler.order_executor.metrics()['rejected'], 1)
+
+
+class BrokerClientTests(TestCase):
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertTrue(condition())
+
+    def test_a_drained_bucket_makes_callers_wait_for_the_next_token(self):
+        bucket = TokenBucket(rate=50, burst=2)
+        self.assertEqual([bucket.acquire(POLL) < 0.01 for _ in range(2)], [True, True])
+        self.assertGreater(bucket.acquire(POLL), 0.01)
+
+    def test_exits_are_served_before_earlier_waiting_polls(self):
+        bucket = TokenBucket(rate=5, burst=1)
+        bucket.acquire(POLL)
+        served = []
+
+        def acquire(priority):
+            bucket.acquire(priority)
+            served.append(priority)
+
+        threads = []
+        for priority in (POLL, POLL, EXIT):
+            thread = threading.Thread(target=acquire, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            self.wait_for(lambda: bucket.waiting() == len(threads))
+        for thread in threads:
+            thread.join(timeout=5)
+        self.assertEqual(served, [EXIT, POLL, POLL])
+
+    def test_identical_concurrent_reads_share_one_request(self):
+        client = BrokerClient(api_key='test')
+        client.kite = mock.Mock()
+        release = threading.Event()
+        orders = [make_order('1', 'BUY', 1)]
+        client.kite.orders.side_effect = lambda: release.wait(5) and orders
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.orders())) for _ in range(3)]
+        threads[0].start()
+        self.wait_for(lambda: client.kite.orders.called)
+        for thread in threads[1:]:
+            thread.start()
+        self.wait_for(lambda: client.metrics()['coalesced'] == 2)
+        release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        self.assertEqual(client.kite.orders.call_count, 1)
+        self.assertTrue(all(result is orders for result in results))
+        self.assertEqual(client.metrics()['requests'], 1)
+
+    def test_a_rate_limited_request_is_retried_after_a_back_off(self):
+        client = BrokerClient(api_key='test', max_retries=1)
+        client.kite = mock.Mock()
+        throttled = Exception("Too many requests")
+        throttled.code = 429
+        client.kite.place_order.side_effect = [throttled, 'order-1']
+        with mock.patch.object(TokenBucket, 'penalize') as penalize, self.assertLogs(level='WARNING'):
+            self.assertEqual(client.place_order(variety='regular'), 'order-1')
+        penalize.assert_called_once_with(1.0)
+        self.assertEqual(client.metrics()['throttled'], 1)
+
+        client.kite.place_order.side_effect = [throttled, throttled]
+        with mock.patch.object(TokenBucket, 'penalize'), self.assertLogs(level='WARNING'), self.assertRaises(Exception):
+            client.place_order(variety='regular')
+
+
+class ShardedEngineTests(TestCase):
+
+    def test_the_layout_keeps_the_slots_of_known_symbols(self):
+        instruments = make_instruments(3)
+        layout = build_layout(instruments[1:])
+        self.assertEqual(layout['symbols'], ['BENCH1', 'BENCH2'])
+        reloaded = build_layout(instruments[:1] + instruments[2:], layout['symbols'])
+        self.assertEqual(reloaded['symbols'], ['BENCH1', 'BENCH2', 'BENCH0'])
+        self.assertEqual(reloaded['groups'], {str(10 ** 9): ['BENCH0', 'BENCH2']})
+
+    def test_group_totals_span_the_shards(self):
+        layout = {'symbols': ['A', 'B', 'C'], 'groups': {'30': ['A', 'B'], '80': ['C']}}
+        owner = SharedGroupPnL.create(layout, capacity=8)
+        self.addCleanup(owner.close)
+        shards = [SharedGroupPnL.attach(owner.name, layout) for _ in range(2)]
+        for shard in shards:
+            self.addCleanup(shard.close)
+        shards[0].update_many({'A': 12.5})
+        shards[1].update_many({'B': -2.5, 'C': 4.0})
+        self.assertEqual(owner.group_total('30'), 10.0)
+        self.assertEqual(shards[0].group_total('80'), 4.0)
+        self.assertEqual(owner.snapshot(), {'A': 12.5, 'B': -2.5, 'C': 4.0})
+        with self.assertRaises(ValueError):
+            owner.set_layout({'symbols': [str(index) for index in range(9)], 'groups': {}})
+
+    def test_the_shards_split_the_rate_limits_of_the_api_key(self):
+        rate_limits = split_rate_limits(4)
+        self.assertEqual(rate_limits['order'], (RATE_LIMITS['order'][0] / 4, RATE_LIMITS['order'][1] / 4))
+        # Every shard can still send a request
+        self.assertEqual(rate_limits['quote'], (0.25, 1))
+
+    def test_the_parent_seeds_the_order_book_and_broadcasts_it(self):
+        enter_sandbox(self)
+        broker = SimulatedBroker(SimulatedClock(FEED_START))
+        broker.set_price('BENCH0', 1000.0)
+        broker.place_order('regular', 'NFO', 'BENCH0', 'BUY', 2, 'MARKET', 'MIS')
+        engine = ShardedEngine(broker, make_instruments(2), processes=2)
+        self.addCleanup(engine.group_pnl.close)
+        if engine.tick_recorder is not None:
+            self.addCleanup(engine.tick_recorder.close)
+
+        self.assertTrue(engine.order_book.seed())
+        shard_books = []
+        for inbox in engine._inboxes:
+            kind, orders = inbox.get(timeout=5)
+            self.assertEqual(kind, 'orders')
+            shard_book = OrderBook(broker)
+            shard_book.merge(orders)
+            shard_books.append(shard_book)
+        self.assertEqual([book.net_quantity('BENCH0') for book in shard_books], [2, 2])
+
+        update = make_order('BT00000002', 'SELL', 2, tradingsymbol='BENCH0')
+        engine.on_order_update(None, update)
+        self.assertEqual(engine.order_book.net_quantity('BENCH0'), 0)
+        for inbox in engine._inboxes:
+            self.assertEqual(inbox.get(timeout=5), ('order', update))
+
+
+class LiveBroadcasterTests(TestCase):
+
+    def test_group_pnl_is_sent_per_group_when_it_changed(self):
+        totals = {30: 12.5, 80: -4.0}
+        broadcaster = LiveBroadcaster(lambda instrument_token: None, lambda: dict(totals))
+        messages = broadcaster.collect()
+        self.assertEqual([(group, message['key'], message['data']) for group, message in messages],
+                         [('pnl', '30', {'group': '30', 'total': 12.5}), ('pnl', '80', {'group': '80', 'total': -4.0})])
+        self.assertEqual(broadcaster.collect(), [])
+        totals[80] = -1.5
+        self.assertEqual([message['key'] for _, message in broadcaster.collect()], ['80'])
+
+    def test_a_closed_candle_is_sent_before_the_next_one(self):
+        history = CandleHistory(depth=5)
+        broadcaster = LiveBroadcaster(lambda instrument_token: history, dict)
+        history.save(make_candle(CandleHistoryTests.MINUTES[0], 100))
+        broadcaster.publish_ticks([{'instrument_token': 256265, 'last_price': 100.0}, {'instrument_token': 256265, 'last_price': 101.0}])
+        messages = broadcaster.collect()
+        self.assertEqual([group for group, _ in messages], ['ticks.256265', 'candles.256265'])
+        self.assertEqual(messages[0][1]['data']['last_price'], 101.0)
+
+        history.save(make_candle(CandleHistoryTests.MINUTES[0], 102, final_save=True))
+        history.save(make_candle(CandleHistoryTests.MINUTES[1], 103))
+        broadcaster.publish_ticks([{'instrument_token': 256265, 'last_price': 103.0}])
+        candles = [message for group, message in broadcaster.collect() if group == 'candles.256265']
+        self.assertEqual([(message['data']['close'], message['base']) for message in candles], [(102, '256265'), (103, '256265')])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class LiveFeedConsumerTests(TestCase):
+    TICKS = broadcast.group_name(broadcast.TICKS, 256265)
+
+    async def connect(self, query_string=''):
+        communicator = ApplicationCommunicator(consumers.ZerodhaWebSocketConsumer.as_asgi(), {
+            'type': 'websocket', 'path': '/ws/zerodha/', 'query_string': query_string.encode(), 'headers': []})
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(1))['type'], 'websocket.accept')
+        return communicator
+
+    async def disconnect(self, communicator):
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(1)
+
+    async def request(self, communicator, message):
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(message)})
+        return await self.receive(communicator)
+
+    async def receive(self, communicator):
+        return json.loads((await communicator.receive_output(1))['text'])
+
+    async def send_tick(self, last_price, volume_traded=100):
+        await get_channel_layer().group_send(self.TICKS, broadcast.update(
+            broadcast.TICKS, '256265', {'instrument_token': 256265, 'last_price': last_price, 'volume_traded': volume_traded}))
+
+    async def test_updates_are_conflated_and_delta_encoded(self):
+        communicator = await self.connect('max_rate=5&streams=ticks')
+        reply = await self.request(communicator, {'action': 'subscribe', 'tokens': [256265], 'streams': ['ticks']})
+        self.assertEqual(reply['subscribed'], {'tokens': [256265], 'streams': ['ticks']})
+
+        await self.send_tick(100.0)
+        first = await self.receive(communicator)
+        self.assertEqual(first['updates'], [{'stream': 'ticks', 'key': '256265', 'data': {
+            'instrument_token': 256265, 'last_price': 100.0, 'volume_traded': 100}}])
+        # Both arrive while the sender waits for its next slot, only the latest is sent
+        await self.send_tick(101.0)
+        await self.send_tick(102.0)
+        second = await self.receive(communicator)
+        self.assertEqual(second['updates'], [{'stream': 'ticks', 'key': '256265', 'delta': {'last_price': 102.0}}])
+        self.assertTrue(await communicator.receive_nothing(0.3))
+        await self.disconnect(communicator)
+
+    async def test_full_updates_without_delta_and_signals_are_never_conflated(self):
+        communicator = await self.connect('max_rate=5&delta=0')
+        await self.request(communicator, {'action': 'subscribe', 'tokens': [256265], 'streams': ['ticks', 'signals']})
+        await self.send_tick(100.0)
+        await self.receive(communicator)
+        await self.send_tick(101.0)
+        for sequence in (1, 2):
+            await get_channel_layer().group_send(broadcast.group_name(broadcast.SIGNALS), broadcast.update(
+                broadcast.SIGNALS, str(sequence), {'order_type': 'Buy'}, conflate=False))
+        frame = await self.receive(communicator)
+        self.assertEqual([(update['stream'], update['key']) for update in frame['updates']],
+                         [('ticks', '256265'), ('signals', '1'), ('signals', '2')])
+        self.assertEqual(frame['updates'][0]['data']['last_price'], 101.0)
+        await self.disconnect(communicator)
+
+    async def test_invalid_settings_are_answered_with_an_error_and_change_nothing(self):
+        communicator = await self.connect('max_rate=nan')
+        self.assertIn('max_rate', (await self.receive(communicator))['error'])
+        reply = await self.request(communicator, {'action': 'configure', 'delta': 'maybe'})
+        self.assertIn('delta', reply['error'])
+        reply = await self.request(communicator, {'action': 'subscribe', 'tokens': ['abc']})
+        self.assertIn('instrument token', reply['error'])
+        reply = await self.request(communicator, {'action': 'configure', 'max_rate': 2})
+        self.assertEqual((reply['max_rate'], reply['delta'], reply['encoding']), (2.0, True, 'json'))
+        self.assertEqual(reply['subscribed'], {'tokens': [], 'streams': []})
+        await self.disconnect(communicator)
+
+    @unittest.skipIf(consumers.msgpack is None, "msgpack is not installed")
+    async def test_msgpack_frames_are_binary(self):
+        communicator = await self.connect('max_rate=5&encoding=msgpack')
+        await self.request(communicator, {'action': 'subscribe', 'tokens': [256265], 'streams': ['ticks']})
+        await self.send_tick(100.0)
+        output = await communicator.receive_output(1)
+        frame = consumers.msgpack.unpackb(output['bytes'])
+        self.assertEqual(frame['updates'][0]['data']['last_price'], 100.0)
+        await self.disconnect(communicator)
+
+
+class BacktestTests(TestCase):
+    # (hour, minute, second, price) of one instrument, the 09:17:40 tick breaks out of the two candles before
+    FEED = [(9, 15, 10, 100.0), (9, 15, 40, 101.0), (9, 16, 5, 100.5), (9, 16, 30, 100.8), (9, 17, 5, 100.2),
+            (9, 17, 20, 100.5), (9, 17, 40, 104.0), (9, 17, 50, 98.5), (9, 17, 55, 97.0)]
+
+    def batches(self):
+        batches = []
+        for hour, minute, second, price in self.FEED:
+            received_at = datetime.datetime(2024, 1, 1, hour, minute, second)
+            batches.append((received_at, [{'instrument_token': 100000, 'last_price': price, 'last_traded_quantity': 1,
+                                           'ohlc': {'high': 120.0, 'low': 90.0}, 'exchange_timestamp': received_at}]))
+        return batches
+
+    def run_feed(self, batches, **options):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        # The stop-loss warning reaches stderr when the channels are not set up
+        with self.assertLogs('algotrader.orders', 'WARNING') as logs:
+            result = run_backtest(make_instruments(1, percentage=1, exit_trades_threshold_points=50), batches,
+                                  workdir=workdir.name, **options)
+        self.assertIn('Stop-loss hit for 100000', logs.output[0])
+        return result
+
+    def test_a_breakout_fills_and_its_stop_loss_reverses_the_position(self):
+        for candle_close_timer in (False, True):
+            result = self.run_feed(self.batches(), candle_close_timer=candle_close_timer)
+            # Levels 103 and 99 from the 09:15 and 09:16 candles at 1%
+            self.assertEqual([(trade['time'], trade['transaction_type'], trade['price']) for trade in result.trades], [
+                ('2024-01-01 09:17:40', 'BUY', 104.0),
+                ('2024-01-01 09:17:50', 'SELL', 98.5),
+                ('2024-01-01 09:17:50', 'SELL', 98.5),
+            ])
+            # 98.5 - 104 on the long, 98.5 - 97 on the short
+            self.assertEqual(result.group_pnl, {'50': -4.0})
+            self.assertEqual(result.symbol_pnl, {'BENCH0': -4.0})
+            self.assertEqual((result.batches, result.ticks, result.simulated_seconds), (9, 9, 165.0))
+
+    def test_recorded_json_lines_replay_the_same(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'ticks.jsonl')
+        with open(path, 'w') as file:
+            for received_at, ticks in self.batches():
+                # Without received_at the batch arrives at its latest exchange_timestamp
+                file.write(json.dumps({'ticks': [dict(tick, exchange_timestamp=received_at.isoformat()) for tick in ticks]}) + '\n')
+        self.assertEqual(self.run_feed(read_tick_batches(path)).trades, self.run_feed(self.batches()).trades)
+
+
+class SweepTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, '256265_1_minute_candles.json')
+        journal = CandleJournal(self.path)
+        start = candle_time.parse_start_time('2024-01-01 09:15:00')
+        for day in range(2):
+            for minute in range(30):
+                price = 100.0 + (minute % 7) * 3 - day
+                journal.save(Candle(start + day * 86400 + minute * 60, price, price + 2, price - 2, price + 1, 10,
+                                    150.0, 50.0, True))
+        journal.close()
+
+    def test_a_second_load_reads_the_cache(self):
+        columns = sweep.load_minute_candles(self.path)
+        self.assertTrue(os.path.exists(sweep.cache_path(self.path)))
+        self.assertEqual(len(columns['start']), 60)
+        with mock.patch.object(sweep, 'load_candles', side_effect=AssertionError("parsed again")):
+            cached = sweep.load_minute_candles(self.path)
+        for field in sweep.COLUMNS:
+            np.testing.assert_array_equal(cached[field], columns[field])
+
+    def test_a_changed_file_is_parsed_again(self):
+        sweep.load_minute_candles(self.path)
+        journal = CandleJournal(self.path)
+        journal.save(make_candle('2024-01-03 09:15:00', 120, final_save=True))
+        journal.close()
+        with mock.patch.object(sweep, 'load_candles', wraps=sweep.load_candles) as load_candles:
+            columns = sweep.load_minute_candles(self.path)
+        load_candles.assert_called_once_with(self.path)
+        self.assertEqual(len(columns['start']), 61)
+
+    def test_levels_come_from_the_two_candles_before(self):
+        day = sweep.split_days(sweep.load_minute_candles(self.path, cache=False))[0]
+        higher, lower = sweep.breakout_levels(day, 1, [0.0])
+        self.assertTrue(np.isnan(higher[0, :2]).all())
+        self.assertEqual((higher[0, 2], lower[0, 2]), (max(day['high'][:2]), min(day['low'][:2])))
+        self.assertFalse(os.path.exists(sweep.cache_path(self.path)))
+
+    def test_a_day_enters_on_a_breakout_reverses_on_the_stop_and_closes_at_the_threshold(self):
+        prices = np.array([100.0, 111.0, 105.0, 95.0, 70.0])
+        higher = np.full((2, len(prices)), 110.0)
+        lower = np.full((2, len(prices)), 100.0)
+        metrics = sweep.simulate_day(prices, higher, lower, np.array([1000.0, 5.0]))
+        # Bought at 111, stopped at 95 and reversed short, 25 points back at 70
+        self.assertEqual(metrics['pnl'].tolist(), [9.0, 9.0])
+        self.assertEqual(metrics['orders'].tolist(), [3, 4])
+        self.assertEqual(metrics['round_trips'].tolist(), [1, 2])
+        self.assertEqual(metrics['winning_trips'].tolist(), [0, 1])
+        self.assertEqual(metrics['max_drawdown'].tolist(), [16.0, 16.0])
+
+    def test_results_are_sorted_by_pnl_and_the_same_from_the_cache(self):
+        options = dict(timeframes=[1, 3], percentages=[0.0, 0.1], thresholds=[5, 50], processes=1)
+        results = sweep.run_sweep([self.path], **options)
+        self.assertEqual(len(results), 8)
+        self.assertEqual([result['pnl'] for result in results], sorted([result['pnl'] for result in results], reverse=True))
+        self.assertEqual(results[0]['instruments']['256265_1_minute_candles.json']['days'], 2)
+        self.assertEqual(sweep.run_sweep([self.path], **options), results)
+        self.assertEqual(sweep.run_sweep([self.path], cache=False, **options), results)
+
+
+class TickQueueTests(TestCase):
+
+    @staticmethod
+    def tick(instrument_token, last_price, last_traded_quantity=1):
+        return {'instrument_token': instrument_token, 'last_price': last_price, 'last_traded_quantity': last_traded_quantity}
+
+    @staticmethod
+    def close_event(instrument_token, boundary=1000):
+        return {'instrument_token': instrument_token, 'candle_close': boundary, 'epoch': boundary}
+
+    def test_drop_oldest_drops_ticks_and_keeps_candle_closes(self):
+        shard = TickShard(0, maxsize=2, policy=DROP_OLDEST)
+        shard.put(self.tick(1, 100.0), 0)
+        shard.put(self.close_event(1), 0)
+        shard.put(self.tick(1, 101.0), 0)
+        shard.put(self.tick(1, 102.0), 0)
+        self.assertEqual(shard.get_batch(10, timeout=0), [self.close_event(1), self.tick(1, 102.0)])
+        self.assertEqual(shard.metrics()['dropped'], 2)
+
+    def test_conflate_replaces_the_queued_tick_of_the_token_and_keeps_its_volume(self):
+        shard = TickShard(0, maxsize=2, policy=CONFLATE)
+        shard.put(self.tick(1, 100.0, 5), 0)
+        shard.put(self.tick(2, 200.0, 5), 0)
+        shard.put(self.tick(1, 101.0, 3), 0)
+        self.assertEqual(shard.metrics()['depth'], 2)
+        self.assertEqual(shard._items[0][1], self.tick(1, 101.0, 8))
+        # The close goes in over the limit, the next tick of the token is not merged across it
+        # and the oldest tick makes room instead
+        shard.put(self.close_event(1), 0)
+        shard.put(self.tick(1, 102.0, 1), 0)
+        self.assertEqual(shard.get_batch(10, timeout=0),
+                         [self.tick(2, 200.0, 5), self.close_event(1), self.tick(1, 102.0, 1)])
+        metrics = shard.metrics()
+        self.assertEqual((metrics['conflated'], metrics['dropped']), (1, 1))
+
+    def test_a_candle_close_never_blocks_on_a_full_shard(self):
+        shard = TickShard(0, maxsize=1, policy=BLOCK)
+        self.addCleanup(shard.close)
+        shard.put(self.tick(1, 100.0), 0)
+        putter = threading.Thread(target=shard.put, args=(self.close_event(1), 0), daemon=True)
+        putter.start()
+        putter.join(timeout=1)
+        self.assertFalse(putter.is_alive())
+        self.assertEqual(shard.metrics()['depth'], 2)
+        self.assertEqual(shard.metrics()['blocked'], 0)
+
+    def test_the_ticks_of_a_token_are_processed_in_order_by_one_worker(self):
+        processed = []
+        lock = threading.Lock()
+
+        def process_ticks(batch):
+            with lock:
+                processed.extend((threading.current_thread().name, tick['instrument_token'], tick['last_price']) for tick in batch)
+
+        tick_queue = ShardedTickQueue(process_ticks, shards=3, maxsize=100, max_batch=7)
+        tick_queue.start()
+        self.addCleanup(tick_queue.stop)
+        for price in range(50):
+            tick_queue.put_many([self.tick(token, float(price)) for token in (1, 2, 3, 4)])
+        self.assertTrue(tick_queue.drain(timeout=5))
+        for token in (1, 2, 3, 4):
+            entries = [(thread, price) for thread, tick_token, price in processed if tick_token == token]
+            self.assertEqual([price for _, price in entries], [float(price) for price in range(50)])
+            self.assertEqual({thread for thread, _ in entries}, {f"tick-worker-{token % 3}"})
+        self.assertEqual(sum(shard['processed'] for shard in tick_queue.metrics()), 200)
+
+
+class FakeCollection:
+    """ The part of a pymongo collection the repository uses, matching on instrument_token only. """
+
+    def __init__(self, documents=()):
+        self.documents = [dict(document, _id=index) for index, document in enumerate(documents)]
+        self.finds = 0
+        self.indexes = []
+
+    def create_index(self, keys, unique=False, name=None):
+        tokens = [document['instrument_token'] for document in self.documents]
+        if unique and len(tokens) != len(set(tokens)):
+            raise DuplicateKeyError("E11000 duplicate key error")
+        self.indexes.append(name)
+        return name
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        return [{key: value for key, value in document.items() if key != '_id'} for document in self.documents]
+
+    def find_one(self, query):
+        for document in self.documents:
+            if document['instrument_token'] == query['instrument_token']:
+                return dict(document)
+        return None
+
+    def find_one_and_update(self, query, update, return_document=None):
+        for document in self.documents:
+            if document['instrument_token'] == query['instrument_token']:
+                previous = dict(document)
+                document.update(update['$set'])
+                return dict(document) if return_document == repository.ReturnDocument.AFTER else previous
+        return None
+
+    def insert_one(self, document):
+        document = dict(document, _id=len(self.documents))
+        self.documents.append(document)
+        return mock.Mock(inserted_id=document['_id'])
+
+    def delete_one(self, query):
+        self.documents = [document for document in self.documents if document['instrument_token'] != query['instrument_token']]
+        return mock.Mock(acknowledged=True)
+
+
+class FakeAuditLog:
+    written = 0
+    failed = 0
+
+    def __init__(self):
+        self.entries = []
+
+    def record(self, document, action):
+        entry = dict(document, old_id=str(document['_id']), action=action)
+        del entry['_id']
+        self.entries.append(entry)
+        return dict(entry)
+
+
+class TradeConfigurationRepositoryTests(TestCase):
+
+    def setUp(self):
+        self.configurations = FakeCollection([{'instrument_token': 1, 'lot_size': 50}, {'instrument_token': 2, 'lot_size': 25}])
+        self.log = FakeCollection()
+        database = {repository.CONFIGURATION_COLLECTION: self.configurations, repository.CONFIGURATION_LOG_COLLECTION: self.log}
+        patcher = mock.patch.object(repository, 'get_database', return_value=database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.audit_log = FakeAuditLog()
+        self.repository = repository.TradeConfigurationRepository(audit_log=self.audit_log, cache_ttl=60)
+
+    def test_reads_are_served_from_the_cache_until_a_write(self):
+        self.assertEqual(self.repository.get(1), {'instrument_token': 1, 'lot_size': 50})
+        self.assertEqual(len(self.repository.list()), 2)
+        self.assertEqual(self.configurations.finds, 1)
+        self.assertEqual(self.repository.metrics()['cache_hits'], 1)
+        # Returned documents are copies
+        self.repository.get(1)['lot_size'] = 0
+        self.assertEqual(self.repository.get(1)['lot_size'], 50)
+
+        self.repository.insert({'instrument_token': 3, 'lot_size': 75})
+        self.assertEqual(self.repository.get(3), {'instrument_token': 3, 'lot_size': 75})
+        self.assertEqual(self.configurations.finds, 2)
+
+    def test_the_cache_expires_after_its_ttl(self):
+        self.repository.get(1)
+        with mock.patch.object(repository.time, 'monotonic', return_value=repository.time.monotonic() + 61):
+            self.repository.get(1)
+        self.assertEqual(self.configurations.finds, 2)
+
+    def test_update_returns_the_stored_document_and_audits_the_previous_one(self):
+        self.repository.get(1)
+        modified_count, entry, updated = self.repository.update(1, {'lot_size': 100})
+        self.assertEqual(modified_count, 1)
+        self.assertEqual(updated, {'instrument_token': 1, 'lot_size': 100})
+        self.assertEqual((entry['lot_size'], entry['action']), (50, 'updation'))
+        self.assertEqual(self.repository.get(1)['lot_size'], 100)
+
+        # Setting the stored value modifies nothing
+        self.assertEqual(self.repository.update(1, {'lot_size': 100})[0], 0)
+        self.assertEqual(self.repository.update(9, {'lot_size': 100}), (0, None, None))
+
+    def test_delete_audits_the_document_and_reloads_the_cache(self):
+        self.assertEqual(self.repository.get(2)['lot_size'], 25)
+        acknowledged, entry = self.repository.delete(2)
+        self.assertTrue(acknowledged)
+        self.assertEqual((entry['instrument_token'], entry['action']), (2, 'deletion'))
+        self.assertIsNone(self.repository.get(2))
+        self.assertEqual(self.repository.delete(2), (False, None))
+
+    def test_ensure_indexes_fails_on_duplicate_tokens(self):
+        self.repository.ensure_indexes()
+        self.assertEqual(self.configurations.indexes, ['instrument_token_unique'])
+        self.assertEqual(self.log.indexes, ['instrument_token_timeofaction'])
+
+        self.configurations.documents.append({'instrument_token': 1, '_id': 5})
+        with self.assertLogs(level='ERROR'), self.assertRaises(DuplicateKeyError):
+            self.repository.ensure_indexes()
+
+
+def make_dump():
+    """ Rows in the shape of kite.instruments(). """
+    return [
+        {'instrument_token': 100000, 'exchange_token': '390', 'tradingsymbol': 'BENCH0', 'name': 'BENCH',
+         'last_price': 0.0, 'expiry': datetime.date(2024, 1, 25), 'strike': 0.0, 'tick_size': 0.05, 'lot_size': 50,
+         'instrument_type': 'FUT', 'segment': 'NFO-FUT', 'exchange': 'NFO'},
+        {'instrument_token': 256265, 'exchange_token': '1001', 'tradingsymbol': 'NIFTY 50', 'name': 'NIFTY 50',
+         'last_price': 0.0, 'expiry': '', 'strike': 0.0, 'tick_size': 0.0, 'lot_size': 0,
+         'instrument_type': 'EQ', 'segment': 'INDICES', 'exchange': 'NSE'},
+        {'instrument_token': 738561, 'exchange_token': '2885', 'tradingsymbol': 'RELIANCE', 'name': 'RELIANCE',
+         'last_price': 0.0, 'expiry': '', 'strike': 0.0, 'tick_size': 0.05, 'lot_size': 1,
+         'instrument_type': 'EQ', 'segment': 'NSE', 'exchange': 'NSE'},
+    ]
+
+
+class InstrumentMasterTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.broker = mock.Mock()
+        self.broker.instruments.return_value = make_dump()
+        self.master = InstrumentMaster(self.broker, directory=self.directory)
+
+    def test_the_dump_is_downloaded_once_and_mapped_after_a_restart(self):
+        self.assertEqual(self.master.get(738561)['tradingsymbol'], 'RELIANCE')
+        self.assertEqual(self.master.get(100000)['expiry'], datetime.date(2024, 1, 25))
+        self.assertEqual(self.master.find('NSE', 'NIFTY 50')['instrument_token'], 256265)
+        self.assertIsNone(self.master.get(1))
+        self.assertEqual(self.broker.instruments.call_count, 1)
+
+        restarted = InstrumentMaster(self.broker, directory=self.directory)
+        self.assertEqual(restarted.get(738561)['lot_size'], 1)
+        self.assertEqual(self.broker.instruments.call_count, 1)
+
+    def test_a_stale_snapshot_answers_while_the_next_day_is_downloaded(self):
+        snapshot = self.master.snapshot()
+        snapshot.expires_at = 0
+        self.broker.instruments.return_value = [dict(row, lot_size=75) if row['instrument_token'] == 100000 else row
+                                                for row in make_dump()]
+        with mock.patch.object(self.master, 'trading_day', return_value=snapshot.day + datetime.timedelta(days=1)):
+            self.assertEqual(self.master.get(100000)['lot_size'], 50)
+            deadline = time.monotonic() + 5
+            while self.master._refreshing and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(self.master.get(100000)['lot_size'], 75)
+        self.assertEqual(self.master.snapshot().day, snapshot.day + datetime.timedelta(days=1))
+        self.assertEqual(len(snapshot_days(self.directory)), 2)
+        self.assertEqual(self.master.metrics()['refreshes'], 2)
+
+    def test_resolve_replaces_the_stored_details_of_listed_tokens(self):
+        configurations = [{'instrument_token': '100000', 'instrument_details': {'tradingsymbol': 'OLD', 'lot_size': 25}},
+                          {'instrument_token': '1', 'instrument_details': {'tradingsymbol': 'DELISTED'}}]
+        self.master.resolve(configurations)
+        self.assertEqual(configurations[0]['instrument_details']['lot_size'], 50)
+        self.assertEqual(configurations[0]['instrument_details']['expiry'], '2024-01-25')
+        self.assertEqual(configurations[1]['instrument_details'], {'tradingsymbol': 'DELISTED'})
+
+    def test_exports_are_written_once_per_filter_with_their_own_etag(self):
+        snapshot = self.master.snapshot()
+        path = self.master.export(snapshot, exchange='NSE')
+        with gzip.open(path, 'rt', newline='') as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[0][:3], ['instrument_token', 'exchange_token', 'tradingsymbol'])
+        self.assertEqual([row[2] for row in rows[1:]], ['NIFTY 50', 'RELIANCE'])
+        modified = os.path.getmtime(path)
+        self.assertEqual(self.master.export(snapshot, exchange='NSE'), path)
+        self.assertEqual(os.path.getmtime(path), modified)
+        self.assertIsNone(self.master.export(snapshot, exchange='BSE'))
+        self.assertNotEqual(self.master.export_etag(snapshot, exchange='NSE'), self.master.export_etag(snapshot))
+
+    def test_the_download_view_answers_a_matching_etag_with_not_modified(self):
+        with mock.patch.object(views, 'instrument_master', self.master):
+            response = self.client.get('/algotraderapp/download_all_instruments', {'segment': 'NFO-FUT'})
+            self.assertEqual(response.status_code, 200)
+            rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+            self.assertEqual([row[2] for row in rows[1:]], ['BENCH0'])
+            not_modified = self.client.get('/algotraderapp/download_all_instruments', {'segment': 'NFO-FUT'},
+                                           HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+
+    def test_the_handler_resolves_instruments_through_the_master(self):
+        enter_sandbox(self)
+        broker = SimulatedBroker(SimulatedClock(FEED_START))
+        instruments = make_instruments(1)
+        instruments[0]['instrument_details']['tradingsymbol'] = 'OLD0'
+        handler = make_handler(self, broker, instruments, instrument_master=self.master)
+        self.assertEqual(handler.candle_aggregators['100000'].tradingsymbol, 'BENCH0')
+        self.assertEqual(handler.symbols_by_token, {100000: 'BENCH0'})
+
+        self.broker.instruments.return_value = [dict(row, tradingsymbol='BENCH0R') if row['instrument_token'] == 100000 else row
+                                                for row in make_dump()]
+        self.master.refresh(force=True)
+        handler.reload_config(make_instruments(1))
+        self.assertEqual(handler.symbols_by_token, {100000: 'BENCH0R'})
+
+
+class TickRecorderTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def full_tick(self, price, second):
+        return {
+            'tradable': True, 'mode': 'full', 'instrument_token': 256265, 'last_price': price,
+            'last_traded_quantity': 25, 'average_traded_price': 101.25, 'volume_traded': 1000,
+            'total_buy_quantity': 400, 'total_sell_quantity': 600, 'change': 1.5,
+            'ohlc': {'open': 99.0, 'high': 103.0, 'low': 98.0, 'close': 100.0},
+            'last_trade_time': datetime.datetime(2024, 1, 1, 9, 15, second - 1), 'oi': 10, 'oi_day_high': 12, 'oi_day_low': 8,
+            'exchange_timestamp': datetime.datetime(2024, 1, 1, 9, 15, second),
+            'depth': {side: [{'quantity': 10 * level, 'price': price + level, 'orders': level} for level in range(1, 6)]
+                      for side in ('buy', 'sell')},
+        }
+
+    def record(self, batches, depth=True):
+        recorder = TickRecorder(self.directory, depth=depth, flush_interval=0.01)
+        for received_at, ticks in batches:
+            recorder.record(ticks, received_at)
+        recorder.close()
+        return recorder
+
+    def test_batches_replay_as_they_were_recorded(self):
+        ltp = {'tradable': True, 'mode': 'ltp', 'instrument_token': 738561, 'last_price': 2500.5}
+        batches = [
+            (datetime.datetime(2024, 1, 1, 9, 15, 1, 250000, tzinfo=candle_time.IST), [self.full_tick(100.0, 1), ltp]),
+            (datetime.datetime(2024, 1, 1, 9, 15, 2, 500, tzinfo=candle_time.IST), [self.full_tick(100.5, 2)]),
+        ]
+        recorder = self.record(batches)
+        self.assertEqual((recorder.metrics()['records'], recorder.metrics()['batches']), (3, 2))
+        self.assertEqual(list(read_tick_batches(self.directory)), batches)
+
+    def test_a_restart_opens_a_new_segment_and_a_torn_record_is_left_out(self):
+        received_at = datetime.datetime(2024, 1, 1, 9, 15, 1, tzinfo=candle_time.IST)
+        self.record([(received_at, [self.full_tick(100.0, 1)])], depth=False)
+        self.record([(received_at, [self.full_tick(101.0, 2)]), (received_at, [self.full_tick(102.0, 3)])], depth=False)
+        segments = day_segments(self.directory, '20240101')
+        self.assertEqual([os.path.basename(path) for path in segments], ['20240101-0.ticks', '20240101-1.ticks'])
+        with open(segments[1], 'ab') as file:
+            file.write(b'\0' * 7)
+        self.assertEqual(len(open_segment(segments[1])), 2)
+        prices = [tick['last_price'] for _, ticks in read_tick_batches(self.directory) for tick in ticks]
+        self.assertEqual(prices, [100.0, 101.0, 102.0])
+        # Ticks recorded without depth replay without it
+        self.assertNotIn('depth', next(iter(read_tick_batches(self.directory)))[1][0])
+        chunks = list(iter_day(self.directory, '20240101', chunk_size=2))
+        self.assertEqual([chunk['last_price'].tolist() for chunk in chunks], [[100.0], [101.0, 102.0]])
+
+
+class BenchmarkTests(TestCase):
+
+    def test_every_benchmark_times_every_tick_of_the_feed(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        results = run_benchmarks(instrument_count=2, rate=2, seconds=5, history=5, workdir=workdir.name)
+        self.assertEqual(results['parameters']['instruments'], 2)
+        calls = {name: (summary['calls'], summary['operations']) for name, summary in results['results'].items()}
+        self.assertEqual(calls, {'process_tick': (20, 20), 'check_strategy': (20, 20), 'pnl': (20, 20), 'on_ticks': (5, 20)})
+        self.assertTrue(all(summary['p50_us'] > 0 for summary in results['results'].values()))
+        # The scratch directory holds the journals, the project's working directory is untouched
+        self.assertIn('100000_1_minute_candles.json', os.listdir(workdir.name))
+
+    def test_the_synthetic_feed_is_the_same_for_a_seed(self):
+        instruments = make_instruments(3)
+        first = synthetic_batches(instruments, rate=2, seconds=3, seed=7)
+        self.assertEqual(first, synthetic_batches(instruments, rate=2, seconds=3, seed=7))
+        self.assertNotEqual(first, synthetic_batches(instruments, rate=2, seconds=3, seed=8))
+        self.assertEqual([len(ticks) for _, ticks in first], [6, 6, 6])
+
+    def test_percentiles_and_regressions(self):
+        samples = LatencySamples()
+        for nanoseconds in range(1000, 101000, 1000):
+            samples.add(nanoseconds, operations=2)
+        summary = samples.summary()
+        self.assertEqual((summary['calls'], summary['operations'], summary['p50_us'], summary['p99_us'], summary['max_us']),
+                         (100, 200, 51.0, 100.0, 100.0))
+        baseline = {'results': {'pnl': {'p50_us': 10.0, 'p99_us': 50.0}}}
+        current = {'results': {'pnl': {'p50_us': 11.9, 'p99_us': 61.0}, 'on_ticks': {'p50_us': 1.0, 'p99_us': 1.0}}}
+        self.assertEqual(compare(baseline, current, tolerance=0.2), [('pnl', 'p99_us', 50.0, 61.0)])
+
+
+class LatencyMetricsTests(TestCase):
+
+    def test_histograms_bucket_by_upper_bound_and_report_bucket_quantiles(self):
+        histogram = latency.Histogram()
+        for seconds in (0.000001, 0.0000011, 0.003, 0.003, 20.0):
+            histogram.observe(seconds)
+        self.assertEqual(histogram.counts[0], 1)  # The bound belongs to its bucket
+        self.assertEqual(histogram.counts[1], 1)
+        self.assertEqual(histogram.counts[latency.BUCKETS.index(0.005)], 2)
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.quantile(0.5), 0.005)
+        self.assertEqual(histogram.quantile(1.0), float('inf'))
+        self.assertIsNone(latency.Histogram().quantile(0.5))
+
+    def test_snapshots_of_several_processes_render_as_one_prometheus_series(self):
+        shards = [latency.LatencyMetrics(enabled=True), latency.LatencyMetrics()]
+        shards[0].observe('candle_update', 'NIFTY "50"', 0.00002)
+        shards[1].observe('candle_update', 'NIFTY "50"', 0.0002)
+        shards[1].observe('queue_wait', 'RELIANCE', 0.001)
+        text = latency.render_prometheus([shards[0].snapshot(), shards[1].snapshot()])
+        lines = text.splitlines()
+        self.assertIn('algotrader_latency_metrics_enabled 1', lines)
+        self.assertIn('algotrader_stage_latency_seconds_bucket{stage="candle_update",le="2.5e-05"} 1', lines)
+        self.assertIn('algotrader_stage_latency_seconds_bucket{stage="candle_update",le="+Inf"} 2', lines)
+        self.assertIn('algotrader_stage_latency_seconds_count{stage="candle_update"} 2', lines)
+        self.assertIn('algotrader_instrument_stage_latency_seconds_count{stage="candle_update",instrument="NIFTY \\"50\\""} 2', lines)
+        # Stages are rendered in tick path order
+        self.assertLess(text.index('stage="queue_wait"'), text.index('stage="candle_update"'))
+        summary = latency.summarize([shards[0].snapshot(), shards[1].snapshot()])
+        self.assertEqual(summary['candle_update'], {'count': 2, 'mean_ms': 0.11, 'p50_ms': 0.025, 'p99_ms': 0.25})
+
+    def test_the_handler_times_its_stages_only_while_enabled(self):
+        enter_sandbox(self)
+        broker = SimulatedBroker(SimulatedClock(datetime.datetime(2024, 1, 1, 9, 15, 2, tzinfo=candle_time.IST)))
+        handler = make_handler(self, broker, make_instruments(1))
+        tick = {'instrument_token': 100000, 'last_price': 1000.0, 'last_traded_quantity': 1,
+                'ohlc': {'high': 1200.0, 'low': 900.0}, 'exchange_timestamp': datetime.datetime(2024, 1, 1, 9, 15, 1)}
+        handler.on_ticks(None, [dict(tick)])
+        self.assertEqual(handler.latency.summary(), {})
+
+        handler.set_latency_metrics(True)
+        handler.on_ticks(None, [dict(tick)])
+        summary = handler.latency.summary()
+        self.assertEqual({stage: stage_summary['count'] for stage, stage_summary in summary.items()},
+                         {'feed_lag': 1, 'queue_wait': 1, 'candle_update': 1, 'pnl_refresh': 1, 'strategy_check': 1})
+        self.assertEqual(summary['feed_lag']['p50_ms'], 1000.0)
+
+        with mock.patch.object(views, 'ws_handler', handler):
+            response = self.client.get('/algotraderapp/latency_metrics')
+        self.assertEqual(response['Content-Type'], latency.PROMETHEUS_CONTENT_TYPE)
+        self.assertIn('algotrader_instrument_stage_latency_seconds_count{stage="feed_lag",instrument="BENCH0"} 1',
+                      response.content.decode().splitlines())
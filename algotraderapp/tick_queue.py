@@ -0,0 +1,223 @@
+import time
+import logging
+import threading
+from collections import deque
+
+# Overflow policies for a full shard
+BLOCK = 'block'  # Wait in the socket thread until the worker catches up
+DROP_OLDEST = 'drop_oldest'  # Discard the oldest queued tick of the shard
+CONFLATE = 'conflate'  # Replace the queued tick of the same token, falls back to drop_oldest
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, CONFLATE)
+
+
+class TickShard:
+    """
+    Bounded FIFO of ticks for the instrument tokens routed to one worker.
+
+    Items are [enqueued_at, tick] lists so a conflated tick can be swapped
+    in place without losing its position in the queue. Candle close events
+    bypass the overflow policy: they are never blocked, dropped or
+    conflated, so the shard can hold maxsize ticks plus the pending closes.
+    """
+
+    def __init__(self, index, maxsize, policy):
+        self.index = index
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = deque()
+        self._pending_by_token = {}  # instrument_token -> queued item, used by conflate
+        self._condition = threading.Condition()
+        self._busy = False  # Worker is processing a batch taken from this shard
+        self._closed = False
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def put(self, tick, enqueued_at):
+        with self._condition:
+            if self._closed:
+                return
+            self.enqueued += 1
+            if len(self._items) >= self.maxsize and 'candle_close' not in tick:
+                if self.policy == CONFLATE and self._conflate(tick):
+                    return
+                if self.policy == BLOCK:
+                    self.blocked += 1
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                else:
+                    self._drop_oldest()
+
+            item = [enqueued_at, tick]
+            self._items.append(item)
+            if self.policy == CONFLATE:
+                if 'candle_close' in tick:
+                    # Never conflate ticks across a candle close event
+                    self._pending_by_token.pop(tick.get('instrument_token'), None)
+                else:
+                    self._pending_by_token[tick.get('instrument_token')] = item
+            if len(self._items) > self.max_depth:
+                self.max_depth = len(self._items)
+            self._condition.notify_all()
+
+    def _conflate(self, tick):
+        item = self._pending_by_token.get(tick.get('instrument_token'))
+        if item is None or 'candle_close' in tick:
+            return False
+        # Latest price wins, the traded quantity is carried over so candle volume stays complete
+        previous_tick = item[1]
+        if 'last_traded_quantity' in tick and 'last_traded_quantity' in previous_tick:
+            tick['last_traded_quantity'] += previous_tick['last_traded_quantity']
+        item[1] = tick
+        self.conflated += 1
+        return True
+
+    def _drop_oldest(self):
+        """ Drop the oldest queued tick, queued candle close events are kept. """
+        for index, item in enumerate(self._items):
+            if 'candle_close' not in item[1]:
+                break
+        else:
+            return
+        del self._items[index]
+        if self._pending_by_token.get(item[1].get('instrument_token')) is item:
+            del self._pending_by_token[item[1].get('instrument_token')]
+        self.dropped += 1
+
+    def get_batch(self, max_items, timeout):
+        """
+        Wait for ticks and take up to max_items of them.
+
+        Returns:
+        - list: The ticks in arrival order, empty when the wait timed out.
+        """
+        with self._condition:
+            if not self._items:
+                self._condition.wait(timeout)
+            if not self._items:
+                return []
+            # Lag is measured on the oldest tick of the batch
+            self.last_lag = time.monotonic() - self._items[0][0]
+            if self.last_lag > self.max_lag:
+                self.max_lag = self.last_lag
+            batch = []
+            while self._items and len(batch) < max_items:
+                item = self._items.popleft()
+                batch.append(item[1])
+                if self.policy == CONFLATE and self._pending_by_token.get(item[1].get('instrument_token')) is item:
+                    del self._pending_by_token[item[1].get('instrument_token')]
+            self._busy = True
+            self._condition.notify_all()
+            return batch
+
+    def task_done(self, count):
+        with self._condition:
+            self.processed += count
+            self._busy = False
+            self._condition.notify_all()
+
+    def wait_idle(self, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._items and not self._busy, timeout)
+
+    def open(self):
+        with self._condition:
+            self._closed = False
+
+    def close(self):
+        """ Stop accepting ticks and release a socket thread blocked on a full shard. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def metrics(self):
+        with self._condition:
+            return {
+                'shard': self.index,
+                'depth': len(self._items),
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'conflated': self.conflated,
+                'blocked': self.blocked,
+                'oldest_age_ms': round((time.monotonic() - self._items[0][0]) * 1000, 3) if self._items else 0.0,
+                'last_lag_ms': round(self.last_lag * 1000, 3),
+                'max_lag_ms': round(self.max_lag * 1000, 3),
+            }
+
+
+class ShardedTickQueue:
+    """
+    Ingestion stage between the KiteTicker callback and strategy processing.
+
+    The socket thread only partitions incoming ticks by instrument token and
+    appends them to bounded shards; one worker thread per shard drains its
+    shard in batches and hands them to the processing function. A token
+    always maps to the same shard, so ticks of one instrument are processed
+    in order and by a single thread.
+    """
+
+    def __init__(self, process_ticks, shards=4, maxsize=10000, policy=BLOCK, max_batch=500):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown tick queue overflow policy: {policy}")
+        self.process_ticks = process_ticks
+        self.max_batch = max_batch
+        self.shards = [TickShard(index, maxsize, policy) for index in range(max(1, shards))]
+        self._workers = []
+        self._stop_event = threading.Event()
+
+    def shard_for(self, instrument_token):
+        return self.shards[int(instrument_token) % len(self.shards)]
+
+    def put_many(self, ticks):
+        """ Enqueue a batch of ticks, called from the socket thread. """
+        enqueued_at = time.monotonic()
+        for tick in ticks:
+            self.shard_for(tick['instrument_token']).put(tick, enqueued_at)
+
+    def start(self):
+        if self._workers:
+            return
+        self._stop_event.clear()
+        for shard in self.shards:
+            shard.open()
+            worker = threading.Thread(target=self._worker_loop, args=(shard,), name=f"tick-worker-{shard.index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout=5):
+        """ Stop the workers once they finished the batch in hand. Queued ticks are discarded. """
+        self._stop_event.set()
+        for shard in self.shards:
+            shard.close()
+        for worker in self._workers:
+            worker.join(timeout=timeout)
+        self._workers = []
+
+    def drain(self, timeout=None):
+        """ Block until every queued tick has been processed. """
+        return all(shard.wait_idle(timeout) for shard in self.shards)
+
+    def _worker_loop(self, shard):
+        while not self._stop_event.is_set():
+            batch = shard.get_batch(self.max_batch, timeout=0.5)
+            if not batch:
+                continue
+            try:
+                self.process_ticks(batch)
+            except Exception as error:
+                logging.error(f"Error processing tick batch on shard {shard.index}: {error}")
+            finally:
+                shard.task_done(len(batch))
+
+    def metrics(self):
+        """ Queue depth, drop counters and lag per shard. """
+        return [shard.metrics() for shard in self.shards]
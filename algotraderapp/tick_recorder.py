@@ -0,0 +1,360 @@
+import os
+import glob
+import queue
+import struct
+import logging
+import threading
+import numpy as np
+from . import candle_time
+
+# Segment file layout: a fixed header followed by fixed width little endian records
+MAGIC = b'ATTICK'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<6sHIIq')  # magic, version, flags, record size, created (IST epoch seconds)
+HEADER_SIZE = 32
+FLAG_DEPTH = 1
+SEGMENT_SUFFIX = '.ticks'
+DEPTH_LEVELS = 5
+
+# KiteTicker modes, stored as a code so replay restores the fields the tick carried
+MODES = ('ltp', 'quote', 'full')
+
+_BASE_FIELDS = [
+    ('instrument_token', '<u4'),
+    ('batch', '<u4'),  # Sequence of the on_ticks call within the segment
+    ('received', '<i8'),  # Arrival time, IST epoch microseconds
+    ('exchange_timestamp', '<i8'),  # IST epoch seconds, 0 when absent
+    ('last_trade_time', '<i8'),
+    ('mode', 'u1'),
+    ('tradable', 'u1'),
+    ('last_price', '<f8'),
+    ('last_traded_quantity', '<u4'),
+    ('average_traded_price', '<f8'),
+    ('volume_traded', '<u8'),
+    ('total_buy_quantity', '<u8'),
+    ('total_sell_quantity', '<u8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('change', '<f8'),
+    ('oi', '<u8'),
+    ('oi_day_high', '<u8'),
+    ('oi_day_low', '<u8'),
+]
+_DEPTH_FIELDS = [
+    (f'{side}_{field}', kind, (DEPTH_LEVELS,))
+    for side in ('buy', 'sell')
+    for field, kind in (('price', '<f8'), ('quantity', '<u4'), ('orders', '<u4'))
+]
+TICK_DTYPE = np.dtype(_BASE_FIELDS)
+DEPTH_TICK_DTYPE = np.dtype(_BASE_FIELDS + _DEPTH_FIELDS)
+
+_QUANTITY_FIELDS = ('last_traded_quantity', 'average_traded_price', 'volume_traded', 'total_buy_quantity',
+                    'total_sell_quantity', 'change')
+_FULL_FIELDS = ('oi', 'oi_day_high', 'oi_day_low')
+_NO_DEPTH_LEVEL = {'price': 0.0, 'quantity': 0, 'orders': 0}
+
+
+def record_dtype(depth):
+    return DEPTH_TICK_DTYPE if depth else TICK_DTYPE
+
+
+def _epoch_or_zero(value):
+    return candle_time.to_epoch(value) if value else 0
+
+
+def _mode_code(tick):
+    mode = tick.get('mode')
+    if mode in MODES:
+        return MODES.index(mode)
+    # Ticks without a mode (hand written or converted) keep the fields they have
+    if tick.get('exchange_timestamp') or tick.get('depth'):
+        return MODES.index('full')
+    return MODES.index('quote') if 'ohlc' in tick else MODES.index('ltp')
+
+
+def _depth_columns(levels):
+    levels = (list(levels) + [_NO_DEPTH_LEVEL] * DEPTH_LEVELS)[:DEPTH_LEVELS]
+    return ([level.get('price', 0.0) for level in levels], [level.get('quantity', 0) for level in levels],
+            [level.get('orders', 0) for level in levels])
+
+
+def encode_batch(ticks, received, batch, depth=False):
+    """
+    Pack one on_ticks batch into a structured array of records.
+
+    Parameters:
+    - ticks (list): KiteTicker tick dicts.
+    - received (int): Arrival time of the batch, IST epoch microseconds.
+    - batch (int): Sequence number of the batch.
+    - depth (bool): Include the five level market depth.
+    """
+    rows = []
+    for tick in ticks:
+        ohlc = tick.get('ohlc') or {}
+        row = (
+            tick['instrument_token'], batch, received,
+            _epoch_or_zero(tick.get('exchange_timestamp')), _epoch_or_zero(tick.get('last_trade_time')),
+            _mode_code(tick), bool(tick.get('tradable', True)),
+            tick.get('last_price', 0.0), tick.get('last_traded_quantity', 0), tick.get('average_traded_price', 0.0),
+            tick.get('volume_traded', 0), tick.get('total_buy_quantity', 0), tick.get('total_sell_quantity', 0),
+            ohlc.get('open', 0.0), ohlc.get('high', 0.0), ohlc.get('low', 0.0), ohlc.get('close', 0.0),
+            tick.get('change', 0.0), tick.get('oi', 0), tick.get('oi_day_high', 0), tick.get('oi_day_low', 0),
+        )
+        if depth:
+            market_depth = tick.get('depth') or {}
+            row += _depth_columns(market_depth.get('buy', ())) + _depth_columns(market_depth.get('sell', ()))
+        rows.append(row)
+    return np.array(rows, dtype=record_dtype(depth))
+
+
+_FIELD_INDEX = {name: index for index, (name, _) in enumerate(_BASE_FIELDS)}
+_DEPTH_INDEX = {field[0]: len(_BASE_FIELDS) + index for index, field in enumerate(_DEPTH_FIELDS)}
+
+
+def decode_row(row):
+    """ Rebuild the KiteTicker tick dict of a record tuple, with the fields its mode carries. """
+    mode = MODES[row[_FIELD_INDEX['mode']]] if row[_FIELD_INDEX['mode']] < len(MODES) else MODES[0]
+    tick = {
+        'tradable': bool(row[_FIELD_INDEX['tradable']]),
+        'mode': mode,
+        'instrument_token': row[_FIELD_INDEX['instrument_token']],
+        'last_price': row[_FIELD_INDEX['last_price']],
+    }
+    if mode == 'ltp':
+        return tick
+    for field in _QUANTITY_FIELDS:
+        tick[field] = row[_FIELD_INDEX[field]]
+    tick['ohlc'] = {field: row[_FIELD_INDEX[field]] for field in ('open', 'high', 'low', 'close')}
+    if mode == 'full':
+        last_trade_time = row[_FIELD_INDEX['last_trade_time']]
+        tick['last_trade_time'] = candle_time.from_epoch(last_trade_time) if last_trade_time else None
+        for field in _FULL_FIELDS:
+            tick[field] = row[_FIELD_INDEX[field]]
+        exchange_timestamp = row[_FIELD_INDEX['exchange_timestamp']]
+        tick['exchange_timestamp'] = candle_time.from_epoch(exchange_timestamp) if exchange_timestamp else None
+        if len(row) > len(_BASE_FIELDS):
+            tick['depth'] = {side: [{'quantity': quantity, 'price': price, 'orders': orders}
+                                    for price, quantity, orders in zip(row[_DEPTH_INDEX[f'{side}_price']].tolist(),
+                                                                       row[_DEPTH_INDEX[f'{side}_quantity']].tolist(),
+                                                                       row[_DEPTH_INDEX[f'{side}_orders']].tolist())]
+                             for side in ('buy', 'sell')}
+    return tick
+
+
+def decode_record(record):
+    """ Rebuild the KiteTicker tick dict of a single structured record. """
+    return decode_row(record.tolist())
+
+
+def received_epoch_us(value):
+    """ IST epoch microseconds of an arrival datetime. """
+    return candle_time.to_epoch(value) * 1000000 + value.microsecond
+
+
+def received_datetime(epoch_us):
+    """ Aware IST datetime of a recorded arrival time. """
+    seconds, microseconds = divmod(int(epoch_us), 1000000)
+    return candle_time.from_epoch(seconds).replace(microsecond=microseconds, tzinfo=candle_time.IST)
+
+
+class TickRecorder:
+    """
+    Records every tick batch to per day binary segment files.
+
+    record() only copies the batch onto a queue; a background thread packs
+    the ticks into fixed width records and appends them to the segment of the
+    batch's day (`<directory>/<YYYYMMDD>-<n>.ticks`). Every recorder opens a
+    new segment per day, so a restart never appends to a torn record.
+    """
+
+    def __init__(self, directory='tick_data', depth=False, flush_interval=1.0):
+        self.directory = directory
+        self.depth = depth
+        self.dtype = record_dtype(depth)
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self._day = None
+        self._batch = 0
+        self.segment_path = None
+        self.records = 0
+        self.batches = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="tick-recorder", daemon=True)
+                self._thread.start()
+
+    def record(self, ticks, received_at):
+        """ Queue a batch for writing; the tick dicts are copied, processing adds fields to them. """
+        if self._thread is None:
+            self.start()
+        self._queue.put((received_at, [dict(tick) for tick in ticks]))
+
+    def close(self):
+        """ Write the queued batches and close the segment. """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+        self._close_segment()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            stop = False
+            while item is not None:
+                self._write(*item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                stop = True
+            if self._file is not None:
+                self._file.flush()
+            if stop:
+                return
+
+    def _write(self, received_at, ticks):
+        try:
+            day = received_at.strftime('%Y%m%d')
+            if day != self._day:
+                self._open_segment(day, received_at)
+            records = encode_batch(ticks, received_epoch_us(received_at), self._batch, self.depth)
+            self._file.write(records.tobytes())
+            self._batch += 1
+            self.batches += 1
+            self.records += len(records)
+            self.bytes_written += records.nbytes
+        except Exception as error:
+            self.errors += 1
+            logging.error(f"Error recording ticks: {error}")
+
+    def _open_segment(self, day, received_at):
+        self._close_segment()
+        os.makedirs(self.directory, exist_ok=True)
+        sequence = len(glob.glob(os.path.join(self.directory, f'{day}-*{SEGMENT_SUFFIX}')))
+        while True:
+            path = os.path.join(self.directory, f'{day}-{sequence}{SEGMENT_SUFFIX}')
+            try:
+                self._file = open(path, 'xb')
+                break
+            except FileExistsError:
+                sequence += 1
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, FLAG_DEPTH if self.depth else 0, self.dtype.itemsize,
+                             candle_time.to_epoch(received_at))
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+        self.bytes_written += HEADER_SIZE
+        self._day = day
+        self._batch = 0
+        self.segment_path = path
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._day = None
+
+    def metrics(self):
+        return {
+            'segment': self.segment_path,
+            'depth': self.depth,
+            'record_size': self.dtype.itemsize,
+            'records': self.records,
+            'batches': self.batches,
+            'bytes': self.bytes_written,
+            'queued': self._queue.qsize(),
+            'errors': self.errors,
+        }
+
+
+def is_segment(path):
+    """ Whether a file starts with the segment header. """
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def open_segment(path):
+    """
+    Memory map the records of a segment file as a read only structured array.
+
+    A record torn by a crash at the end of the file is left out.
+    """
+    with open(path, 'rb') as file:
+        magic, version, flags, record_size, created = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a version {FORMAT_VERSION} tick segment")
+    dtype = record_dtype(flags & FLAG_DEPTH)
+    if record_size != dtype.itemsize:
+        raise ValueError(f"{path} has {record_size} byte records, expected {dtype.itemsize}")
+    count = (os.path.getsize(path) - HEADER_SIZE) // record_size
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+def day_segments(directory, day):
+    """ Segment files of a day (YYYYMMDD), in recording order. """
+    paths = glob.glob(os.path.join(directory, f'{day}-*{SEGMENT_SUFFIX}'))
+    return sorted(paths, key=lambda path: int(os.path.basename(path)[len(day) + 1:-len(SEGMENT_SUFFIX)]))
+
+
+def recorded_days(directory):
+    """ Days with recorded segments, oldest first. """
+    return sorted({os.path.basename(path).split('-')[0] for path in glob.glob(os.path.join(directory, f'*{SEGMENT_SUFFIX}'))})
+
+
+def iter_day(directory, day, chunk_size=65536):
+    """
+    Iterate a recorded day as structured arrays of at most chunk_size records.
+
+    The chunks are views on the memory mapped segments, nothing is copied
+    until fields are read; use them for analytics, e.g.
+    `chunk['last_price'][chunk['instrument_token'] == token]`.
+    """
+    for path in day_segments(directory, day):
+        records = open_segment(path)
+        for begin in range(0, len(records), chunk_size):
+            yield records[begin:begin + chunk_size]
+
+
+def _segment_paths(path):
+    if os.path.isdir(path):
+        return [segment for day in recorded_days(path) for segment in day_segments(path, day)]
+    return [path]
+
+
+def read_tick_batches(path):
+    """
+    Read recorded batches back as (received_at, ticks) pairs for replay.
+
+    path is a segment file or a recorder directory, whose days are read in
+    order. The ticks are rebuilt as KiteTicker dicts.
+    """
+    return _read_segments(_segment_paths(path))
+
+
+def _read_segments(paths):
+    for segment in paths:
+        records = open_segment(segment)
+        if not len(records):
+            continue
+        # Batches are runs of equal sequence numbers
+        boundaries = np.flatnonzero(np.diff(records['batch'])) + 1
+        for begin, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(records)]):
+            batch = records[begin:end]
+            yield received_datetime(batch['received'][0]), [decode_row(row) for row in batch.tolist()]
@@ -15,5 +15,12 @@ urlpatterns = [
     path('delete_added_trading_instrument',views.delete_added_trading_instrument,name = 'delete_added_trading_instrument'),
     path('callback',views.callback,name = 'callback'),
     path('check_login_status',views.check_login_status,name = 'check_login_status'),
+    path('latency_metrics',views.latency_metrics,name = 'latency_metrics'),
+    path('set_latency_metrics',views.set_latency_metrics,name = 'set_latency_metrics'),
+    path('tick_queue_status',views.tick_queue_status,name = 'tick_queue_status'),
+    path('engine_status',views.engine_status,name = 'engine_status'),
+    path('order_executor_status',views.order_executor_status,name = 'order_executor_status'),
+    path('broker_status',views.broker_status,name = 'broker_status'),
+    path('instrument_master_status',views.instrument_master_status,name = 'instrument_master_status'),
     path('fetch_candle_data',views.fetch_candle_data,name = 'fetch_candle_data')
 ]
@@ -1,16 +1,17 @@
 from django.shortcuts import render
-from .product_setting import mongo_port, mongo_url,mongo_username,mongo_password,mongo_database
+from .product_setting import ENGINE_PROCESSES, BROKER_POOL_SIZE, BROKER_MAX_RETRIES
+from .product_setting import INSTRUMENT_MASTER_DIR, INSTRUMENT_MASTER_REFRESH_TIME
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from django.http import JsonResponse
 from django.http import HttpResponse
-from pymongo import MongoClient
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
 import json
 from kiteconnect import KiteConnect
 import requests
 import os
-import pandas as pd
 import datetime
 from algotraderapp.consumers import ZerodhaWebSocketConsumer 
 import threading
@@ -18,6 +19,14 @@ import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
 from . import run_script
+from . import engine
+from . import candle_store
+from . import candle_query
+from . import log_channels
+from . import latency
+from .broker import BrokerClient
+from . import repository
+from .instrument_master import InstrumentMaster, csv_chunks, iter_rows
 from zoneinfo import ZoneInfo
 import logging
 from django.http import JsonResponse
@@ -32,7 +41,11 @@ login_flag = False
 
 env_path = Path('./.env')
 load_dotenv(dotenv_path=env_path)
-kite = KiteConnect(api_key=os.getenv("api_key"))
+kite = BrokerClient(api_key=os.getenv("api_key"), pool_size=BROKER_POOL_SIZE, max_retries=BROKER_MAX_RETRIES)
+# Trade configuration reads and writes, on the shared MongoDB client
+trade_configurations = repository.TradeConfigurationRepository()
+# Instrument dump, downloaded once per trading day and looked up by token
+instrument_master = InstrumentMaster(kite, directory=INSTRUMENT_MASTER_DIR, refresh_time=INSTRUMENT_MASTER_REFRESH_TIME)
 # Initialize Redis client using Django setting
 # View to add an item
 # Function to start the WebSocket connection
@@ -92,8 +105,15 @@ def access_web_socket(request):
                 # Check if WebSocket handler is already running
                 if ws_handler is None:
                     save_json_to_mongodb(directory=".")
+                    # The cleanup deleted the channel log files, start fresh ones
+                    log_channels.reopen()
                     instrument_details = view_all_added_trading_instrument()
-                    ws_handler = run_script.WebSocketHandler(kite, instrument_details)
+                    if ENGINE_PROCESSES > 1:
+                        # Spread the instruments over worker processes
+                        ws_handler = engine.ShardedEngine(kite, instrument_details, processes=ENGINE_PROCESSES,
+                                                          instrument_master=instrument_master)
+                    else:
+                        ws_handler = run_script.WebSocketHandler(kite, instrument_details, instrument_master=instrument_master)
                     threading.Thread(target=ws_handler.run_websocket).start()
                 else:
                     return JsonResponse({"Websocket Already Running": True})            
@@ -168,24 +188,48 @@ def stop_web_socket(request):
 
 
 
-@api_view(['POST'])
-def download_all_instruments(request):
-    try:
-        # Fetch all instruments
-        instruments = kite.instruments()
+def etag_matches(request, etag):
+    """ Whether the request's If-None-Match names etag, compared weakly. """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    tags = parse_etags(header)
+    return '*' in tags or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags)
+
 
-        # Convert the instruments list to a DataFrame
-        instruments_df = pd.DataFrame(instruments)
-        # Get the current date and time for the filename
-        current_datetime = datetime.datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%Y%m%d_%H%M%S")
-        csv_filename = f'zerodha_instruments_{current_datetime}.csv'
+def not_modified(etag):
+    response = HttpResponse(status=304)
+    response['ETag'] = etag
+    return response
 
-        # Create a HttpResponse object with the appropriate CSV headers
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename={csv_filename}'
 
-        # Write the CSV data to the response
-        instruments_df.to_csv(path_or_buf=response, index=False)
+# CSV of the cached instrument dump, optionally only one exchange or segment
+@api_view(['GET', 'POST'])
+def download_all_instruments(request):
+    try:
+        exchange = request.GET.get('exchange') or request.POST.get('exchange') or None
+        segment = request.GET.get('segment') or request.POST.get('segment') or None
+        snapshot = instrument_master.snapshot()
+        etag = instrument_master.export_etag(snapshot, exchange, segment)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        csv_filename = f"zerodha_instruments_{snapshot.day.strftime('%Y%m%d')}.csv"
+
+        path = None
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            # Compressed once per day and filter, then sent from the file
+            path = instrument_master.export(snapshot, exchange, segment)
+        if path is not None:
+            response = FileResponse(open(path, 'rb'), content_type='text/csv', as_attachment=True, filename=csv_filename)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            # Rows are decoded and written a chunk at a time
+            selection = snapshot.selection(exchange, segment)
+            response = StreamingHttpResponse(csv_chunks(iter_rows(selection)), content_type='text/csv')
+            response['Content-Disposition'] = f'attachment; filename={csv_filename}'
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = 'no-cache'
         return response
     except Exception as error:
         return JsonResponse({"Some Error Occured":True},status = 500)
@@ -200,22 +244,15 @@ def add_trading_instrument(request):
         trade_calculation_percentage= request.POST['trade_calculation_percentage']
         timeframe= request.POST['timeframe']
         trade_side = request.POST.get('trade_side','BOTH')
-        client = MongoClient(f"mongodb://{mongo_username}:{mongo_password}@{mongo_url}:{mongo_port}")
-        database = client[mongo_database]  # Access the database
-        collection = database['tradeconfiguration']  # Replace 'mycollection' with your collection name
-        existing_document = collection.find_one({"instrument_token":instrument_token},{"_id":0})
+        existing_document = trade_configurations.get(instrument_token)
         # Fetch the full instruments list
         if existing_document:
             return JsonResponse({"Existing Instrument Found with Following Details, Please Update using Update API":existing_document})
-        instruments = kite.instruments()
-        instrument_details = {}
-        for single_dict in instruments:
-            if single_dict['instrument_token'] == int(instrument_token):
-                instrument_details = single_dict
+        instrument_details = instrument_master.get(instrument_token)
         if not instrument_details:
             return HttpResponse("No Instrument token {} exists".format(instrument_token))
         instrument_details['expiry'] = str(instrument_details['expiry'])
-        result = collection.insert_one({
+        inserted_id = trade_configurations.insert({
             "lot_size":lot_size,
             "instrument_token":instrument_token,
             "exit_trades_threshold_points":exit_trades_threshold_points,
@@ -224,6 +261,7 @@ def add_trading_instrument(request):
             "instrument_details":instrument_details,
             "trade_side":trade_side
         })
+        reload_running_websocket_config()
         return JsonResponse({
             "lot_size":lot_size,
             "instrument_token":instrument_token,
@@ -232,7 +270,7 @@ def add_trading_instrument(request):
             "timeframe":timeframe,
             "instrument_details":instrument_details,
             "trade_side":trade_side,
-            "insertion_id":str(result.inserted_id)})
+            "insertion_id":str(inserted_id)})
     except Exception as error:
         return JsonResponse({"Some Error Occured":True},status = 500)
     
@@ -242,15 +280,12 @@ def add_trading_instrument(request):
 def view_added_trading_instrument(request):
     try:
         instrument_token = request.POST.get('instrument_token',"")
-        client = MongoClient(f"mongodb://{mongo_username}:{mongo_password}@{mongo_url}:{mongo_port}/")
-        database = client[mongo_database]  # Access the database
-        collection = database['tradeconfiguration']  # Replace 'mycollection' with your collection name
         if instrument_token!="":
-            existing_document = collection.find_one({"instrument_token":instrument_token},{"_id":0})
+            existing_document = trade_configurations.get(instrument_token)
             if not existing_document:
                 return HttpResponse(f"No Instrument Found with {instrument_token} instrument_token",status.HTTP_204_NO_CONTENT)
             return JsonResponse(existing_document)
-        return JsonResponse(list(collection.find({},{"_id":0})),safe = False)
+        return JsonResponse(trade_configurations.list(),safe = False)
     except Exception as error:
         return JsonResponse({"Some Error Occured":True},status = 500)
     
@@ -259,28 +294,18 @@ def view_added_trading_instrument(request):
 def delete_added_trading_instrument(request):
     try:
         instrument_token = request.POST.get('instrument_token',"")
-        client = MongoClient(f"mongodb://{mongo_username}:{mongo_password}@{mongo_url}:{mongo_port}/")
-        database = client[mongo_database]  # Access the database
-        collection = database['tradeconfiguration']  # Replace 'mycollection' with your collection name
         if instrument_token!="":
-            existing_document = collection.find_one({"instrument_token":instrument_token},{"_id":0})
+            existing_document = trade_configurations.get(instrument_token)
             if not existing_document:
                 return HttpResponse(f"No Instrument Found with {instrument_token} instrument_token",status.HTTP_204_NO_CONTENT)
-        database = client[mongo_database]  # Access the database
-        collection = database['tradeconfiguration']  # Replace 'mycollection' with your collection name
-        tradeconfigurationlog_collection = database['tradeconfigurationlog']
-        old_data = collection.find_one({"instrument_token":instrument_token})
-        old_data['old_id'] = str(old_data['_id'])
-        old_data['action'] = 'deletion'
-        old_data['timeofaction'] = str(datetime.datetime.now(ZoneInfo("Asia/Kolkata")))
-        del old_data['_id']
-        tradeconfigurationlog_collection.insert_one(old_data)
-        if old_data["instrument_token"]:
-            result = collection.delete_one({"instrument_token":instrument_token})
+        # The audit entry is written in the background
+        acknowledged, old_data = trade_configurations.delete(instrument_token)
+        if old_data is None:
+            return HttpResponse(f"No Instrument Found with {instrument_token} instrument_token",status.HTTP_204_NO_CONTENT)
         del old_data['instrument_details']
-        del old_data['_id']
         del old_data['old_id']
-        return JsonResponse({"instrument_deleted":result.acknowledged,
+        reload_running_websocket_config()
+        return JsonResponse({"instrument_deleted":acknowledged,
                             "instrument_token":instrument_token,
                             "deleted_data":old_data})
     except Exception as error:
@@ -292,7 +317,6 @@ def delete_added_trading_instrument(request):
 def update_trading_instrument(request):
     try:
         instrument_token = request.POST['instrument_token']
-        client = MongoClient(f"mongodb://{mongo_username}:{mongo_password}@{mongo_url}:{mongo_port}/")
         data = {}
         for key,value in request.POST.items():
             if key not in ["lot_size","instrument_token","exit_trades_threshold_points","trade_calculation_percentage","timeframe","trade_side"]:
@@ -301,25 +325,17 @@ def update_trading_instrument(request):
                 if key =="instrument_token":
                     continue
                 data[key]=value
-        database = client[mongo_database]  # Access the database
-        collection = database['tradeconfiguration']  # Replace 'mycollection' with your collection name
-        tradeconfigurationlog_collection = database['tradeconfigurationlog']
-        old_data = collection.find_one({"instrument_token":instrument_token})
-        old_data['old_id'] = str(old_data['_id'])
-        old_data['action'] = 'updation'
-        old_data['timeofaction'] = str(datetime.datetime.now(ZoneInfo("Asia/Kolkata")))
-        del old_data['_id']
-        tradeconfigurationlog_collection.insert_one(old_data)
-        if data:
-            result = collection.update_one({"instrument_token":instrument_token},{"$set":data})
-            updated_data = collection.find_one({"instrument_token":instrument_token},{"_id":0})
+        # The audit entry is written in the background
+        modified_count, old_data, updated_data = trade_configurations.update(instrument_token, data)
+        if old_data is None:
+            return HttpResponse(f"No Instrument Found with {instrument_token} instrument_token",status.HTTP_204_NO_CONTENT)
         del updated_data['instrument_details']
         del old_data['instrument_details']
-        del old_data['_id']
         del old_data['old_id']
         del old_data['action']
         del old_data['timeofaction']
-        return JsonResponse({"document_modified":result.modified_count,
+        reload_running_websocket_config()
+        return JsonResponse({"document_modified":modified_count,
                             "instrument_token":instrument_token,
                             "updated_data":updated_data,
                             "old_data":old_data})
@@ -363,29 +379,127 @@ def check_login_status(request):
         return JsonResponse({"current_login_status":False})
 
 
+# per stage tick path latency histograms in the Prometheus text format
+@api_view(['GET'])
+def latency_metrics(request):
+    try:
+        snapshots = ws_handler.latency_snapshots() if ws_handler is not None else []
+        return HttpResponse(latency.render_prometheus(snapshots), content_type=latency.PROMETHEUS_CONTENT_TYPE)
+    except Exception as error:
+        return JsonResponse({"Some Error Occurred": str(error)}, status=500)
+
+
+# switch the latency histograms on or off while the WebSocket runs
 @api_view(['POST'])
-def fetch_candle_data(request):
+def set_latency_metrics(request):
     try:
-        # Extract parameters
-        instrument_token = request.POST.get('instrumentToken')
-        interval_minutes = request.POST.get('timeframe')
+        if ws_handler is None:
+            return JsonResponse({"Websocket Not Running": True}, status=status.HTTP_412_PRECONDITION_FAILED)
+        enabled = str(request.POST.get('enabled', 'true')).lower() in ('1', 'true', 'yes', 'on')
+        ws_handler.set_latency_metrics(enabled)
+        return JsonResponse({"latency_metrics": enabled})
+    except Exception as error:
+        return JsonResponse({"Some Error Occurred": str(error)}, status=500)
 
-        # Validate input
-        if not instrument_token or not interval_minutes:
-            return JsonResponse({"error": "instrument_token and timeframe are required"}, status=400)
 
-        # Construct the file path
-        candle_file_path = f"{instrument_token}_{interval_minutes}_minute_candles.json"
+# tick queue depth, drops and lag per worker shard, skipped evaluations per instrument
+@api_view(['GET'])
+def tick_queue_status(request):
+    try:
+        if ws_handler is None:
+            return JsonResponse({"websocket_running": False, "shards": [], "conflation": {}, "candle_scheduler": {},
+                                 "recorder": {}, "broadcast": {}})
+        return JsonResponse({"websocket_running": ws_handler.is_running(), "shards": ws_handler.queue_metrics(),
+                             "conflation": ws_handler.conflation_metrics(),
+                             "candle_scheduler": ws_handler.scheduler_metrics(),
+                             "recorder": ws_handler.recorder_metrics(),
+                             "broadcast": ws_handler.broadcast_metrics()})
+    except Exception as error:
+        return JsonResponse({"Some Error Occurred": str(error)}, status=500)
+
+
+# order executor counters and submit-to-ack latency
+@api_view(['GET'])
+def order_executor_status(request):
+    try:
+        if ws_handler is None:
+            return JsonResponse({"websocket_running": False, "orders": {}})
+        if hasattr(ws_handler, 'shard_status'):
+            orders = {status['shard']: status.get('orders', {}) for status in ws_handler.shard_status()}
+        else:
+            orders = ws_handler.order_metrics()
+        return JsonResponse({"websocket_running": ws_handler.is_running(), "orders": orders})
+    except Exception as error:
+        return JsonResponse({"Some Error Occurred": str(error)}, status=500)
+
+
+# request counters of the broker client used by the views and the single process handler
+@api_view(['GET'])
+def broker_status(request):
+    try:
+        return JsonResponse({"broker": kite.metrics()})
+    except Exception as error:
+        return JsonResponse({"Some Error Occurred": str(error)}, status=500)
+
+
+# day, size and refresh counters of the cached instrument dump
+@api_view(['GET'])
+def instrument_master_status(request):
+    try:
+        return JsonResponse({"instrument_master": instrument_master.metrics()})
+    except Exception as error:
+        return JsonResponse({"Some Error Occurred": str(error)}, status=500)
+
 
-        # Check if the file exists
-        if not os.path.exists(candle_file_path):
-            return JsonResponse({"file_exists": False})
+# status reported by every process of the sharded engine
+@api_view(['GET'])
+def engine_status(request):
+    try:
+        if ws_handler is None:
+            return JsonResponse({"websocket_running": False, "shards": []})
+        if not hasattr(ws_handler, 'shard_status'):
+            return JsonResponse({"websocket_running": ws_handler.is_running(), "sharded": False, "shards": []})
+        return JsonResponse({"websocket_running": ws_handler.is_running(), "sharded": True, "shards": ws_handler.shard_status()})
+    except Exception as error:
+        return JsonResponse({"Some Error Occurred": str(error)}, status=500)
 
-        # Load the JSON data from the file
-        with open(candle_file_path, 'r') as file:
-            candle_data = json.load(file)
 
-        return JsonResponse({"file_exists": True, "candle_data": candle_data})
+# candles of one or more instruments, filtered by from, to, since and limit
+@api_view(['GET', 'POST'])
+def fetch_candle_data(request):
+    try:
+        # Extract parameters, instrumentToken may repeat or hold comma separated tokens
+        params = request.GET.copy()
+        params.update(request.POST)
+        instrument_tokens = [token.strip() for value in params.getlist('instrumentToken') for token in value.split(',') if token.strip()]
+        interval_minutes = params.get('timeframe')
+
+        # Validate input
+        if not instrument_tokens or not interval_minutes:
+            return JsonResponse({"error": "instrument_token and timeframe are required"}, status=400)
+        try:
+            instrument_tokens = list(dict.fromkeys(str(int(token)) for token in instrument_tokens))
+            interval_minutes = str(int(interval_minutes))
+            query = candle_query.CandleQuery.from_params(params)
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=400)
+
+        # Candles of running instruments come from the engine's memory, others from their journal
+        handler = ws_handler
+        histories = {}
+        if handler is not None and hasattr(handler, 'candle_history'):
+            histories = {token: handler.candle_history(token, interval_minutes) for token in instrument_tokens}
+        states = [(token, candle_query.source_state(histories.get(token), candle_query.journal_path(token, interval_minutes)))
+                  for token in instrument_tokens]
+        etag = candle_query.etag(interval_minutes, query, states)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response = HttpResponse(candle_query.render(instrument_tokens, interval_minutes, histories, query),
+                                content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
 
     except FileNotFoundError:
         return JsonResponse({"error": "Candle data file not found"}, status=404)
@@ -397,17 +511,23 @@ def fetch_candle_data(request):
 
 def view_all_added_trading_instrument():
     try:
-        client = MongoClient(f"mongodb://{mongo_username}:{mongo_password}@{mongo_url}:{mongo_port}/")
-        database = client[mongo_database]  # Access the database
-        collection = database['tradeconfiguration']  # Replace 'mycollection' with your collection name
-        return list(collection.find({},{"_id":0}))
+        # The handler resolves the stored instrument details through instrument_master
+        return trade_configurations.list()
     except Exception as error:
         return []    
 
+def reload_running_websocket_config():
+    """ Recompile the instrument table of the running WebSocket handler after a configuration change. """
+    try:
+        with ws_lock:
+            if ws_handler is not None:
+                ws_handler.reload_config(view_all_added_trading_instrument())
+    except Exception as error:
+        logging.error(f"Error reloading trade configuration: {error}")
+
 def save_json_to_mongodb(directory="."):
     try:
-        client = MongoClient(f"mongodb://{mongo_username}:{mongo_password}@{mongo_url}:{mongo_port}/")
-        database = client['CandleData']  # Access the database
+        database = repository.get_database('CandleData')  # Access the database
         collection = database['tradeconfiguration']
         for filename in os.listdir(directory):
             # Check if the file is a JSON file
@@ -416,9 +536,8 @@ def save_json_to_mongodb(directory="."):
                 file_path = os.path.join(directory, filename)
                 
                 try:
-                    # Load the JSON data from the file
-                    with open(file_path, 'r') as file:
-                        data = json.load(file)
+                    # Load the candle journal from the file
+                    data = candle_store.load_candles(file_path)
                     
                     # Get the date from the first record in the JSON file
                     if data:
@@ -438,6 +557,9 @@ def save_json_to_mongodb(directory="."):
                 
                 except Exception as e:
                     print(f"Error processing file {filename}: {e}")
+            elif filename.endswith("_candles.json.npz"):
+                # Sweep cache of a journal, stale once the journal is gone
+                os.remove(os.path.join(directory, filename))
             elif filename.endswith(".txt"):
                 if filename == "requirements.txt":
                     continue